@@ -1,20 +1,39 @@
+import argparse
 import database_setup
-from geoprocessing_service import calcular_distancia, buscar_locais_em_raio, cruzar_dados_local_cidade
+import metricas
+import visao_locais_cidades
+from geoprocessing_service import (calcular_distancia, iterar_locais_com_distancia, buscar_k_mais_proximos,
+                                   cruzar_dados_local_cidade)
 from pprint import pprint
 
 if __name__ == '__main__':
 
+    parser = argparse.ArgumentParser(description="Demonstração do projeto de persistência poliglota.")
+    parser.add_argument("--perfil", action="store_true",
+                        help="Ao final, imprime o tempo de cada etapa e as métricas por backend.")
+    args = parser.parse_args()
+
+    perfil = metricas.PerfilEtapas()
+    if args.perfil:
+        metricas.ativar()
+        metricas.resetar()
+
     print("=====================================================")
     print("    INÍCIO DO PROJETO DE PERSISTÊNCIA POLIGLOTA    ")
     print("=====================================================")
 
     # 1. Configuração e Popularização dos Bancos de Dados
+    perfil.etapa("1. Configurando Bancos de Dados")
     print("\n--- 1. Configurando Bancos de Dados (SQLite e MongoDB) ---")
     # Execute o setup para garantir que os dados e o índice 2dsphere existam
-    database_setup.setup_sqlite()
-    database_setup.setup_mongodb()
+    # (versionado: depois da primeira vez, é apenas uma verificação rápida)
+    tempos_setup = database_setup.garantir_bancos_configurados()
+    print(f"Tempo de setup: SQLite {tempos_setup['sqlite']['ms']} ms | MongoDB {tempos_setup['mongodb']['ms']} ms")
+    # Visão materializada locais + cidade, usada no cruzamento (construída só na primeira vez)
+    visao_locais_cidades.garantir_visao()
 
     # 2. Demonstração de Geoprocessamento: Cálculo de Distância
+    perfil.etapa("2. Teste de Cálculo de Distância")
     print("\n--- 2. Teste de Cálculo de Distância (geopy) ---")
 
     # Ponto A: Praça da Independência (João Pessoa)
@@ -28,6 +47,7 @@ if __name__ == '__main__':
     print(f"-> Distância calculada: {distancia_jp_cg:.2f} km")
 
     # 3. Demonstração de Geoprocessamento: Busca em Raio
+    perfil.etapa("3. Teste de Busca em Raio")
     print("\n--- 3. Teste de Busca em Raio (MongoDB GeoSpatial) ---")
 
     # Buscando locais a 2 km ao redor da Praça da Independência (JP)
@@ -35,20 +55,25 @@ if __name__ == '__main__':
     longitude_busca = -34.861
     raio = 2  # km
 
-    locais_proximos = buscar_locais_em_raio(latitude_busca, longitude_busca, raio)
-
     print(f"Busca Central: ({latitude_busca}, {longitude_busca}) | Raio: {raio} km")
-    print(f"Total de locais encontrados: {len(locais_proximos)}")
 
-    for local in locais_proximos:
-        # Calcula a distância exata com geopy para exibir no resultado
-        local_lat = local['coordenadas']['latitude']
-        local_lon = local['coordenadas']['longitude']
-        dist_exata = calcular_distancia(latitude_busca, longitude_busca, local_lat, local_lon)
+    # Os resultados são consumidos em lotes (streaming), apenas com os campos exibidos,
+    # e a distância de cada local já vem calculada pelo MongoDB ($geoNear)
+    total_encontrados = 0
+    for lote in iterar_locais_com_distancia(latitude_busca, longitude_busca, raio):
+        for local in lote:
+            print(f"  - {local['nome_local']} ({local['cidade']}) | Distância: {local['distancia_km']:.3f} km")
+        total_encontrados += len(lote)
+
+    print(f"Total de locais encontrados: {total_encontrados}")
 
-        print(f"  - {local['nome_local']} ({local['cidade']}) | Distância: {dist_exata:.3f} km")
+    # Os 3 locais mais próximos do ponto, independentemente do raio
+    print(f"\nOs 3 locais mais próximos de ({latitude_busca}, {longitude_busca}):")
+    for local in buscar_k_mais_proximos(latitude_busca, longitude_busca, 3):
+        print(f"  - {local['nome_local']} ({local['cidade']}) | Distância: {local['distancia_km']:.3f} km")
 
     # 4. Demonstração de Consulta Poliglota
+    perfil.etapa("4. Teste de Cruzamento de Dados")
     print("\n--- 4. Teste de Cruzamento de Dados (MongoDB + SQLite) ---")
 
     nome_local_busca = "Praça do Marco Zero"
@@ -70,6 +95,12 @@ if __name__ == '__main__':
     else:
         print(f"Erro na busca: {dados_cruzados['erro']}")
 
+    perfil.encerrar()
+
     print("\n=====================================================")
     print("    FIM DA EXECUÇÃO DO PROJETO    ")
-    print("=====================================================")
\ No newline at end of file
+    print("=====================================================")
+
+    if args.perfil:
+        print("\n--- Perfil da Execução (etapas e chamadas por backend) ---")
+        print(metricas.relatorio_texto())
\ No newline at end of file
@@ -0,0 +1,170 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pymongo import AsyncMongoClient
+from pymongo.errors import OperationFailure
+
+import geoprocessing_service
+import visao_locais_cidades
+from geoprocessing_service import (MONGO_URI, DB_NAME, COLLECTION_NAME, CACHE_CIDADES, filtro_raio,
+                                   _montar_dados_cruzados)
+from radius_cache import CacheRaios
+
+# --- Limites de Concorrência ---
+# Máximo de consultas simultâneas ao MongoDB por instância do serviço
+MAX_CONSULTAS_SIMULTANEAS = 32
+# Threads do executor dedicado ao SQLite (que é bloqueante)
+MAX_WORKERS_SQLITE = 4
+
+
+class GeoprocessamentoAsync:
+    """
+    Versão assíncrona do geoprocessing_service para camadas web que
+    disparam muitas buscas por requisição.
+
+    O MongoDB é acessado com o driver assíncrono do PyMongo
+    (AsyncMongoClient) e o SQLite roda em um ThreadPoolExecutor limitado.
+    Deve ser criado e usado dentro do mesmo event loop, de preferência
+    como gerenciador de contexto:
+
+        async with GeoprocessamentoAsync() as servico:
+            locais = await servico.buscar_locais_em_raio(-7.115, -34.861, 2)
+    """
+
+    def __init__(self, mongo_uri=MONGO_URI, max_consultas=MAX_CONSULTAS_SIMULTANEAS,
+                 max_workers_sqlite=MAX_WORKERS_SQLITE):
+        self._client = AsyncMongoClient(mongo_uri, maxPoolSize=max_consultas)
+        self._collection = self._client[DB_NAME][COLLECTION_NAME]
+        self._visao = self._client[DB_NAME][visao_locais_cidades.COLLECTION_VISAO]
+        self._semaforo = asyncio.Semaphore(max_consultas)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers_sqlite,
+                                            thread_name_prefix="sqlite-async")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.fechar()
+
+    async def fechar(self):
+        """Encerra o cliente MongoDB e o executor do SQLite."""
+        await self._client.close()
+        self._executor.shutdown(wait=False)
+
+    async def _no_executor(self, funcao, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, funcao, *args)
+
+    # ------------------------------------------------------------------
+    # Espelhos das funções síncronas
+    # ------------------------------------------------------------------
+    async def buscar_locais_em_raio(self, latitude_central, longitude_central, raio_km):
+        """Equivalente assíncrono de geoprocessing_service.buscar_locais_em_raio()."""
+        if geoprocessing_service.GEO_BACKEND != "mongo":
+            # Backends "memoria" e "sqlite": consulta local (bloqueante) no executor
+            return await self._no_executor(geoprocessing_service.buscar_locais_em_raio,
+                                           latitude_central, longitude_central, raio_km)
+
+        async with self._semaforo:
+            try:
+                cursor = self._collection.find(filtro_raio(latitude_central, longitude_central, raio_km))
+                return await cursor.to_list(None)
+            except OperationFailure as e:
+                print(f"ERRO: Verifique se o índice '2dsphere' foi criado no MongoDB. Erro: {e}")
+                return []
+
+    async def cruzar_dados_local_cidade(self, nome_local):
+        """Equivalente assíncrono de geoprocessing_service.cruzar_dados_local_cidade()."""
+        if geoprocessing_service.GEO_BACKEND == "sqlite":
+            return await self._no_executor(geoprocessing_service.cruzar_dados_local_cidade, nome_local)
+
+        if visao_locais_cidades.VISAO_ATIVA:
+            # Leitura única na visão materializada (cidade já embutida no local)
+            async with self._semaforo:
+                local_visao = await self._visao.find_one({"nome_local": nome_local}, {'_id': False})
+            if local_visao is not None:
+                cidade_info = local_visao.pop("cidade_info", None)
+                return _montar_dados_cruzados(local_visao, visao_locais_cidades.linha_cidade(cidade_info))
+
+        async with self._semaforo:
+            local_mongo = await self._collection.find_one({"nome_local": nome_local}, {'_id': False})
+
+        if not local_mongo:
+            return {"erro": f"Local '{nome_local}' não encontrado no MongoDB."}
+
+        cidade_sqlite = await self._no_executor(CACHE_CIDADES.por_nome, local_mongo.get("cidade"))
+        return _montar_dados_cruzados(local_mongo, cidade_sqlite)
+
+    async def buscar_locais_em_varios_raios(self, consultas):
+        """
+        Executa várias buscas por raio concorrentemente (limitadas pelo
+        semáforo do serviço).
+
+        Args:
+            consultas (list[tuple[float, float, float]]): (lat, lon, raio_km) de cada busca.
+
+        Returns:
+            list[list]: Resultados de cada busca, na ordem das consultas.
+        """
+        return await asyncio.gather(*(self.buscar_locais_em_raio(lat, lon, raio) for lat, lon, raio in consultas))
+
+
+# ----------------------------------------------------------------------
+# Benchmark: vazão síncrona (serial) x assíncrona
+# ----------------------------------------------------------------------
+def _consultas_benchmark(quantidade, raio_km=2.0):
+    """Centros espalhados ao redor de João Pessoa, Recife e Campina Grande."""
+    centros = [(-7.11532, -34.861), (-8.0614, -34.8715), (-7.2285, -35.8817)]
+    return [(centros[i % len(centros)][0] + (i % 10) * 0.001, centros[i % len(centros)][1] + (i % 7) * 0.001, raio_km)
+            for i in range(quantidade)]
+
+
+async def _executar_async(consultas, nomes, max_consultas):
+    async with GeoprocessamentoAsync(max_consultas=max_consultas) as servico:
+        inicio = time.perf_counter()
+        await servico.buscar_locais_em_varios_raios(consultas)
+        await asyncio.gather(*(servico.cruzar_dados_local_cidade(nome) for nome in nomes))
+        return time.perf_counter() - inicio
+
+
+def executar_benchmark(quantidade=500, max_consultas=MAX_CONSULTAS_SIMULTANEAS):
+    """
+    Compara a vazão (operações/s) de buscas por raio + cruzamentos entre o
+    caminho síncrono (laço serial) e o assíncrono, e a das buscas por raio
+    em lote com threads (buscar_locais_em_varios_raios). Requer o MongoDB rodando.
+    """
+    consultas = _consultas_benchmark(quantidade)
+    nomes = ["Praça da Independência", "Estação Ciência", "Praça do Marco Zero", "Museu da Cidade"]
+    nomes = [nomes[i % len(nomes)] for i in range(quantidade)]
+    total_operacoes = len(consultas) + len(nomes)
+
+    # Os centros das consultas são quase iguais: com o cache de círculos, o caminho síncrono
+    # seria medido por acertos no cache e o assíncrono (direto no MongoDB) não
+    cache_raios = geoprocessing_service.CACHE_RAIOS
+    geoprocessing_service.CACHE_RAIOS = CacheRaios(ativo=False)
+    try:
+        inicio = time.perf_counter()
+        for lat, lon, raio in consultas:
+            geoprocessing_service.buscar_locais_em_raio(lat, lon, raio)
+        for nome in nomes:
+            geoprocessing_service.cruzar_dados_local_cidade(nome)
+        tempo_sync = time.perf_counter() - inicio
+
+        tempo_async = asyncio.run(_executar_async(consultas, nomes, max_consultas))
+        lote = geoprocessing_service.buscar_locais_em_varios_raios(consultas)
+    finally:
+        geoprocessing_service.CACHE_RAIOS = cache_raios
+
+    return {
+        "operacoes": total_operacoes,
+        "max_consultas_simultaneas": max_consultas,
+        "sync_ops_por_segundo": round(total_operacoes / tempo_sync, 1),
+        "async_ops_por_segundo": round(total_operacoes / tempo_async, 1),
+        "ganho": round(tempo_sync / tempo_async, 2),
+        "lote_threads_buscas_por_segundo": lote["estatisticas"]["consultas_por_segundo"],
+    }
+
+
+if __name__ == '__main__':
+    print(json.dumps(executar_benchmark(), indent=2))
@@ -0,0 +1,366 @@
+import argparse
+import json
+import math
+import time
+from collections import Counter
+
+import numpy as np
+from bson import ObjectId
+from pymongo import UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+import metricas
+import mongo_client
+import snapshot_locais
+import sqlite_pool
+import visao_locais_cidades
+from database_setup import MONGO_URI, DB_NAME, COLLECTION_NAME, SQLITE_DB
+from geoprocessing_service import _distancia_great_circle_km
+
+# --- Configurações da Atribuição de Locais às Cidades ---
+# Fora da extensão de todas as cidades, o local só é atribuído ao centro mais próximo até esta distância
+DISTANCIA_MAXIMA_KM = 50.0
+# Locais lidos e atribuídos por vez
+TAMANHO_LOTE_ATRIBUICAO = 200000
+# Aresta (graus) dos blocos de lat/lon: cada bloco é comparado apenas com as cidades próximas dele
+TAMANHO_BLOCO_GRAUS = 1.0
+# Máximo de _ids por UpdateMany nas correções
+TAMANHO_LOTE_CORRECAO = 10000
+# Quantidade de trocas (cidade atual -> atribuída) listadas no relatório
+TROCAS_NO_RELATORIO = 20
+# Locais em conflito com a chave única (nome_local, cidade) listados no relatório
+CONFLITOS_NO_RELATORIO = 100
+
+_KM_POR_GRAU = 111.195
+
+
+def _lon_no_intervalo(longitudes, inicio, largura):
+    """Longitude dentro de [inicio, inicio + largura] (graus), dando a volta no antimeridiano."""
+    return np.mod(longitudes - inicio, 360.0) <= largura
+
+
+# ----------------------------------------------------------------------
+# 1. Cidades com coordenadas (tabela CIDADES_GEO)
+# ----------------------------------------------------------------------
+def gravar_centro_cidade(conn, cidade_id, latitude, longitude, extensao=None):
+    """
+    Grava (ou substitui) o centro e a extensão opcional (lat_min, lat_max,
+    lon_min, lon_max) de uma cidade, na transação da conexão informada.
+    """
+    lat_min, lat_max, lon_min, lon_max = extensao or (None, None, None, None)
+    conn.execute("INSERT OR REPLACE INTO CIDADES_GEO VALUES (?, ?, ?, ?, ?, ?, ?)",
+                 (cidade_id, latitude, longitude, lat_min, lat_max, lon_min, lon_max))
+
+
+class CidadesGeo:
+    """
+    Centros e extensões das cidades de CIDADES_GEO em arrays NumPy, com a
+    atribuição vetorizada de pontos à cidade que os contém ou mais próxima.
+    """
+
+    def __init__(self, linhas, distancia_maxima_km=DISTANCIA_MAXIMA_KM):
+        """
+        Args:
+            linhas (list): (nome, latitude, longitude, lat_min, lat_max, lon_min, lon_max) de cada cidade.
+        """
+        self.distancia_maxima_km = distancia_maxima_km
+        self.nomes = [linha[0] for linha in linhas]
+        # None (sem extensão) vira NaN: as comparações com NaN são sempre falsas
+        colunas = np.array([linha[1:] for linha in linhas], dtype=np.float64).reshape(-1, 6)
+        self.latitudes, self.longitudes = colunas[:, 0], colunas[:, 1]
+        self.lat_min, self.lat_max = colunas[:, 2], colunas[:, 3]
+        self.lon_min = colunas[:, 4]
+        self.largura_lon = np.mod(colunas[:, 5] - colunas[:, 4], 360.0)
+
+    @classmethod
+    def do_sqlite(cls, caminho_db=SQLITE_DB, distancia_maxima_km=DISTANCIA_MAXIMA_KM):
+        with sqlite_pool.conexao(caminho_db) as conn:
+            linhas = conn.execute("SELECT c.nome, g.latitude, g.longitude, g.lat_min, g.lat_max, g.lon_min, g.lon_max "
+                                  "FROM CIDADES_GEO g JOIN CIDADES c ON c.id = g.cidade_id ORDER BY c.id").fetchall()
+        return cls(linhas, distancia_maxima_km)
+
+    def __len__(self):
+        return len(self.nomes)
+
+    def _candidatas(self, lat_inicio, lon_inicio, tamanho):
+        """Cidades cujo centro está a até distancia_maxima_km do bloco ou cuja extensão o intersecta."""
+        margem_lat = self.distancia_maxima_km / _KM_POR_GRAU
+        lat_mais_alta = min(max(abs(lat_inicio), abs(lat_inicio + tamanho)) + margem_lat, 90.0)
+        cosseno = math.cos(math.radians(lat_mais_alta))
+        margem_lon = 180.0 if cosseno < 1e-6 else min(self.distancia_maxima_km / (_KM_POR_GRAU * cosseno), 180.0)
+
+        perto = ((self.latitudes >= lat_inicio - margem_lat) & (self.latitudes <= lat_inicio + tamanho + margem_lat)
+                 & _lon_no_intervalo(self.longitudes, lon_inicio - margem_lon, tamanho + 2 * margem_lon))
+        intersecta = ((self.lat_max >= lat_inicio) & (self.lat_min <= lat_inicio + tamanho)
+                      & (_lon_no_intervalo(self.lon_min, lon_inicio, tamanho)
+                         | _lon_no_intervalo(np.float64(lon_inicio), self.lon_min, self.largura_lon)))
+        return np.flatnonzero(perto | intersecta)
+
+    def atribuir(self, latitudes, longitudes):
+        """
+        Atribui cada ponto à cidade cuja extensão o contém (a de centro mais
+        próximo, se houver mais de uma) ou, fora de todas as extensões, à
+        cidade de centro mais próximo até distancia_maxima_km.
+
+        Returns:
+            tuple: (índices em self.nomes, -1 = sem cidade; distâncias ao centro em km;
+            máscara dos pontos contidos na extensão da cidade atribuída).
+        """
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        indices = np.full(len(latitudes), -1, dtype=np.intp)
+        distancias = np.full(len(latitudes), np.inf)
+        contidos = np.zeros(len(latitudes), dtype=bool)
+        if not len(latitudes) or not len(self):
+            return indices, distancias, contidos
+
+        # Agrupa os pontos por bloco de lat/lon e compara cada bloco só com as cidades candidatas
+        bloco_lat = np.floor((latitudes + 90.0) / TAMANHO_BLOCO_GRAUS).astype(np.int64)
+        bloco_lon = np.floor(np.mod(longitudes + 180.0, 360.0) / TAMANHO_BLOCO_GRAUS).astype(np.int64)
+        chaves = bloco_lat * 1_000_000 + bloco_lon
+        ordem = np.argsort(chaves, kind="stable")
+        inicios = np.flatnonzero(np.r_[True, chaves[ordem][1:] != chaves[ordem][:-1]])
+
+        for inicio, fim in zip(inicios, np.r_[inicios[1:], len(ordem)]):
+            posicoes = ordem[inicio:fim]
+            primeira = posicoes[0]
+            candidatas = self._candidatas(bloco_lat[primeira] * TAMANHO_BLOCO_GRAUS - 90.0,
+                                          bloco_lon[primeira] * TAMANHO_BLOCO_GRAUS - 180.0, TAMANHO_BLOCO_GRAUS)
+            if not len(candidatas):
+                continue
+
+            lat, lon = latitudes[posicoes][:, None], longitudes[posicoes][:, None]
+            distancia = _distancia_great_circle_km(lat, lon, self.latitudes[candidatas], self.longitudes[candidatas])
+            dentro = ((lat >= self.lat_min[candidatas]) & (lat <= self.lat_max[candidatas])
+                      & _lon_no_intervalo(lon, self.lon_min[candidatas], self.largura_lon[candidatas]))
+
+            # Cidades que contêm o ponto vêm antes de qualquer outra; entre elas, vale o centro mais próximo
+            melhor = np.argmin(np.where(dentro, distancia, distancia + 1e9), axis=1)
+            linhas = np.arange(len(posicoes))
+            distancia_melhor, dentro_melhor = distancia[linhas, melhor], dentro[linhas, melhor]
+            valido = dentro_melhor | (distancia_melhor <= self.distancia_maxima_km)
+
+            indices[posicoes[valido]] = candidatas[melhor[valido]]
+            distancias[posicoes[valido]] = distancia_melhor[valido]
+            contidos[posicoes[valido]] = dentro_melhor[valido]
+        return indices, distancias, contidos
+
+
+@metricas.instrumentar("mongodb", operacao="atribuicao.estimar_centros")
+def estimar_centros_pelos_locais(caminho_db=SQLITE_DB):
+    """
+    Para as cidades sem coordenadas, grava como centro a média das
+    coordenadas dos locais já cadastrados com o nome delas (agregação no
+    MongoDB). A extensão não é estimada: locais com a cidade errada a
+    ampliariam indevidamente.
+
+    Returns:
+        list[str]: Cidades que receberam um centro.
+    """
+    collection = mongo_client.obter_colecao(MONGO_URI, DB_NAME, COLLECTION_NAME)
+    medias = {grupo["_id"]: grupo for grupo in collection.aggregate([
+        {"$group": {"_id": "$cidade", "latitude": {"$avg": "$coordenadas.latitude"},
+                    "longitude": {"$avg": "$coordenadas.longitude"}}}])}
+
+    estimadas = []
+    with sqlite_pool.conexao(caminho_db) as conn:
+        sem_centro = conn.execute("SELECT c.id, c.nome FROM CIDADES c LEFT JOIN CIDADES_GEO g ON g.cidade_id = c.id "
+                                  "WHERE g.cidade_id IS NULL").fetchall()
+        for cidade_id, nome in sem_centro:
+            media = medias.get(nome)
+            if media and media["latitude"] is not None and media["longitude"] is not None:
+                gravar_centro_cidade(conn, cidade_id, media["latitude"], media["longitude"])
+                estimadas.append(nome)
+    return estimadas
+
+
+# ----------------------------------------------------------------------
+# 2. Leitura dos locais em lotes (MongoDB ou snapshot colunar)
+# ----------------------------------------------------------------------
+def _lotes_mongodb(tamanho_lote):
+    """Lotes (ids, cidades atuais, latitudes, longitudes) lidos da collection com projeção mínima."""
+    collection = mongo_client.obter_colecao(MONGO_URI, DB_NAME, COLLECTION_NAME)
+    cursor = collection.find({}, {"cidade": 1, "coordenadas.latitude": 1, "coordenadas.longitude": 1},
+                             batch_size=min(tamanho_lote, 10000))
+    lote = []
+    for documento in cursor:
+        coordenadas = documento.get("coordenadas", {})
+        if coordenadas.get("latitude") is None or coordenadas.get("longitude") is None:
+            continue
+        lote.append((documento["_id"], documento.get("cidade"), coordenadas["latitude"], coordenadas["longitude"]))
+        if len(lote) >= tamanho_lote:
+            yield _colunas(lote)
+            lote = []
+    if lote:
+        yield _colunas(lote)
+
+
+def _colunas(lote):
+    ids, cidades, latitudes, longitudes = zip(*lote)
+    return (list(ids), np.array(cidades, dtype=object),
+            np.array(latitudes, dtype=np.float64), np.array(longitudes, dtype=np.float64))
+
+
+def _lotes_snapshot(tamanho_lote, diretorio):
+    """Lotes lidos direto das colunas do snapshot (sem decodificar documentos BSON)."""
+    snapshot = snapshot_locais.carregar(diretorio)
+    nomes = np.array(snapshot.cidades + [None], dtype=object)  # cidade_id -1 -> None
+    for inicio in range(0, len(snapshot), tamanho_lote):
+        fim = min(inicio + tamanho_lote, len(snapshot))
+        ids = [ObjectId(linha.tobytes()) for linha in snapshot.ids[inicio:fim]]
+        yield (ids, nomes[np.asarray(snapshot.cidade_ids[inicio:fim])],
+               np.asarray(snapshot.latitudes[inicio:fim]), np.asarray(snapshot.longitudes[inicio:fim]))
+
+
+# ----------------------------------------------------------------------
+# 3. Correções (UpdateMany em lote) e execução completa
+# ----------------------------------------------------------------------
+def _corrigir_individualmente(collection, ids, nome):
+    """
+    Após um E11000 no UpdateMany, grava os ids restantes um a um (UpdateOne
+    não ordenado), para que só os locais em conflito com a chave única
+    (nome_local, cidade) fiquem de fora.
+
+    Returns:
+        tuple: (ids com a nova cidade, documentos alterados aqui, conflitos).
+    """
+    # O UpdateMany interrompido pode ter alterado parte dos ids
+    alterados = [documento["_id"] for documento in collection.find({"_id": {"$in": ids}, "cidade": nome}, {"_id": 1})]
+    ja_alterados = set(alterados)
+    pendentes = [_id for _id in ids if _id not in ja_alterados]
+    if not pendentes:
+        return alterados, 0, []
+
+    falhas = {}
+    try:
+        modificados = collection.bulk_write([UpdateOne({"_id": _id}, {"$set": {"cidade": nome}}) for _id in pendentes],
+                                            ordered=False).modified_count
+    except BulkWriteError as e:
+        modificados = e.details.get("nModified", 0)
+        falhas = {erro["index"]: erro.get("errmsg", "") for erro in e.details.get("writeErrors", [])}
+    alterados += [_id for posicao, _id in enumerate(pendentes) if posicao not in falhas]
+    conflitos = [{"_id": str(pendentes[posicao]), "cidade": nome, "erro": mensagem}
+                 for posicao, mensagem in falhas.items()]
+    return alterados, modificados, conflitos
+
+
+def _corrigir(correcoes):
+    """
+    Grava as novas cidades: um UpdateMany({_id: {$in: [...]}}) por cidade e
+    lote de ids, na collection de locais e na visão materializada. Locais
+    que colidem com a chave única (nome_local, cidade) são listados como
+    conflitos e não interrompem as demais correções.
+
+    Returns:
+        tuple: (documentos alterados, conflitos).
+    """
+    collection = mongo_client.obter_colecao(MONGO_URI, DB_NAME, COLLECTION_NAME)
+    gravados, conflitos = 0, []
+    try:
+        for nome, ids in correcoes.items():
+            for inicio in range(0, len(ids), TAMANHO_LOTE_CORRECAO):
+                lote = ids[inicio:inicio + TAMANHO_LOTE_CORRECAO]
+                try:
+                    resultado = collection.bulk_write(
+                        [UpdateMany({"_id": {"$in": lote}}, {"$set": {"cidade": nome}})], ordered=False)
+                    gravados += resultado.modified_count
+                    alterados = lote
+                except BulkWriteError as e:
+                    gravados += e.details.get("nModified", 0)
+                    alterados, modificados, conflitos_lote = _corrigir_individualmente(collection, lote, nome)
+                    gravados += modificados
+                    conflitos += conflitos_lote
+                    metricas.registrar_erro("atribuicao.executar", "mongodb")
+                visao_locais_cidades.registrar_troca_de_cidade(alterados, nome)
+    except PyMongoError as e:
+        # Falha de conexão/servidor: as correções já gravadas continuam no relatório
+        print(f"ERRO: Falha ao gravar as correções de cidade. Erro: {e}")
+        metricas.registrar_erro("atribuicao.executar", "mongodb")
+    return gravados, conflitos
+
+
+@metricas.instrumentar("numpy", operacao="atribuicao.executar", itens=lambda relatorio: relatorio["locais"])
+def executar_atribuicao(aplicar=False, modo="invalidas", fonte="mongodb", tamanho_lote=TAMANHO_LOTE_ATRIBUICAO,
+                        distancia_maxima_km=DISTANCIA_MAXIMA_KM, diretorio_snapshot=snapshot_locais.DIRETORIO_SNAPSHOT):
+    """
+    Atribui todos os locais à cidade que os contém ou mais próxima e
+    compara com a cidade cadastrada. Divergências são classificadas em
+    'ausente' (sem cidade), 'desconhecida' (nome que não existe em CIDADES,
+    ex: erro de digitação) e 'diferente' (outra cidade cadastrada).
+
+    Args:
+        aplicar (bool): Grava as correções (padrão: apenas relatório).
+        modo (str): "invalidas" corrige só 'ausente'/'desconhecida'; "todas" corrige também 'diferente'.
+        fonte (str): "mongodb" (cursor em lotes) ou "snapshot" (colunas de snapshot_locais).
+
+    Returns:
+        dict: Relatório com contagens, trocas mais comuns, correções gravadas, conflitos e vazão.
+    """
+    inicio = time.perf_counter()
+    cidades = CidadesGeo.do_sqlite(distancia_maxima_km=distancia_maxima_km)
+    if not len(cidades):
+        print("AVISO: nenhuma cidade tem coordenadas em CIDADES_GEO (use --estimar-centros).")
+    with sqlite_pool.conexao(SQLITE_DB) as conn:
+        cadastradas = {linha[0] for linha in conn.execute("SELECT nome FROM CIDADES")}
+    nomes = np.array(cidades.nomes + [None], dtype=object)  # índice -1 -> None
+
+    tipos_corrigidos = ("ausente", "desconhecida") if modo == "invalidas" else ("ausente", "desconhecida", "diferente")
+    contagem = Counter()
+    trocas = Counter()
+    correcoes = {}
+    total = 0
+    lotes = _lotes_snapshot(tamanho_lote, diretorio_snapshot) if fonte == "snapshot" else _lotes_mongodb(tamanho_lote)
+
+    for ids, atuais, latitudes, longitudes in lotes:
+        total += len(ids)
+        indices, _, contidos = cidades.atribuir(latitudes, longitudes)
+        atribuidas = nomes[indices]
+        contagem["sem_cidade_proxima"] += int(np.count_nonzero(indices < 0))
+        contagem["contidos_na_extensao"] += int(np.count_nonzero(contidos))
+
+        for posicao in np.flatnonzero((indices >= 0) & (atuais != atribuidas)).tolist():
+            atual, nova = atuais[posicao], atribuidas[posicao]
+            tipo = "ausente" if not atual else ("desconhecida" if atual not in cadastradas else "diferente")
+            contagem[tipo] += 1
+            trocas[(atual, nova)] += 1
+            if tipo in tipos_corrigidos:
+                correcoes.setdefault(nova, []).append(ids[posicao])
+
+    corrigidos, conflitos = 0, []
+    if aplicar and correcoes:
+        corrigidos, conflitos = _corrigir(correcoes)
+
+    segundos = time.perf_counter() - inicio
+    return {
+        "locais": total,
+        "cidades_com_coordenadas": len(cidades),
+        "sem_cidade_proxima": contagem["sem_cidade_proxima"],
+        "contidos_na_extensao": contagem["contidos_na_extensao"],
+        "divergencias": {tipo: contagem[tipo] for tipo in ("ausente", "desconhecida", "diferente")},
+        "trocas_mais_comuns": [{"atual": atual, "atribuida": nova, "locais": quantidade}
+                               for (atual, nova), quantidade in trocas.most_common(TROCAS_NO_RELATORIO)],
+        "a_corrigir": sum(len(ids) for ids in correcoes.values()),
+        "corrigidos": corrigidos,
+        "conflitos": len(conflitos),
+        "locais_em_conflito": conflitos[:CONFLITOS_NO_RELATORIO],
+        "segundos": round(segundos, 3),
+        "locais_por_segundo": round(total / segundos, 1) if segundos else 0.0,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Atribui os locais à cidade que os contém ou mais próxima.")
+    parser.add_argument("--aplicar", action="store_true", help="Grava as correções (padrão: só o relatório).")
+    parser.add_argument("--modo", choices=["invalidas", "todas"], default="invalidas",
+                        help="invalidas: só locais sem cidade ou com cidade inexistente; todas: qualquer divergência.")
+    parser.add_argument("--fonte", choices=["mongodb", "snapshot"], default="mongodb")
+    parser.add_argument("--distancia-maxima", type=float, default=DISTANCIA_MAXIMA_KM, help="Em km.")
+    parser.add_argument("--lote", type=int, default=TAMANHO_LOTE_ATRIBUICAO)
+    parser.add_argument("--estimar-centros", action="store_true",
+                        help="Antes, estima o centro das cidades sem coordenadas pela média dos seus locais.")
+    args = parser.parse_args()
+
+    if args.estimar_centros:
+        print(f"Centros estimados: {estimar_centros_pelos_locais()}")
+    print(json.dumps(executar_atribuicao(args.aplicar, args.modo, args.fonte, args.lote, args.distancia_maxima),
+                     indent=2, ensure_ascii=False))
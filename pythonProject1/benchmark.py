@@ -0,0 +1,346 @@
+import argparse
+import contextlib
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+import numpy as np
+
+import buffer_locais
+import bulk_loader
+import database_setup
+import geoprocessing_service
+import mongo_client
+import sqlite_pool
+import visao_locais_cidades
+from city_cache import CacheCidades
+from radius_cache import CacheRaios
+
+# --- Configurações do Benchmark ---
+SEMENTE_PADRAO = 42
+DB_NAME_BENCHMARK = "poliglota_geoproj_benchmark"
+RAIOS_KM = (0.5, 2.0, 10.0)
+# Peso relativo de locais por cidade em cada classe de densidade
+DENSIDADES = {"alta": 6, "media": 3, "baixa": 1}
+DISPERSAO_KM = 5.0      # desvio padrão da distância dos locais ao centro da cidade
+LIMITE_REGRESSAO = 0.20  # aumento relativo do p95 considerado regressão na comparação
+# Status do buffer de escrita que contam como gravação bem-sucedida
+STATUS_SUCESSO_BUFFER = {"inserido", "atualizado", "inalterado"}
+
+# Extensão aproximada do território brasileiro (lat/lon)
+LATITUDE_MIN, LATITUDE_MAX = -33.7, 5.3
+LONGITUDE_MIN, LONGITUDE_MAX = -73.9, -34.8
+UFS = ["AC", "AL", "AM", "AP", "BA", "CE", "DF", "ES", "GO", "MA", "MG", "MS", "MT", "PA", "PB", "PE", "PI",
+       "PR", "RJ", "RN", "RO", "RR", "RS", "SC", "SE", "SP", "TO"]
+KM_POR_GRAU = 111.32
+
+
+# ----------------------------------------------------------------------
+# 1. Gerador de dados sintéticos (reprodutível pela semente)
+# ----------------------------------------------------------------------
+def gerar_cidades(quantidade, semente=SEMENTE_PADRAO):
+    """
+    Gera cidades sintéticas com centro dentro do Brasil e uma classe de densidade.
+
+    Returns:
+        list[dict]: Cidades com nome, estado, populacao, latitude, longitude e densidade.
+    """
+    rng = np.random.default_rng(semente)
+    classes = list(DENSIDADES)
+    return [
+        {
+            "nome": f"Cidade Sintética {i:05d}",
+            "estado": UFS[int(rng.integers(len(UFS)))],
+            "populacao": int(rng.integers(5_000, 3_000_000)),
+            "latitude": float(rng.uniform(LATITUDE_MIN, LATITUDE_MAX)),
+            "longitude": float(rng.uniform(LONGITUDE_MIN, LONGITUDE_MAX)),
+            "densidade": classes[i % len(classes)],
+        }
+        for i in range(quantidade)
+    ]
+
+
+def gerar_locais(quantidade, cidades, semente=SEMENTE_PADRAO, dispersao_km=DISPERSAO_KM):
+    """
+    Gera `quantidade` locais distribuídos entre as cidades proporcionalmente
+    ao peso da classe de densidade, espalhados (normal) ao redor do centro.
+
+    Yields:
+        dict: Documentos no formato de 'locais_geo'.
+    """
+    rng = np.random.default_rng(semente + 1)
+    pesos = np.array([DENSIDADES[cidade["densidade"]] for cidade in cidades], dtype=np.float64)
+    indices_cidade = rng.choice(len(cidades), size=quantidade, p=pesos / pesos.sum())
+    deslocamentos = rng.normal(0.0, dispersao_km, size=(quantidade, 2)) / KM_POR_GRAU
+
+    for i, (indice, (d_lat, d_lon)) in enumerate(zip(indices_cidade, deslocamentos)):
+        cidade = cidades[indice]
+        lat = float(np.clip(cidade["latitude"] + d_lat, -90, 90))
+        lon = cidade["longitude"] + d_lon / max(math.cos(math.radians(lat)), 1e-6)
+        yield bulk_loader.montar_documento_local(f"Local Sintético {i:08d}", cidade["nome"], lat,
+                                                 float(lon), "Gerado pelo benchmark.")
+
+
+# ----------------------------------------------------------------------
+# 2. Medição de latência
+# ----------------------------------------------------------------------
+def _resumir(latencias_s, total_s, itens=None):
+    """Percentis (ms) e vazão (operações/s) de uma série de medições."""
+    latencias_ms = np.asarray(latencias_s) * 1000
+    resumo = {
+        "chamadas": len(latencias_ms),
+        "p50_ms": round(float(np.percentile(latencias_ms, 50)), 4),
+        "p95_ms": round(float(np.percentile(latencias_ms, 95)), 4),
+        "p99_ms": round(float(np.percentile(latencias_ms, 99)), 4),
+        "max_ms": round(float(latencias_ms.max()), 4),
+        "ops_por_segundo": round(len(latencias_ms) / total_s, 1) if total_s > 0 else None,
+    }
+    if itens is not None:
+        resumo["itens_por_segundo"] = round(itens / total_s, 1) if total_s > 0 else None
+    return resumo
+
+
+def medir(funcao, argumentos, aquecimento=3):
+    """
+    Executa `funcao(*args)` para cada tupla de `argumentos`, após algumas
+    chamadas de aquecimento, e devolve o resumo das latências.
+    """
+    for args in argumentos[:aquecimento]:
+        funcao(*args)
+
+    latencias = []
+    inicio = time.perf_counter()
+    for args in argumentos:
+        t0 = time.perf_counter()
+        funcao(*args)
+        latencias.append(time.perf_counter() - t0)
+    return _resumir(latencias, time.perf_counter() - inicio)
+
+
+# ----------------------------------------------------------------------
+# 3. Preparação dos bancos de benchmark
+# ----------------------------------------------------------------------
+def _apontar_para_bancos(mongo_uri, db_name, sqlite_db):
+    """Redireciona o setup e o serviço para os bancos do benchmark (sem tocar nos dados reais)."""
+    for modulo in (database_setup, geoprocessing_service):
+        modulo.MONGO_URI = mongo_uri
+        modulo.DB_NAME = db_name
+        modulo.SQLITE_DB = sqlite_db
+    for modulo in (bulk_loader, buffer_locais, visao_locais_cidades):
+        modulo.MONGO_URI, modulo.DB_NAME, modulo.SQLITE_DB = mongo_uri, db_name, sqlite_db
+    geoprocessing_service.CACHE_CIDADES = CacheCidades(sqlite_db)
+    # As buscas por raio medem o backend, não o cache de círculos
+    geoprocessing_service.CACHE_RAIOS = CacheRaios(ativo=False)
+    geoprocessing_service._INDICE_MEMORIA = None
+
+
+def _usar_substituto_em_processo(mongo_uri):
+    """Usa o mongomock (opcional) no lugar de um mongod; por padrão, buscas por raio passam ao índice em memória."""
+    try:
+        import mongomock
+    except ImportError:
+        sys.exit("O modo --em-processo requer o pacote opcional 'mongomock' (pip install mongomock).")
+
+    mongo_client._CLIENTES[mongo_uri] = mongomock.MongoClient()
+    # O mongomock não implementa $nearSphere/$geoNear
+    geoprocessing_service.GEO_BACKEND = "memoria"
+
+
+# ----------------------------------------------------------------------
+# 4. Execução
+# ----------------------------------------------------------------------
+def executar(quantidade_locais=10_000, quantidade_cidades=50, consultas=200, semente=SEMENTE_PADRAO,
+             mongo_uri=database_setup.MONGO_URI, em_processo=False, backend_geo=None):
+    """
+    Gera os dados sintéticos, popula bancos dedicados e mede os caminhos
+    críticos do projeto.
+
+    Returns:
+        dict: Resultado em formato serializável (JSON).
+    """
+    # Tudo o que os serviços imprimem (setup, avisos, erros) vai para stderr, para não misturar com o JSON em stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        return _executar(quantidade_locais, quantidade_cidades, consultas, semente, mongo_uri, em_processo,
+                         backend_geo)
+
+
+def _executar(quantidade_locais, quantidade_cidades, consultas, semente, mongo_uri, em_processo, backend_geo):
+    diretorio = tempfile.mkdtemp(prefix="benchmark_poliglota_")
+    sqlite_db = os.path.join(diretorio, "benchmark.db")
+    if em_processo:
+        _usar_substituto_em_processo(mongo_uri)
+    if backend_geo:
+        geoprocessing_service.GEO_BACKEND = backend_geo
+    _apontar_para_bancos(mongo_uri, DB_NAME_BENCHMARK, sqlite_db)
+
+    collection = mongo_client.obter_colecao(mongo_uri, DB_NAME_BENCHMARK, database_setup.COLLECTION_NAME)
+    collection.database.client.drop_database(DB_NAME_BENCHMARK)
+    rng = np.random.default_rng(semente + 2)
+    resultados = {}
+
+    # --- Setup (a frio e verificação a quente) ---
+    resultados["setup_frio"] = database_setup.garantir_bancos_configurados()
+    resultados["setup_quente"] = database_setup.garantir_bancos_configurados()
+
+    # --- Inserção ---
+    cidades = gerar_cidades(quantidade_cidades, semente)
+    inicio = time.perf_counter()
+    with sqlite_pool.conexao(sqlite_db) as conn:
+        conn.executemany("INSERT OR IGNORE INTO CIDADES (nome, estado, populacao) VALUES (?, ?, ?)",
+                         [(c["nome"], c["estado"], c["populacao"]) for c in cidades])
+    resultados["insercao_cidades_executemany"] = {
+        "linhas": len(cidades), "linhas_por_segundo": round(len(cidades) / (time.perf_counter() - inicio), 1)}
+
+    locais = list(gerar_locais(quantidade_locais, cidades, semente))
+    inicio = time.perf_counter()
+    for lote_inicio in range(0, len(locais), bulk_loader.TAMANHO_LOTE_MONGO):
+        bulk_loader._inserir_lote_mongo(collection, locais[lote_inicio:lote_inicio + bulk_loader.TAMANHO_LOTE_MONGO])
+    resultados["insercao_locais_insert_many"] = {
+        "documentos": len(locais),
+        "documentos_por_segundo": round(len(locais) / (time.perf_counter() - inicio), 1)}
+
+    # Visão materializada locais + cidade (reconstrução completa)
+    resultados["reconstrucao_visao_locais_cidades"] = visao_locais_cidades.reconstruir()
+
+    if geoprocessing_service.GEO_BACKEND == "sqlite":
+        inicio = time.perf_counter()
+        geoprocessing_service.obter_indice_sqlite().adicionar_varios(locais)
+        resultados["insercao_locais_rtree_sqlite"] = {
+            "documentos": len(locais),
+            "documentos_por_segundo": round(len(locais) / (time.perf_counter() - inicio), 1)}
+
+    # insert_many acrescenta o _id aos documentos; as cópias precisam de um _id novo
+    extras = [({**{k: v for k, v in doc.items() if k != "_id"}, "nome_local": f"Extra {i}"},)
+              for i, doc in enumerate(locais[:consultas])]
+    resultados["insercao_local_insert_one"] = medir(collection.insert_one, extras, aquecimento=0)
+
+    # As mesmas inserções pelo buffer de escrita (bulk_write com upsert pela chave única)
+    if em_processo:
+        # O mongomock não aceita os upserts do bulk_write enviados pelo pymongo 4.x
+        resultados["insercao_local_buffer"] = {"ignorado": "upsert em bulk_write não suportado pelo mongomock"}
+    else:
+        buffer = buffer_locais.BufferLocais(collection)
+        inicio = time.perf_counter()
+        futuros = buffer.enviar_varios([{**{k: v for k, v in doc.items() if k != "_id"}, "nome_local": f"Buffer {i}"}
+                                        for i, (doc,) in enumerate(extras)])
+        status = Counter(futuro.result()["status"] for futuro in futuros)
+        segundos = time.perf_counter() - inicio
+        buffer.fechar()
+        resultados["insercao_local_buffer"] = {"documentos": len(futuros), "status": dict(status)}
+        # Vazão só quando todas as gravações deram certo (falhas rápidas não contam como desempenho)
+        if set(status) <= STATUS_SUCESSO_BUFFER:
+            resultados["insercao_local_buffer"]["documentos_por_segundo"] = round(len(futuros) / segundos, 1)
+
+    # --- Distâncias ---
+    pares = [tuple(rng.uniform([LATITUDE_MIN, LONGITUDE_MIN] * 2, [LATITUDE_MAX, LONGITUDE_MAX] * 2))
+             for _ in range(consultas)]
+    resultados["calcular_distancia"] = medir(geoprocessing_service.calcular_distancia, pares)
+
+    latitudes = np.array([doc["coordenadas"]["latitude"] for doc in locais])
+    longitudes = np.array([doc["coordenadas"]["longitude"] for doc in locais])
+    lote = medir(geoprocessing_service.calcular_distancias_um_para_muitos,
+                 [(lat, lon, latitudes, longitudes) for lat, lon, _, _ in pares[:20]])
+    lote["itens_por_chamada"] = len(locais)
+    resultados["calcular_distancias_um_para_muitos"] = lote
+
+    # --- Busca por raio: vários raios x densidades ---
+    if geoprocessing_service.GEO_BACKEND == "memoria":
+        geoprocessing_service.obter_indice_memoria()
+    resultados["buscar_locais_em_raio"] = {}
+    for densidade in DENSIDADES:
+        centros = [(c["latitude"], c["longitude"]) for c in cidades if c["densidade"] == densidade]
+        for raio in RAIOS_KM:
+            argumentos = [(*centros[i % len(centros)], raio) for i in range(consultas)]
+            encontrados = sum(len(geoprocessing_service.buscar_locais_em_raio(*args)) for args in argumentos[:20])
+            resumo = medir(geoprocessing_service.buscar_locais_em_raio, argumentos)
+            resumo["media_resultados"] = round(encontrados / 20, 1)
+            resultados["buscar_locais_em_raio"][f"{densidade}_{raio}km"] = resumo
+
+    # --- Cruzamento MongoDB + SQLite ---
+    nomes = [(locais[int(i)]["nome_local"],) for i in rng.integers(len(locais), size=consultas)]
+    resultados["cruzar_dados_local_cidade"] = medir(geoprocessing_service.cruzar_dados_local_cidade, nomes)
+    resultados["cruzar_dados_locais_cidades_lote_100"] = medir(
+        geoprocessing_service.cruzar_dados_locais_cidades,
+        [([nome for (nome,) in nomes[i:i + 100]],) for i in range(0, len(nomes), 100)] * 5)
+
+    collection.database.client.drop_database(DB_NAME_BENCHMARK)
+    return {
+        "metadados": {
+            "data": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "semente": semente,
+            "locais": quantidade_locais,
+            "cidades": quantidade_cidades,
+            "consultas_por_cenario": consultas,
+            "backend_geo": geoprocessing_service.GEO_BACKEND,
+            "mongo": "mongomock (em processo)" if em_processo else mongo_uri,
+        },
+        "resultados": resultados,
+    }
+
+
+# ----------------------------------------------------------------------
+# 5. Comparação entre execuções
+# ----------------------------------------------------------------------
+def _achatar(resultados, prefixo=""):
+    """Transforma os resultados aninhados em {caminho: resumo} para os cenários com p95."""
+    planos = {}
+    for chave, valor in resultados.items():
+        if isinstance(valor, dict) and "p95_ms" in valor:
+            planos[prefixo + chave] = valor
+        elif isinstance(valor, dict):
+            planos.update(_achatar(valor, f"{prefixo}{chave}."))
+    return planos
+
+
+def comparar(base, atual, limite=LIMITE_REGRESSAO):
+    """
+    Compara o p95 de cada cenário entre duas execuções.
+
+    Returns:
+        dict: Razão atual/base por cenário e a lista de regressões acima do limite.
+    """
+    base_plana, atual_plana = _achatar(base["resultados"]), _achatar(atual["resultados"])
+    razoes = {
+        cenario: round(atual_plana[cenario]["p95_ms"] / base_plana[cenario]["p95_ms"], 3)
+        for cenario in sorted(base_plana.keys() & atual_plana.keys()) if base_plana[cenario]["p95_ms"] > 0
+    }
+    return {"razao_p95": razoes, "regressoes": [c for c, r in razoes.items() if r > 1 + limite]}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark reprodutível dos caminhos críticos do projeto.")
+    parser.add_argument("--locais", type=int, default=10_000)
+    parser.add_argument("--cidades", type=int, default=50)
+    parser.add_argument("--consultas", type=int, default=200, help="Chamadas medidas por cenário.")
+    parser.add_argument("--semente", type=int, default=SEMENTE_PADRAO)
+    parser.add_argument("--mongo-uri", default=database_setup.MONGO_URI)
+    parser.add_argument("--em-processo", action="store_true",
+                        help="Usa mongomock no lugar de um mongod local (requer o pacote mongomock).")
+    parser.add_argument("--backend-geo", choices=["mongo", "memoria", "sqlite"],
+                        help="Backend das buscas por raio (padrão: GEO_BACKEND, ou 'memoria' com --em-processo).")
+    parser.add_argument("--saida", help="Arquivo JSON de saída (padrão: stdout).")
+    parser.add_argument("--comparar", help="JSON de uma execução anterior para detectar regressões.")
+    args = parser.parse_args()
+
+    resultado = executar(args.locais, args.cidades, args.consultas, args.semente, args.mongo_uri, args.em_processo,
+                         args.backend_geo)
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as arquivo:
+            resultado["comparacao"] = comparar(json.load(arquivo), resultado)
+
+    texto = json.dumps(resultado, indent=2, ensure_ascii=False)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as arquivo:
+            arquivo.write(texto)
+    else:
+        print(texto)
+
+    if resultado.get("comparacao", {}).get("regressoes"):
+        sys.exit(1)
@@ -0,0 +1,367 @@
+import argparse
+import atexit
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from pymongo.write_concern import WriteConcern
+
+import metricas
+import mongo_client
+import sqlite_pool
+import visao_locais_cidades
+from database_setup import MONGO_URI, DB_NAME, COLLECTION_NAME, SQLITE_DB, criar_indices_mongodb
+from geoprocessing_service import registrar_local_no_indice, registrar_local_atualizado
+
+# --- Configurações do Buffer de Escrita de Locais ---
+# Locais por bulk_write: o lote é gravado assim que atinge este tamanho...
+TAMANHO_LOTE_BUFFER = int(os.getenv("BUFFER_LOCAIS_LOTE", "500"))
+# ...ou quando o local mais antigo esperou este tempo (segundos)
+INTERVALO_DESCARGA_S = float(os.getenv("BUFFER_LOCAIS_INTERVALO", "0.05"))
+# Write concern dos lotes: "0" (sem confirmação), "1", "majority"...; BUFFER_LOCAIS_J=1 exige o journal
+WRITE_CONCERN_W = os.getenv("BUFFER_LOCAIS_W", "1")
+WRITE_CONCERN_J = os.getenv("BUFFER_LOCAIS_J", "0") == "1"
+# Tempo máximo (segundos) que gravar() espera pelo resultado
+TIMEOUT_RESULTADO_S = 30
+
+# Campos gravados pelo upsert; (nome_local, cidade) é a chave única
+_CAMPOS_LOCAL = ("coordenadas", "descricao")
+# Campos lidos dos locais já existentes (comparação com o envio e troca do ponto nos índices)
+_PROJECAO_EXISTENTES = {"nome_local": 1, "cidade": 1, **{campo: 1 for campo in _CAMPOS_LOCAL}}
+# Máximo de parâmetros por "IN (...)" (abaixo do limite histórico de 999 do SQLite)
+_TAMANHO_LOTE_IN = 900
+
+_BUFFER = None
+_BUFFER_LOCK = threading.Lock()
+
+
+def write_concern_padrao():
+    """WriteConcern de WRITE_CONCERN_W/WRITE_CONCERN_J ("majority" e tags ficam como texto)."""
+    w = int(WRITE_CONCERN_W) if WRITE_CONCERN_W.isdigit() else WRITE_CONCERN_W
+    return WriteConcern(w=w, j=True if WRITE_CONCERN_J else None)
+
+
+def _resultado(status, mensagem, _id=None):
+    """
+    Resultado entregue a cada chamador. status: 'inserido', 'atualizado',
+    'inalterado', 'enviado' (write concern sem confirmação), 'rejeitado'
+    (dados ou cidade inválidos) ou 'erro' (falha na gravação).
+    """
+    return {"status": status, "mensagem": mensagem, "_id": _id}
+
+
+def _validar(documento):
+    """Mensagem de erro dos campos obrigatórios do local, ou None se ele for válido."""
+    coordenadas = documento.get("coordenadas") or {}
+    latitude, longitude = coordenadas.get("latitude"), coordenadas.get("longitude")
+    if not (documento.get("nome_local") and documento.get("cidade")):
+        return "Nome e cidade são obrigatórios."
+    if not (isinstance(latitude, (int, float)) and isinstance(longitude, (int, float))
+            and -90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return "Coordenadas inválidas."
+    return None
+
+
+def _chave(documento):
+    return documento["nome_local"], documento["cidade"]
+
+
+def _filtro(chave):
+    return {"nome_local": chave[0], "cidade": chave[1]}
+
+
+def _mesmos_campos(anterior, documento):
+    return all(anterior.get(campo) == documento.get(campo) for campo in _CAMPOS_LOCAL)
+
+
+class BufferLocais:
+    """
+    Buffer de escrita dos novos locais: as chamadas de vários usuários (ou
+    de um script de importação) são agrupadas em lotes gravados com um único
+    bulk_write, quando o lote enche ou o mais antigo espera INTERVALO_DESCARGA_S.
+
+    Cada lote:
+      - junta os envios da mesma chave (nome_local, cidade): vale o último;
+      - valida as cidades no catálogo do SQLite com uma única consulta;
+      - lê de uma vez os locais já existentes, para não regravar os inalterados;
+      - faz upsert pela chave única e entrega a cada chamador o resultado do seu local.
+    """
+
+    def __init__(self, collection=None, tamanho_lote=TAMANHO_LOTE_BUFFER, intervalo_s=INTERVALO_DESCARGA_S,
+                 write_concern=None, cache_cidades=None, ao_gravar=None):
+        """
+        Args:
+            collection: Collection de locais (padrão: 'locais_geo' do cliente compartilhado).
+            cache_cidades (CacheCidades, opcional): Valida as cidades pelo cache em vez de consultar o SQLite.
+            ao_gravar (callable, opcional): Recebe [(documento anterior ou None, documento gravado)]
+                após cada lote (ex: invalidação dos caches da interface).
+        """
+        collection = collection if collection is not None else mongo_client.obter_colecao(
+            MONGO_URI, DB_NAME, COLLECTION_NAME)
+        self._collection = collection.with_options(write_concern=write_concern or write_concern_padrao())
+        self.tamanho_lote = tamanho_lote
+        self.intervalo_s = intervalo_s
+        self.cache_cidades = cache_cidades
+        self.ao_gravar = ao_gravar
+        self._condicao = threading.Condition()
+        self._lock_gravacao = threading.Lock()  # um lote por vez: mantém a ordem dos envios da mesma chave
+        self._pendentes = []  # (documento, Future)
+        self._primeiro_envio = None
+        self._thread = None
+        self._encerrado = False
+
+    # --- Envio ---
+    def enviar(self, documento):
+        """Enfileira o local e retorna um Future com o seu resultado (ver _resultado)."""
+        futuro = Future()
+        with self._condicao:
+            if self._encerrado:
+                raise RuntimeError("Buffer de locais encerrado.")
+            if not self._pendentes:
+                self._primeiro_envio = time.monotonic()
+            self._pendentes.append((documento, futuro))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._executar, name="buffer-locais", daemon=True)
+                self._thread.start()
+            self._condicao.notify()
+        return futuro
+
+    def enviar_varios(self, documentos):
+        """Enfileira vários locais; retorna os Futures na mesma ordem."""
+        return [self.enviar(documento) for documento in documentos]
+
+    def gravar(self, documento, timeout=TIMEOUT_RESULTADO_S):
+        """Enfileira o local e espera o resultado da gravação do seu lote."""
+        return self.enviar(documento).result(timeout)
+
+    # --- Descarga ---
+    def _retirar_lote(self):
+        lote, self._pendentes = self._pendentes[:self.tamanho_lote], self._pendentes[self.tamanho_lote:]
+        self._primeiro_envio = time.monotonic() if self._pendentes else None
+        return lote
+
+    def _executar(self):
+        """Thread de descarga: grava um lote quando ele enche ou quando o mais antigo expira."""
+        while True:
+            with self._condicao:
+                while not self._encerrado:
+                    if len(self._pendentes) >= self.tamanho_lote:
+                        break
+                    if self._pendentes:
+                        restante = self._primeiro_envio + self.intervalo_s - time.monotonic()
+                        if restante <= 0:
+                            break
+                        self._condicao.wait(restante)
+                    else:
+                        self._condicao.wait()
+                if self._encerrado and not self._pendentes:
+                    return
+                lote = self._retirar_lote()
+            self._gravar_lote(lote)
+
+    def descarregar(self):
+        """Grava imediatamente tudo o que está pendente (ex: ao final de um script de importação)."""
+        while True:
+            with self._condicao:
+                lote = self._retirar_lote()
+            if not lote:
+                return
+            self._gravar_lote(lote)
+
+    def fechar(self):
+        """Grava os pendentes e encerra a thread de descarga."""
+        with self._condicao:
+            self._encerrado = True
+            self._condicao.notify()
+        if self._thread is not None:
+            self._thread.join()
+        self.descarregar()
+
+    # --- Gravação de um lote ---
+    def _cidades_existentes(self, nomes):
+        """Nomes de `nomes` cadastrados em CIDADES: uma consulta (ou uma leitura do cache) por lote."""
+        if self.cache_cidades is not None:
+            return {nome for nome, linha in self.cache_cidades.por_nomes(nomes).items() if linha is not None}
+        nomes, existentes = list(nomes), set()
+        with sqlite_pool.conexao(SQLITE_DB) as conn:
+            for inicio in range(0, len(nomes), _TAMANHO_LOTE_IN):
+                lote = nomes[inicio:inicio + _TAMANHO_LOTE_IN]
+                marcadores = ", ".join("?" * len(lote))
+                existentes.update(linha[0] for linha in
+                                  conn.execute(f"SELECT nome FROM CIDADES WHERE nome IN ({marcadores})", lote))
+        return existentes
+
+    def _gravar_lote(self, lote):
+        with self._lock_gravacao:
+            try:
+                with metricas.medir("buffer_locais.lote", "mongodb") as medicao:
+                    por_chave, resultados, gravados, confirmado = self._gravar(lote)
+                    medicao.itens = len(por_chave)
+            except Exception as e:
+                # Os chamadores estão esperando: qualquer falha (MongoDB, SQLite...) vira 'erro' no resultado
+                print(f"ERRO: Falha ao gravar o lote de {len(lote)} locais. Erro: {e}")
+                metricas.registrar_erro("buffer_locais.lote", "mongodb")
+                for _, futuro in lote:
+                    futuro.set_result(_resultado("erro", f"Erro ao gravar no MongoDB: {e}"))
+                return
+            # O lote já foi aceito pelo MongoDB: falhas na sincronização não mudam o resultado dos chamadores
+            try:
+                self._apos_gravar(gravados, confirmado)
+            except Exception as e:
+                print(f"AVISO: índices, visão ou caches não sincronizados com o lote de {len(gravados)} locais "
+                      f"(a próxima reconstrução corrige). Erro: {e}")
+                metricas.registrar_erro("buffer_locais.apos_gravar", "mongodb")
+            for documento, futuro in lote:
+                futuro.set_result(resultados[id(documento)] if id(documento) in resultados
+                                  else resultados[_chave(documento)])
+
+    def _gravar(self, lote):
+        """
+        Grava o lote e retorna ({chave: documento}, resultados, gravados,
+        confirmado), com os resultados indexados pela chave ou, para os
+        rejeitados na validação, por id(documento). gravados: pares
+        (anterior, documento) para _apos_gravar().
+        """
+        resultados, por_chave = {}, {}
+        for documento, _ in lote:
+            erro = _validar(documento)
+            if erro:
+                resultados[id(documento)] = _resultado("rejeitado", erro)
+            else:
+                por_chave[_chave(documento)] = documento  # envios repetidos: vale o último
+
+        cidades = self._cidades_existentes({cidade for _, cidade in por_chave}) if por_chave else set()
+        for chave in [chave for chave in por_chave if chave[1] not in cidades]:
+            del por_chave[chave]
+            resultados[chave] = _resultado("rejeitado", f"A cidade '{chave[1]}' não está cadastrada no SQLite.")
+        if not por_chave:
+            return por_chave, resultados, [], True
+
+        # Locais já existentes (uma leitura pelo índice único), para detectar os inalterados
+        anteriores = {_chave(documento): documento for documento in self._collection.find(
+            {"$or": [_filtro(chave) for chave in por_chave]}, _PROJECAO_EXISTENTES)}
+        chaves, operacoes = [], []
+        for chave, documento in por_chave.items():
+            anterior = anteriores.get(chave)
+            if anterior is not None and _mesmos_campos(anterior, documento):
+                resultados[chave] = _resultado("inalterado", f"Local '{chave[0]}' já cadastrado, sem alterações.",
+                                               anterior["_id"])
+                continue
+            chaves.append(chave)
+            operacoes.append(UpdateOne(_filtro(chave), {"$set": {campo: documento.get(campo)
+                                                                 for campo in _CAMPOS_LOCAL}}, upsert=True))
+        if not operacoes:
+            return por_chave, resultados, [], True
+
+        falhas, inseridos = {}, {}
+        try:
+            resposta = self._collection.bulk_write(operacoes, ordered=False)
+            confirmado = resposta.acknowledged
+            if confirmado:
+                inseridos = resposta.upserted_ids
+        except BulkWriteError as e:
+            confirmado = True
+            falhas = {erro["index"]: erro.get("errmsg", "") for erro in e.details.get("writeErrors", [])}
+            inseridos = {item["index"]: item["_id"] for item in e.details.get("upserted", [])}
+            metricas.registrar_erro("buffer_locais.lote", "mongodb")
+
+        # Chaves inseridas por outro processo entre a leitura e o upsert: busca os _ids (e as
+        # coordenadas, para o índice trocar o ponto em vez de duplicá-lo) que faltam
+        faltantes = [chave for posicao, chave in enumerate(chaves)
+                     if confirmado and posicao not in falhas and posicao not in inseridos and chave not in anteriores]
+        if faltantes:
+            anteriores.update({_chave(documento): documento for documento in self._collection.find(
+                {"$or": [_filtro(chave) for chave in faltantes]}, _PROJECAO_EXISTENTES)})
+
+        gravados = []
+        for posicao, chave in enumerate(chaves):
+            documento = dict(por_chave[chave])
+            anterior = anteriores.get(chave)
+            if posicao in falhas:
+                resultados[chave] = _resultado("erro", f"Erro ao gravar '{chave[0]}': {falhas[posicao]}")
+                continue
+            if not confirmado:
+                resultados[chave] = _resultado("enviado", f"Local '{chave[0]}' enviado (write concern sem confirmação).")
+                gravados.append((anterior, documento))
+                continue
+            if posicao not in inseridos and anterior is None:
+                # Gravado, mas removido por outro processo antes da releitura: não há o que indexar
+                resultados[chave] = _resultado("atualizado", f"Local '{chave[0]}' gravado, mas removido em seguida "
+                                                             f"por outra operação.")
+                continue
+            documento["_id"] = inseridos[posicao] if posicao in inseridos else anterior["_id"]
+            if posicao in inseridos:
+                resultados[chave] = _resultado("inserido", f"Local '{chave[0]}' inserido com sucesso no MongoDB.",
+                                               documento["_id"])
+                gravados.append((None, documento))
+            else:
+                resultados[chave] = _resultado("atualizado", f"Local '{chave[0]}' já existia e foi atualizado.",
+                                               documento["_id"])
+                gravados.append((anterior, documento))
+
+        return por_chave, resultados, gravados, confirmado
+
+    def _apos_gravar(self, gravados, confirmado):
+        """Mantém índices locais, cache de raios e visão sincronizados com o lote gravado."""
+        for anterior, documento in gravados:
+            if anterior is not None and "coordenadas" in anterior:
+                registrar_local_atualizado(anterior, documento)
+            else:
+                registrar_local_no_indice(documento)
+        if confirmado:
+            visao_locais_cidades.registrar_locais([documento for _, documento in gravados])
+        if self.ao_gravar is not None and gravados:
+            self.ao_gravar(gravados)
+
+
+def obter_buffer_locais(**opcoes):
+    """
+    Buffer compartilhado do processo, criado no primeiro uso (as opções só
+    valem nessa primeira chamada). Os pendentes são gravados ao encerrar o processo.
+    """
+    global _BUFFER
+    if _BUFFER is None:
+        with _BUFFER_LOCK:
+            if _BUFFER is None:
+                _BUFFER = BufferLocais(**opcoes)
+                atexit.register(_BUFFER.fechar)
+    return _BUFFER
+
+
+# ----------------------------------------------------------------------
+# Remoção dos duplicados antigos (pré-requisito do índice único)
+# ----------------------------------------------------------------------
+@metricas.instrumentar("mongodb", operacao="buffer_locais.deduplicar", itens=lambda removidos: removidos)
+def remover_duplicados(collection=None):
+    """
+    Mantém um único documento (o de menor _id, o mais antigo) por
+    (nome_local, cidade), remove os demais e cria o índice único.
+
+    Returns:
+        int: Documentos removidos.
+    """
+    collection = collection if collection is not None else mongo_client.obter_colecao(
+        MONGO_URI, DB_NAME, COLLECTION_NAME)
+    grupos = collection.aggregate([
+        {"$sort": {"_id": 1}},
+        {"$group": {"_id": {"nome_local": "$nome_local", "cidade": "$cidade"},
+                    "ids": {"$push": "$_id"}, "total": {"$sum": 1}}},
+        {"$match": {"total": {"$gt": 1}}},
+    ], allowDiskUse=True)
+    removidos = 0
+    for grupo in grupos:
+        removidos += collection.delete_many({"_id": {"$in": grupo["ids"][1:]}}).deleted_count
+    criar_indices_mongodb(collection)
+    return removidos
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Manutenção da chave única (nome_local, cidade) dos locais.")
+    parser.add_argument("comando", choices=["deduplicar"])
+    parser.parse_args()
+    print(f"Documentos duplicados removidos: {remover_duplicados()}")
+    print("Reconstrua a visão e reexporte o snapshot: python visao_locais_cidades.py; "
+          "python snapshot_locais.py exportar")
@@ -0,0 +1,355 @@
+import argparse
+import csv
+import json
+import os
+import time
+
+from pymongo.errors import BulkWriteError
+
+import mongo_client
+import sqlite_pool
+import visao_locais_cidades
+from database_setup import MONGO_URI, DB_NAME, COLLECTION_NAME, SQLITE_DB
+
+# --- Configurações da Carga em Massa ---
+TAMANHO_LOTE_MONGO = 5000      # documentos por insert_many(ordered=False)
+TAMANHO_LOTE_SQLITE = 10000    # linhas por transação (executemany)
+INTERVALO_PROGRESSO = 2.0      # segundos entre relatórios de progresso
+TAMANHO_BLOCO_LEITURA = 1 << 16  # bytes lidos por vez no modo GeoJSON
+
+
+# ----------------------------------------------------------------------
+# 1. Leitura em streaming (CSV, NDJSON e GeoJSON) em memória constante
+# ----------------------------------------------------------------------
+def _detectar_formato(caminho):
+    extensao = os.path.splitext(caminho)[1].lower()
+    if extensao == ".csv":
+        return "csv"
+    if extensao in (".ndjson", ".jsonl"):
+        return "ndjson"
+    if extensao in (".geojson", ".json"):
+        return "geojson"
+    raise ValueError(f"Não foi possível detectar o formato de '{caminho}'. Use csv, ndjson ou geojson.")
+
+
+def _achatar_feature(feature):
+    """Converte uma Feature GeoJSON (Point) em um registro plano com latitude/longitude."""
+    registro = dict(feature.get("properties") or {})
+    geometria = feature.get("geometry") or {}
+    if geometria.get("type") == "Point":
+        longitude, latitude = geometria["coordinates"][:2]
+        registro.setdefault("latitude", latitude)
+        registro.setdefault("longitude", longitude)
+    return registro
+
+
+def _ler_csv(caminho):
+    with open(caminho, newline="", encoding="utf-8") as arquivo:
+        yield from csv.DictReader(arquivo)
+
+
+def _ler_ndjson(caminho):
+    with open(caminho, encoding="utf-8") as arquivo:
+        for linha in arquivo:
+            linha = linha.strip()
+            if not linha:
+                continue
+            objeto = json.loads(linha)
+            yield _achatar_feature(objeto) if objeto.get("type") == "Feature" else objeto
+
+
+def _ler_geojson(caminho):
+    """
+    Lê as Features de um FeatureCollection sem carregar o arquivo inteiro:
+    o texto é lido em blocos e cada Feature do array "features" é
+    decodificada individualmente com JSONDecoder.raw_decode.
+    """
+    decoder = json.JSONDecoder()
+    with open(caminho, encoding="utf-8") as arquivo:
+        buffer = ""
+        # Avança até o início do array "features"
+        while True:
+            posicao = buffer.find('"features"')
+            if posicao >= 0:
+                inicio_array = buffer.find("[", posicao)
+                if inicio_array >= 0:
+                    buffer = buffer[inicio_array + 1:]
+                    break
+            bloco = arquivo.read(TAMANHO_BLOCO_LEITURA)
+            if not bloco:
+                return
+            buffer = buffer[-16:] + bloco if posicao < 0 else buffer + bloco
+
+        while True:
+            buffer = buffer.lstrip(" \t\r\n,")
+            if buffer.startswith("]"):
+                return
+            try:
+                feature, fim = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                bloco = arquivo.read(TAMANHO_BLOCO_LEITURA)
+                if not bloco:
+                    if buffer:
+                        raise
+                    return
+                buffer += bloco
+                continue
+            buffer = buffer[fim:]
+            yield _achatar_feature(feature)
+
+
+def ler_registros(caminho, formato=None):
+    """
+    Gera os registros (dicionários planos) de um arquivo CSV, NDJSON ou
+    GeoJSON, um por vez, sem carregar o arquivo inteiro em memória.
+    """
+    leitores = {"csv": _ler_csv, "ndjson": _ler_ndjson, "geojson": _ler_geojson}
+    return leitores[formato or _detectar_formato(caminho)](caminho)
+
+
+# ----------------------------------------------------------------------
+# 2. Conversão dos registros
+# ----------------------------------------------------------------------
+def montar_documento_local(nome, cidade, lat, lon, descricao):
+    """Monta o documento de 'locais_geo' com o ponto GeoJSON em 'coordenadas.ponto'."""
+    return {
+        "nome_local": nome,
+        "cidade": cidade,
+        "coordenadas": {
+            "latitude": lat,
+            "longitude": lon,
+            # Padrão GeoJSON: [longitude, latitude]
+            "ponto": {"type": "Point", "coordinates": [lon, lat]}
+        },
+        "descricao": descricao
+    }
+
+
+def _registro_para_local(registro):
+    """Converte um registro em documento de local ou retorna None se for inválido."""
+    nome = registro.get("nome_local") or registro.get("nome")
+    cidade = registro.get("cidade")
+    try:
+        lat = float(registro.get("latitude"))
+        lon = float(registro.get("longitude"))
+    except (TypeError, ValueError):
+        return None
+
+    if not (nome and cidade and -90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    return montar_documento_local(nome, cidade, lat, lon, registro.get("descricao", ""))
+
+
+def _registro_para_cidade(registro):
+    """
+    Converte um registro em tupla (nome, estado, populacao, latitude, longitude)
+    ou retorna None se for inválido. O centro (latitude/longitude) é opcional.
+    """
+    nome, estado = registro.get("nome"), registro.get("estado")
+    try:
+        populacao = int(registro.get("populacao"))
+    except (TypeError, ValueError):
+        return None
+
+    if not (nome and estado):
+        return None
+    try:
+        lat, lon = float(registro.get("latitude")), float(registro.get("longitude"))
+    except (TypeError, ValueError):
+        lat = lon = None
+    if lat is not None and not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    return nome, estado.upper(), populacao, lat, lon
+
+
+# ----------------------------------------------------------------------
+# 3. Checkpoints e relatório de progresso
+# ----------------------------------------------------------------------
+class Checkpoint:
+    """
+    Guarda em disco quantos registros do arquivo de origem já foram
+    gravados, permitindo retomar a carga após uma falha.
+    """
+
+    def __init__(self, caminho_checkpoint, arquivo_origem):
+        self.caminho = caminho_checkpoint
+        self.arquivo_origem = os.path.abspath(arquivo_origem)
+
+    def carregar(self):
+        """Retorna o número de registros já processados (0 se não houver checkpoint)."""
+        if not os.path.exists(self.caminho):
+            return 0
+        with open(self.caminho, encoding="utf-8") as arquivo:
+            dados = json.load(arquivo)
+        if dados.get("arquivo") != self.arquivo_origem or dados.get("concluido"):
+            return 0
+        return dados.get("registros_processados", 0)
+
+    def salvar(self, registros_processados, concluido=False):
+        temporario = self.caminho + ".tmp"
+        with open(temporario, "w", encoding="utf-8") as arquivo:
+            json.dump({"arquivo": self.arquivo_origem, "registros_processados": registros_processados,
+                       "concluido": concluido}, arquivo)
+        # Substituição atômica: o checkpoint nunca fica corrompido
+        os.replace(temporario, self.caminho)
+
+
+class RelatorioProgresso:
+    """Imprime periodicamente o total de registros e a taxa em registros/segundo."""
+
+    def __init__(self, rotulo, intervalo=INTERVALO_PROGRESSO):
+        self.rotulo = rotulo
+        self.intervalo = intervalo
+        self.inicio = time.perf_counter()
+        self._ultimo = self.inicio
+        self.registros = 0
+
+    def atualizar(self, registros, forcar=False):
+        self.registros = registros
+        agora = time.perf_counter()
+        if forcar or agora - self._ultimo >= self.intervalo:
+            self._ultimo = agora
+            print(f"[{self.rotulo}] {registros} registros | {self.taxa():.0f} reg/s")
+
+    def segundos(self):
+        return time.perf_counter() - self.inicio
+
+    def taxa(self):
+        segundos = self.segundos()
+        return self.registros / segundos if segundos > 0 else 0.0
+
+
+# ----------------------------------------------------------------------
+# 4. Carga em massa
+# ----------------------------------------------------------------------
+def _inserir_lote_mongo(collection, lote):
+    """
+    insert_many não ordenado; erros individuais (ex: chave duplicada) não
+    interrompem o lote.
+
+    Returns:
+        tuple: (documentos gravados, posições no lote dos documentos rejeitados pelo servidor).
+    """
+    try:
+        return len(collection.insert_many(lote, ordered=False).inserted_ids), set()
+    except BulkWriteError as e:
+        return e.details.get("nInserted", 0), {erro["index"] for erro in e.details.get("writeErrors", [])}
+
+
+def _carregar(caminho, formato, converter, gravar_lote, tamanho_lote, caminho_checkpoint, retomar, rotulo):
+    """Laço comum: lê, converte, grava em lotes, salva checkpoints e reporta progresso."""
+    checkpoint = Checkpoint(caminho_checkpoint or caminho + ".checkpoint.json", caminho)
+    ja_processados = checkpoint.carregar() if retomar else 0
+    if ja_processados:
+        print(f"[{rotulo}] Retomando a partir do registro {ja_processados}.")
+
+    progresso = RelatorioProgresso(rotulo)
+    lote, processados, gravados, rejeitados = [], ja_processados, 0, 0
+
+    for indice, registro in enumerate(ler_registros(caminho, formato)):
+        if indice < ja_processados:
+            continue
+
+        item = converter(registro)
+        if item is None:
+            rejeitados += 1
+        else:
+            lote.append(item)
+        processados = indice + 1
+
+        if len(lote) >= tamanho_lote:
+            gravados += gravar_lote(lote)
+            lote = []
+            checkpoint.salvar(processados)
+            progresso.atualizar(processados - ja_processados)
+
+    if lote:
+        gravados += gravar_lote(lote)
+    checkpoint.salvar(processados, concluido=True)
+    progresso.atualizar(processados - ja_processados, forcar=True)
+
+    return {
+        "lidos": processados - ja_processados,
+        "gravados": gravados,
+        "rejeitados": rejeitados,
+        "segundos": round(progresso.segundos(), 3),
+        "registros_por_segundo": round(progresso.taxa(), 1),
+    }
+
+
+def carregar_locais(caminho, formato=None, tamanho_lote=TAMANHO_LOTE_MONGO, caminho_checkpoint=None,
+                    retomar=True, collection=None):
+    """
+    Carrega locais (pontos de interesse) de um arquivo CSV/NDJSON/GeoJSON no
+    MongoDB, em lotes de insert_many(ordered=False).
+
+    Campos esperados: nome_local (ou nome), cidade, latitude, longitude e
+    descricao (opcional); em GeoJSON, latitude/longitude vêm da geometria.
+    Ao retomar após uma falha, o último lote incompleto pode ser inserido
+    novamente (entrega "pelo menos uma vez").
+
+    Returns:
+        dict: Resumo da carga (lidos, gravados, rejeitados, tempo e taxa).
+    """
+    # Importado aqui: geoprocessing_service depende (via sqlite_geo/snapshot_locais) deste módulo
+    import geoprocessing_service
+
+    if collection is None:
+        collection = mongo_client.obter_colecao(MONGO_URI, DB_NAME, COLLECTION_NAME)
+
+    def gravar_lote(lote):
+        gravados, falhas = _inserir_lote_mongo(collection, lote)
+        # O pymongo atribui o _id antes de enviar: só os documentos aceitos pelo servidor seguem adiante
+        aceitos = [documento for posicao, documento in enumerate(lote) if posicao not in falhas]
+        visao_locais_cidades.registrar_locais(aceitos)
+        geoprocessing_service.registrar_locais_no_indice(aceitos)
+        return gravados
+
+    return _carregar(caminho, formato, _registro_para_local, gravar_lote,
+                     tamanho_lote, caminho_checkpoint, retomar, "locais")
+
+
+def carregar_cidades(caminho, formato=None, tamanho_lote=TAMANHO_LOTE_SQLITE, caminho_checkpoint=None,
+                     retomar=True):
+    """
+    Carrega cidades (nome, estado, populacao e, opcionalmente, latitude e
+    longitude do centro) de um arquivo CSV/NDJSON no SQLite, com executemany
+    dentro de uma transação por lote. Cidades já existentes são ignoradas
+    (INSERT OR IGNORE), o que torna a retomada idempotente.
+
+    Returns:
+        dict: Resumo da carga (lidos, gravados, rejeitados, tempo e taxa).
+    """
+    def gravar_lote(lote):
+        with sqlite_pool.conexao(SQLITE_DB) as conn:
+            antes = conn.total_changes
+            conn.executemany("INSERT OR IGNORE INTO CIDADES (nome, estado, populacao) VALUES (?, ?, ?)",
+                             [cidade[:3] for cidade in lote])
+            gravados = conn.total_changes - antes
+            # Centros informados vão para CIDADES_GEO (usados por atribuicao_cidades.py)
+            conn.executemany("INSERT OR IGNORE INTO CIDADES_GEO (cidade_id, latitude, longitude) "
+                             "SELECT id, ?, ? FROM CIDADES WHERE nome = ?",
+                             [(lat, lon, nome) for nome, _, _, lat, lon in lote if lat is not None])
+        visao_locais_cidades.registrar_cidades([cidade[0] for cidade in lote])
+        return gravados
+
+    return _carregar(caminho, formato, _registro_para_cidade, gravar_lote,
+                     tamanho_lote, caminho_checkpoint, retomar, "cidades")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Carga em massa de locais (MongoDB) e cidades (SQLite).")
+    parser.add_argument("tipo", choices=["locais", "cidades"])
+    parser.add_argument("arquivo")
+    parser.add_argument("--formato", choices=["csv", "ndjson", "geojson"])
+    parser.add_argument("--lote", type=int, help="Tamanho do lote de gravação.")
+    parser.add_argument("--checkpoint", help="Arquivo de checkpoint (padrão: <arquivo>.checkpoint.json).")
+    parser.add_argument("--recomecar", action="store_true", help="Ignora o checkpoint existente.")
+    args = parser.parse_args()
+
+    carregar = carregar_locais if args.tipo == "locais" else carregar_cidades
+    opcoes = {"formato": args.formato, "caminho_checkpoint": args.checkpoint, "retomar": not args.recomecar}
+    if args.lote:
+        opcoes["tamanho_lote"] = args.lote
+
+    print(json.dumps(carregar(args.arquivo, **opcoes), indent=2))
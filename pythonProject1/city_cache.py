@@ -0,0 +1,144 @@
+import threading
+
+import sqlite_pool
+from query_cache import AUSENTE, LRUComTTL
+
+# --- Configurações do Cache de Cidades ---
+# Máximo de entradas mantidas por tipo de consulta (nome/estado) antes da remoção LRU
+CACHE_CIDADES_MAX_ENTRADAS = 10000
+# Tempo de vida (segundos) de cada entrada; None desativa a expiração
+CACHE_CIDADES_TTL = 300
+
+# Máximo de parâmetros por "IN (...)" (abaixo do limite histórico de 999 do SQLite)
+_TAMANHO_LOTE_IN = 900
+
+
+class CacheCidades:
+    """
+    Cache de leitura (read-through) da tabela CIDADES do SQLite.
+
+    As linhas são tuplas (id, nome, estado, populacao), no mesmo formato de
+    "SELECT * FROM CIDADES". Consultas ausentes do cache vão ao banco e são
+    armazenadas (inclusive cidades inexistentes, como None) até expirarem,
+    serem removidas pelo LRU ou invalidadas por uma escrita.
+    """
+
+    def __init__(self, caminho_db, max_entradas=CACHE_CIDADES_MAX_ENTRADAS, ttl=CACHE_CIDADES_TTL):
+        self.caminho_db = caminho_db
+        self._lock = threading.Lock()
+        self._por_nome = LRUComTTL(max_entradas, ttl)
+        self._por_estado = LRUComTTL(max_entradas, ttl)
+        self._lista_completa = LRUComTTL(1, ttl)
+        self._acertos = 0
+        self._falhas = 0
+        # Incrementada a cada escrita: leituras iniciadas antes dela não gravam no cache
+        self._geracao = 0
+
+    # --- Consultas ---
+    def _consultar(self, cache, chave, carregar):
+        with self._lock:
+            valor = cache.get(chave)
+            if valor is not AUSENTE:
+                self._acertos += 1
+                return valor
+            self._falhas += 1
+            geracao = self._geracao
+
+        valor = carregar()
+        with self._lock:
+            if self._geracao == geracao:
+                cache.put(chave, valor)
+        return valor
+
+    def por_nome(self, nome):
+        """Retorna a linha da cidade `nome` ou None se ela não existir."""
+        def carregar():
+            with sqlite_pool.conexao(self.caminho_db) as conn:
+                return conn.execute("SELECT * FROM CIDADES WHERE nome = ?", (nome,)).fetchone()
+
+        return self._consultar(self._por_nome, nome, carregar)
+
+    def por_nomes(self, nomes):
+        """
+        Retorna {nome: linha ou None} para vários nomes. Os nomes ausentes do
+        cache são buscados juntos, em lotes de SELECT ... WHERE nome IN (...).
+        """
+        resultado, faltantes = {}, []
+        with self._lock:
+            for nome in set(nomes):
+                valor = self._por_nome.get(nome)
+                if valor is AUSENTE:
+                    self._falhas += 1
+                    faltantes.append(nome)
+                else:
+                    self._acertos += 1
+                    resultado[nome] = valor
+            geracao = self._geracao
+
+        if faltantes:
+            encontrados = {}
+            with sqlite_pool.conexao(self.caminho_db) as conn:
+                for inicio in range(0, len(faltantes), _TAMANHO_LOTE_IN):
+                    lote = faltantes[inicio:inicio + _TAMANHO_LOTE_IN]
+                    marcadores = ", ".join("?" * len(lote))
+                    for linha in conn.execute(f"SELECT * FROM CIDADES WHERE nome IN ({marcadores})", lote):
+                        encontrados[linha[1]] = linha
+
+            with self._lock:
+                guardar = self._geracao == geracao
+                for nome in faltantes:
+                    resultado[nome] = encontrados.get(nome)
+                    if guardar:
+                        self._por_nome.put(nome, resultado[nome])
+        return resultado
+
+    def por_estado(self, estado):
+        """Retorna a lista de linhas das cidades de um estado (UF), ordenada por nome."""
+        def carregar():
+            with sqlite_pool.conexao(self.caminho_db) as conn:
+                return conn.execute("SELECT * FROM CIDADES WHERE estado = ? ORDER BY nome",
+                                    (estado.upper(),)).fetchall()
+
+        return self._consultar(self._por_estado, estado.upper(), carregar)
+
+    def todas(self):
+        """Retorna todas as linhas de CIDADES, ordenadas por nome."""
+        def carregar():
+            with sqlite_pool.conexao(self.caminho_db) as conn:
+                return conn.execute("SELECT * FROM CIDADES ORDER BY nome").fetchall()
+
+        return self._consultar(self._lista_completa, None, carregar)
+
+    # --- Invalidação ---
+    def registrar_insercao(self, nome, estado):
+        """
+        Atualiza o cache após a inserção de uma cidade: remove a entrada do
+        nome (que pode estar em cache como inexistente), a lista do estado
+        e a lista completa, que serão recarregadas na próxima leitura.
+        """
+        with self._lock:
+            self._geracao += 1
+            self._por_nome.pop(nome)
+            self._por_estado.pop(estado.upper())
+            self._lista_completa.clear()
+
+    def invalidar(self):
+        """Esvazia todo o cache."""
+        with self._lock:
+            self._geracao += 1
+            self._por_nome.clear()
+            self._por_estado.clear()
+            self._lista_completa.clear()
+
+    # --- Métricas ---
+    def estatisticas(self):
+        """Retorna os contadores de acertos/falhas e o tamanho atual do cache."""
+        with self._lock:
+            total = self._acertos + self._falhas
+            return {
+                "acertos": self._acertos,
+                "falhas": self._falhas,
+                "taxa_acerto": self._acertos / total if total else 0.0,
+                "entradas_por_nome": len(self._por_nome),
+                "entradas_por_estado": len(self._por_estado),
+            }
@@ -1,5 +1,10 @@
-import sqlite3
-from pymongo import MongoClient
+import time
+
+from pymongo.errors import OperationFailure
+
+import metricas
+import mongo_client
+import sqlite_pool
 
 # --- Configurações de Conexão ---
 MONGO_URI = "mongodb://localhost:27017/"
@@ -7,116 +12,273 @@ DB_NAME = "poliglota_geoproj"
 COLLECTION_NAME = "locais_geo"
 SQLITE_DB = 'dados_estruturados.db'
 
+# --- Versionamento do Schema e dos Dados Iniciais ---
+# Incremente ao alterar tabelas, índices ou dados de exemplo: o setup completo
+# volta a rodar uma única vez; nas demais execuções é feita só uma verificação.
+VERSAO_SCHEMA_SQLITE = 4      # PRAGMA user_version (2: LOCAIS_GEO/R*Tree; 3: INDICES_SQLITE; 4: CIDADES_GEO)
+VERSAO_SCHEMA_MONGODB = 3     # gravada na collection COLLECTION_VERSOES (2: INDICES_LOCAIS_MONGODB; 3: únicos)
+COLLECTION_VERSOES = "_versao_schema"
+
+# --- Índices Declarados ---
+# Cobrem todas as consultas emitidas pelo serviço; confira os planos com: python explicar_consultas.py
+# MongoDB: chaves de cada índice das collections de locais ('locais_geo' e a visão 'locais_com_cidade')
+INDICES_LOCAIS_MONGODB = [
+    [("coordenadas.ponto", "2dsphere")],                   # $nearSphere, $geoNear e $geoWithin
+    [("cidade", 1), ("coordenadas.ponto", "2dsphere")],    # $geoNear filtrado por cidade
+    [("nome_local", 1)],                                   # local por nome (cruzamento)
+    [("cidade", 1)],                                       # locais por cidade
+]
+# Chaves únicas: um local por (nome_local, cidade), base dos upserts do buffer_locais. O índice
+# simples de 'nome_local' é mantido para o caso de o único não poder ser criado (duplicados antigos).
+INDICES_UNICOS_LOCAIS_MONGODB = [
+    [("nome_local", 1), ("cidade", 1)],
+]
+# SQLite: (nome do índice, tabela, colunas); CIDADES.nome já é indexado pela restrição UNIQUE
+INDICES_SQLITE = [
+    ("idx_cidades_estado", "CIDADES", "estado, nome"),     # cidades por estado, ordenadas pelo nome
+    ("idx_locais_geo_nome", "LOCAIS_GEO", "nome_local"),   # local por nome (backend R*Tree)
+    ("idx_locais_geo_cidade", "LOCAIS_GEO", "cidade"),     # filtro e contagem por cidade
+]
+
+# --- Centro e extensão (lat_min, lat_max, lon_min, lon_max) das cidades de exemplo ---
+CENTROS_CIDADES_EXEMPLO = {
+    "João Pessoa": (-7.1195, -34.8450, (-7.2500, -7.0500, -34.9700, -34.7900)),
+    "Recife": (-8.0476, -34.8770, (-8.1600, -7.9300, -35.0200, -34.8500)),
+    "Natal": (-5.7945, -35.2110, (-5.9000, -5.7000, -35.3000, -35.1500)),
+    "Campina Grande": (-7.2307, -35.8811, (-7.3500, -7.1500, -36.0000, -35.8000)),
+}
+
+# --- Locais de Exemplo (MongoDB e backend R*Tree do SQLite) ---
+# GeoJSON: [longitude, latitude] em 'ponto'
+LOCAIS_EXEMPLO = [
+    {
+        "nome_local": "Praça da Independência",
+        "cidade": "João Pessoa",
+        "coordenadas": {
+            "latitude": -7.11532,
+            "longitude": -34.861,
+            # GeoJSON: [longitude, latitude]
+            "ponto": {"type": "Point", "coordinates": [-34.861, -7.11532]}
+        },
+        "descricao": "Ponto turístico central da cidade."
+    },
+    {
+        "nome_local": "Estação Ciência",
+        "cidade": "João Pessoa",
+        "coordenadas": {
+            "latitude": -7.1189,
+            "longitude": -34.851,
+            "ponto": {"type": "Point", "coordinates": [-34.851, -7.1189]}
+        },
+        "descricao": "Espaço cultural e científico."
+    },
+    {
+        "nome_local": "Praça do Marco Zero",
+        "cidade": "Recife",
+        "coordenadas": {
+            "latitude": -8.0614,
+            "longitude": -34.8715,
+            "ponto": {"type": "Point", "coordinates": [-34.8715, -8.0614]}
+        },
+        "descricao": "Marco inicial da cidade."
+    },
+    {
+        "nome_local": "Museu da Cidade",
+        "cidade": "Campina Grande",
+        "coordenadas": {
+            "latitude": -7.2285,
+            "longitude": -35.8817,
+            "ponto": {"type": "Point", "coordinates": [-35.8817, -7.2285]}
+        },
+        "descricao": "Um dos principais museus de Campina Grande."
+    }
+]
+
+
+# ----------------------------------------------------------------------
+# 0. Índices declarados (idempotente: só cria os que faltam)
+# ----------------------------------------------------------------------
+def criar_indices_sqlite(conn):
+    """Cria os índices de INDICES_SQLITE que ainda não existem."""
+    for nome, tabela, colunas in INDICES_SQLITE:
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {nome} ON {tabela} ({colunas})")
+
+
+def criar_indices_mongodb(collection):
+    """
+    Cria na collection de locais os índices de INDICES_LOCAIS_MONGODB e de
+    INDICES_UNICOS_LOCAIS_MONGODB que ainda não existem. Um índice único que
+    falhe por documentos duplicados apenas gera um aviso.
+    """
+    for chaves in INDICES_LOCAIS_MONGODB:
+        collection.create_index(chaves)
+    for chaves in INDICES_UNICOS_LOCAIS_MONGODB:
+        try:
+            collection.create_index(chaves, unique=True)
+        except OperationFailure as e:
+            print(f"AVISO: índice único {chaves} não criado em '{collection.name}' (remova os duplicados com "
+                  f"'python buffer_locais.py deduplicar'). Erro: {e}")
+
 
 # ----------------------------------------------------------------------
 # 1. Configuração SQLite (Dados Tabulares Estruturados)
 # ----------------------------------------------------------------------
+@metricas.instrumentar("sqlite", itens=lambda executou: 0)
 def setup_sqlite():
-    """Conecta ao SQLite e cria a tabela 'CIDADES'."""
-    conn = sqlite3.connect(SQLITE_DB)
-    cursor = conn.cursor()
-
-    print("Configurando SQLite...")
-
-    # Cria a tabela de Cidades
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS CIDADES (
-            id INTEGER PRIMARY KEY,
-            nome TEXT UNIQUE NOT NULL,
-            estado TEXT NOT NULL,
-            populacao INTEGER
-        )
-    ''')
-
-    # Exemplo de inserção de dados
-    cidades = [
-        ('João Pessoa', 'PB', 817512),
-        ('Recife', 'PE', 1653461),
-        ('Natal', 'RN', 890480),
-        ('Campina Grande', 'PB', 411807)
-    ]
-
-    # Inserimos apenas se o nome for novo (UNIQUE)
-    cursor.executemany("INSERT OR IGNORE INTO CIDADES (nome, estado, populacao) VALUES (?, ?, ?)", cidades)
-
-    conn.commit()
-    conn.close()
+    """
+    Conecta ao SQLite (via pool compartilhado) e cria a tabela 'CIDADES' e
+    as tabelas do backend geoespacial R*Tree ('LOCAIS_GEO' e 'LOCAIS_GEO_RTREE').
+    Só executa se o banco estiver numa versão anterior a VERSAO_SCHEMA_SQLITE.
+
+    Returns:
+        bool: True se o setup foi executado, False se o banco já estava atualizado.
+    """
+    # O commit é feito automaticamente ao sair do bloco
+    with sqlite_pool.conexao(SQLITE_DB) as conn:
+        versao_atual = conn.execute("PRAGMA user_version").fetchone()[0]
+        if versao_atual >= VERSAO_SCHEMA_SQLITE:
+            print(f"SQLite já está na versão {versao_atual}. Pulando setup.")
+            return False
+
+        print("Configurando SQLite...")
+        cursor = conn.cursor()
+
+        # Cria a tabela de Cidades
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS CIDADES (
+                id INTEGER PRIMARY KEY,
+                nome TEXT UNIQUE NOT NULL,
+                estado TEXT NOT NULL,
+                populacao INTEGER
+            )
+        ''')
+
+        # Exemplo de inserção de dados
+        cidades = [
+            ('João Pessoa', 'PB', 817512),
+            ('Recife', 'PE', 1653461),
+            ('Natal', 'RN', 890480),
+            ('Campina Grande', 'PB', 411807)
+        ]
+
+        # Inserimos apenas se o nome for novo (UNIQUE)
+        cursor.executemany("INSERT OR IGNORE INTO CIDADES (nome, estado, populacao) VALUES (?, ?, ?)", cidades)
+
+        # Centro (obrigatório) e extensão opcional de cada cidade, usados na atribuição
+        # de locais à cidade mais próxima/que os contém (atribuicao_cidades.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS CIDADES_GEO (
+                cidade_id INTEGER PRIMARY KEY REFERENCES CIDADES (id),
+                latitude REAL NOT NULL,
+                longitude REAL NOT NULL,
+                lat_min REAL,
+                lat_max REAL,
+                lon_min REAL,
+                lon_max REAL
+            )
+        ''')
+        cursor.executemany(
+            "INSERT OR IGNORE INTO CIDADES_GEO SELECT id, ?, ?, ?, ?, ?, ? FROM CIDADES WHERE nome = ?",
+            [(latitude, longitude, *extensao, nome)
+             for nome, (latitude, longitude, extensao) in CENTROS_CIDADES_EXEMPLO.items()])
+
+        # Locais para o backend geoespacial R*Tree (GEO_BACKEND = "sqlite"), que
+        # dispensa o MongoDB nas buscas por raio
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS LOCAIS_GEO (
+                id INTEGER PRIMARY KEY,
+                nome_local TEXT NOT NULL,
+                cidade TEXT,
+                latitude REAL NOT NULL,
+                longitude REAL NOT NULL,
+                descricao TEXT
+            )
+        ''')
+        # Cada ponto é uma caixa degenerada (min = max) no R*Tree, com o mesmo id de LOCAIS_GEO
+        cursor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS LOCAIS_GEO_RTREE USING rtree(id, min_lat, max_lat, min_lon, max_lon)")
+
+        if cursor.execute("SELECT COUNT(*) FROM LOCAIS_GEO").fetchone()[0] == 0:
+            cursor.executemany(
+                "INSERT INTO LOCAIS_GEO (nome_local, cidade, latitude, longitude, descricao) VALUES (?, ?, ?, ?, ?)",
+                [(local["nome_local"], local["cidade"], local["coordenadas"]["latitude"],
+                  local["coordenadas"]["longitude"], local["descricao"]) for local in LOCAIS_EXEMPLO])
+            cursor.execute("INSERT INTO LOCAIS_GEO_RTREE SELECT id, latitude, latitude, longitude, longitude FROM LOCAIS_GEO")
+
+        criar_indices_sqlite(conn)
+
+        # Registra a versão na mesma transação dos dados
+        cursor.execute(f"PRAGMA user_version = {VERSAO_SCHEMA_SQLITE}")
+
     print("SQLite configurado e populado com sucesso.")
+    return True
 
 
 # ----------------------------------------------------------------------
 # 2. Configuração MongoDB (Documentos Geoespaciais)
 # ----------------------------------------------------------------------
+@metricas.instrumentar("mongodb", itens=lambda executou: 0)
 def setup_mongodb():
-    """Conecta ao MongoDB, cria a collection e o índice geoespacial."""
+    """
+    Conecta ao MongoDB, cria a collection e o índice geoespacial.
+    Só executa se a versão registrada for anterior a VERSAO_SCHEMA_MONGODB.
+
+    Returns:
+        bool: True se o setup foi executado, False caso contrário.
+    """
     try:
-        client = MongoClient(MONGO_URI)
-        db = client[DB_NAME]
+        db = mongo_client.obter_cliente(MONGO_URI)[DB_NAME]
         collection = db[COLLECTION_NAME]
+        versoes = db[COLLECTION_VERSOES]
+
+        registro = versoes.find_one({"_id": COLLECTION_NAME})
+        if registro and registro.get("versao", 0) >= VERSAO_SCHEMA_MONGODB:
+            print(f"MongoDB já está na versão {registro['versao']}. Pulando setup.")
+            return False
 
         print("Configurando MongoDB...")
 
-        # --- CRIAÇÃO DO ÍNDICE GEOESPACIAL 2dSPHERE ---
+        # --- CRIAÇÃO DOS ÍNDICES (inclusive o GEOESPACIAL 2dSPHERE) ---
         # ESSENCIAL para realizar buscas eficientes por raio ($nearSphere).
-        collection.create_index([("coordenadas.ponto", "2dsphere")])
-        print("Índice '2dsphere' criado/verificado.")
-
-        # Exemplo de documentos (usando GeoJSON [longitude, latitude] para 'ponto')
-        locais = [
-            {
-                "nome_local": "Praça da Independência",
-                "cidade": "João Pessoa",
-                "coordenadas": {
-                    "latitude": -7.11532,
-                    "longitude": -34.861,
-                    # GeoJSON: [longitude, latitude]
-                    "ponto": {"type": "Point", "coordinates": [-34.861, -7.11532]}
-                },
-                "descricao": "Ponto turístico central da cidade."
-            },
-            {
-                "nome_local": "Estação Ciência",
-                "cidade": "João Pessoa",
-                "coordenadas": {
-                    "latitude": -7.1189,
-                    "longitude": -34.851,
-                    "ponto": {"type": "Point", "coordinates": [-34.851, -7.1189]}
-                },
-                "descricao": "Espaço cultural e científico."
-            },
-            {
-                "nome_local": "Praça do Marco Zero",
-                "cidade": "Recife",
-                "coordenadas": {
-                    "latitude": -8.0614,
-                    "longitude": -34.8715,
-                    "ponto": {"type": "Point", "coordinates": [-34.8715, -8.0614]}
-                },
-                "descricao": "Marco inicial da cidade."
-            },
-            {
-                "nome_local": "Museu da Cidade",
-                "cidade": "Campina Grande",
-                "coordenadas": {
-                    "latitude": -7.2285,
-                    "longitude": -35.8817,
-                    "ponto": {"type": "Point", "coordinates": [-35.8817, -7.2285]}
-                },
-                "descricao": "Um dos principais museus de Campina Grande."
-            }
-        ]
+        criar_indices_mongodb(collection)
+        print(f"{len(INDICES_LOCAIS_MONGODB) + len(INDICES_UNICOS_LOCAIS_MONGODB)} índices "
+              f"(inclusive o '2dsphere') criados/verificados.")
+
 
         # Inserir dados se a collection estiver vazia
         if collection.count_documents({}) == 0:
-            collection.insert_many(locais)
-            print(f"MongoDB populado com {len(locais)} locais.")
+            # Cópias: o insert_many acrescenta o _id aos documentos
+            collection.insert_many([dict(local) for local in LOCAIS_EXEMPLO])
+            print(f"MongoDB populado com {len(LOCAIS_EXEMPLO)} locais.")
         else:
             print("MongoDB já contém dados. Pulando inserção.")
 
+        versoes.update_one({"_id": COLLECTION_NAME}, {"$set": {"versao": VERSAO_SCHEMA_MONGODB}}, upsert=True)
+        return True
+
     except Exception as e:
         print(f"Erro ao conectar ou configurar MongoDB. Certifique-se de que o servidor está rodando. Erro: {e}")
+        metricas.registrar_erro("setup_mongodb", "mongodb")
+        return False
+
+
+# ----------------------------------------------------------------------
+# 3. Inicialização com medição de tempo
+# ----------------------------------------------------------------------
+def garantir_bancos_configurados():
+    """
+    Executa setup_sqlite() e setup_mongodb() medindo o tempo de cada um.
+
+    Returns:
+        dict: Para cada banco, se o setup completo rodou e quanto tempo levou (ms).
+    """
+    tempos = {}
+    for nome, setup in (("sqlite", setup_sqlite), ("mongodb", setup_mongodb)):
+        inicio = time.perf_counter()
+        executou = setup()
+        tempos[nome] = {"executou_setup": executou, "ms": round((time.perf_counter() - inicio) * 1000, 2)}
+    return tempos
 
 
 if __name__ == '__main__':
-    setup_sqlite()
-    setup_mongodb()
+    print(garantir_bancos_configurados())
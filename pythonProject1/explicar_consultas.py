@@ -0,0 +1,187 @@
+import argparse
+import contextlib
+import json
+import sys
+
+from pymongo.errors import PyMongoError
+
+import database_setup
+import geoprocessing_service
+import mongo_client
+import sqlite_pool
+import visao_locais_cidades
+from sqlite_geo import IndiceRTreeSQLite, _COLUNAS_LOCAL, _COLUNAS_CIDADE
+
+# Valores de exemplo usados para montar as consultas (o plano não depende deles)
+_LOCAL = database_setup.LOCAIS_EXEMPLO[0]
+_NOME, _CIDADE = _LOCAL["nome_local"], _LOCAL["cidade"]
+_LAT, _LON = _LOCAL["coordenadas"]["latitude"], _LOCAL["coordenadas"]["longitude"]
+_CAIXA = geoprocessing_service.geometria_caixa(_LAT - 0.05, _LON - 0.05, _LAT + 0.05, _LON + 0.05)
+
+
+# ----------------------------------------------------------------------
+# 1. Formatos de consulta emitidos pelo serviço
+# ----------------------------------------------------------------------
+def consultas_mongodb():
+    """
+    (descrição, collection, tipo, consulta, varredura esperada) de cada
+    consulta ao MongoDB; filtros e pipelines vêm das próprias funções do serviço.
+    """
+    locais, visao = database_setup.COLLECTION_NAME, visao_locais_cidades.COLLECTION_VISAO
+    return [
+        ("local por nome (cruzamento)", locais, "find", {"nome_local": _NOME}, False),
+        ("locais por cidade", locais, "find", {"cidade": _CIDADE}, False),
+        ("buffer: locais existentes (nome, cidade)", locais, "find",
+         {"$or": [{"nome_local": _NOME, "cidade": _CIDADE}, {"nome_local": "Recife", "cidade": "Recife"}]}, False),
+        ("busca por raio ($nearSphere)", locais, "find", geoprocessing_service.filtro_raio(_LAT, _LON, 2), False),
+        ("distâncias no servidor ($geoNear)", locais, "aggregate",
+         geoprocessing_service._pipeline_geo_near(_LAT, _LON, 2), False),
+        ("k vizinhos da cidade ($geoNear + cidade)", locais, "aggregate",
+         geoprocessing_service._pipeline_geo_near(_LAT, _LON, cidade=_CIDADE, limite=10), False),
+        ("locais na área ($geoWithin)", locais, "find", geoprocessing_service.filtro_area(_CAIXA), False),
+        ("contagem por cidade (toda a collection)", locais, "aggregate",
+         [{"$group": {"_id": "$cidade", "total": {"$sum": 1}}}], True),
+        ("visão: local por nome", visao, "find", {"nome_local": _NOME}, False),
+        ("visão: locais por cidade", visao, "find", {"cidade": _CIDADE}, False),
+    ]
+
+
+def consultas_sqlite():
+    """(descrição, SQL, parâmetros, varredura esperada) de cada consulta ao SQLite."""
+    caixa = (_LAT - 0.05, _LAT + 0.05, _LON - 0.05, _LON + 0.05)
+    return [
+        ("cidade por nome", "SELECT * FROM CIDADES WHERE nome = ?", (_CIDADE,), False),
+        ("cidades por nomes (lote)", "SELECT * FROM CIDADES WHERE nome IN (?, ?)", (_CIDADE, "Recife"), False),
+        ("cidades por estado", "SELECT * FROM CIDADES WHERE estado = ? ORDER BY nome", ("PB",), False),
+        ("todas as cidades", "SELECT * FROM CIDADES ORDER BY nome", (), True),
+        ("R*Tree: locais na caixa", IndiceRTreeSQLite.sql_caixa(), caixa, False),
+        ("R*Tree: locais da cidade na caixa", IndiceRTreeSQLite.sql_caixa(com_cidade=True), caixa + (_CIDADE,), False),
+        ("R*Tree: locais na caixa + cidades",
+         IndiceRTreeSQLite.sql_caixa(f"{_COLUNAS_LOCAL}, {_COLUNAS_CIDADE}",
+                                     "LEFT JOIN CIDADES c ON c.nome = l.cidade"), caixa, False),
+        ("R*Tree: local por nome + cidade",
+         f"SELECT {_COLUNAS_LOCAL}, {_COLUNAS_CIDADE} FROM LOCAIS_GEO l LEFT JOIN CIDADES c ON c.nome = l.cidade "
+         "WHERE l.nome_local = ? ORDER BY l.id LIMIT 1", (_NOME,), False),
+        ("R*Tree: contagem por cidade",
+         "SELECT cidade, COUNT(*) AS total FROM LOCAIS_GEO GROUP BY cidade ORDER BY total DESC", (), True),
+    ]
+
+
+# ----------------------------------------------------------------------
+# 2. Planos de execução
+# ----------------------------------------------------------------------
+def _planos_vencedores(explicacao):
+    """Todos os 'winningPlan' de uma saída de explain() (em find e em cada estágio de aggregate)."""
+    if isinstance(explicacao, dict):
+        for chave, valor in explicacao.items():
+            if chave == "winningPlan":
+                yield valor
+            else:
+                yield from _planos_vencedores(valor)
+    elif isinstance(explicacao, list):
+        for item in explicacao:
+            yield from _planos_vencedores(item)
+
+
+def _estagios(plano, estagios, indices):
+    """Percorre a árvore do plano acumulando os estágios e os índices usados."""
+    if isinstance(plano, dict):
+        if "stage" in plano:
+            estagios.append(plano["stage"])
+        if "indexName" in plano:
+            indices.add(plano["indexName"])
+        for valor in plano.values():
+            _estagios(valor, estagios, indices)
+    elif isinstance(plano, list):
+        for item in plano:
+            _estagios(item, estagios, indices)
+
+
+def explicar_mongodb():
+    """Executa explain() (verbosidade queryPlanner) em cada consulta de consultas_mongodb()."""
+    db = mongo_client.obter_cliente(database_setup.MONGO_URI)[database_setup.DB_NAME]
+    relatorio = []
+    for descricao, colecao, tipo, consulta, varredura_esperada in consultas_mongodb():
+        try:
+            if tipo == "find":
+                explicacao = db[colecao].find(consulta).explain()
+            else:
+                explicacao = db.command("explain", {"aggregate": colecao, "pipeline": consulta, "cursor": {}},
+                                        verbosity="queryPlanner")
+        except PyMongoError as e:
+            relatorio.append({"banco": "mongodb", "consulta": descricao, "erro": str(e)})
+            continue
+
+        estagios, indices = [], set()
+        for plano in _planos_vencedores(explicacao):
+            _estagios(plano, estagios, indices)
+        varredura = "COLLSCAN" in estagios
+        relatorio.append({
+            "banco": "mongodb",
+            "consulta": descricao,
+            "plano": " <- ".join(estagios),
+            "indices": sorted(indices),
+            "varredura": varredura,
+            "alerta": varredura and not varredura_esperada,
+        })
+    return relatorio
+
+
+def explicar_sqlite():
+    """Executa EXPLAIN QUERY PLAN em cada consulta de consultas_sqlite()."""
+    relatorio = []
+    with sqlite_pool.conexao(database_setup.SQLITE_DB) as conn:
+        for descricao, sql, parametros, varredura_esperada in consultas_sqlite():
+            detalhes = [linha[3] for linha in conn.execute(f"EXPLAIN QUERY PLAN {sql}", parametros)]
+            # "SCAN tabela" lê a tabela (ou um índice) inteira; no R*Tree, "VIRTUAL TABLE INDEX" usa a árvore
+            varredura = any(detalhe.startswith("SCAN") and "VIRTUAL TABLE INDEX" not in detalhe
+                            for detalhe in detalhes)
+            relatorio.append({
+                "banco": "sqlite",
+                "consulta": descricao,
+                "plano": " | ".join(detalhes),
+                "varredura": varredura,
+                "alerta": varredura and not varredura_esperada,
+            })
+    return relatorio
+
+
+def gerar_relatorio(incluir_mongodb=True):
+    """Planos de todas as consultas; cada item traz 'alerta' = varredura inesperada."""
+    relatorio = explicar_sqlite()
+    if incluir_mongodb:
+        try:
+            relatorio += explicar_mongodb()
+        except PyMongoError as e:
+            print(f"ERRO: não foi possível explicar as consultas do MongoDB. Erro: {e}")
+    return relatorio
+
+
+def relatorio_texto(relatorio):
+    linhas = []
+    for item in relatorio:
+        if "erro" in item:
+            marca, plano = "ERRO", item["erro"]
+        else:
+            marca = "SCAN!" if item["alerta"] else ("scan" if item["varredura"] else "ok")
+            plano = item["plano"] + (f" [{', '.join(item['indices'])}]" if item.get("indices") else "")
+        linhas.append(f"{marca:<6}{item['banco']:<9}{item['consulta']:<42}{plano}")
+    return "\n".join(linhas)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Planos de execução das consultas do serviço (explain).")
+    parser.add_argument("--sem-mongodb", action="store_true", help="Explica apenas as consultas do SQLite.")
+    parser.add_argument("--json", action="store_true", help="Saída em JSON.")
+    args = parser.parse_args()
+
+    # Aplica os índices declarados antes de explicar (mensagens do setup vão para o stderr)
+    with contextlib.redirect_stdout(sys.stderr):
+        database_setup.setup_sqlite()
+        if not args.sem_mongodb:
+            database_setup.setup_mongodb()
+
+    relatorio = gerar_relatorio(incluir_mongodb=not args.sem_mongodb)
+    print(json.dumps(relatorio, indent=2, ensure_ascii=False) if args.json else relatorio_texto(relatorio))
+    # Código de saída 1 se alguma consulta fizer varredura inesperada (útil em CI)
+    sys.exit(1 if any(item.get("alerta") for item in relatorio) else 0)
@@ -1,40 +1,148 @@
-from geopy.distance import great_circle
-from pymongo import MongoClient
+from geopy.distance import EARTH_RADIUS, great_circle
+import numpy as np
 from pymongo.errors import OperationFailure
-import sqlite3
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import metricas
+import mongo_client
+import snapshot_locais
+import visao_locais_cidades
+from city_cache import CacheCidades
+from radius_cache import CacheRaios
+from spatial_index import IndiceEspacial
+from sqlite_geo import IndiceRTreeSQLite
 
 # --- Constantes de Conexão (Devem ser as mesmas do setup) ---
 MONGO_URI = "mongodb://localhost:27017/"
 DB_NAME = "poliglota_geoproj"
 COLLECTION_NAME = "locais_geo"
 SQLITE_DB = 'dados_estruturados.db'
-MONGO_CLIENT = MongoClient(MONGO_URI)
+
+# Cache de leitura da tabela CIDADES, compartilhado pelo serviço e pela interface
+CACHE_CIDADES = CacheCidades(SQLITE_DB)
+
+# Cache das buscas por raio no MongoDB (CACHE_RAIO=0 desativa): círculos contidos em um
+# círculo já buscado são respondidos em memória; inserções invalidam só os círculos do ponto
+CACHE_RAIOS = CacheRaios(ativo=os.getenv("CACHE_RAIO", "1") != "0")
+
+# Mesmo raio médio da Terra usado pelo geopy.great_circle (6371.009 km)
+RAIO_TERRA_KM = EARTH_RADIUS
+
+# Backend das buscas por raio: "mongo" ($nearSphere no servidor), "memoria"
+# (índice espacial em memória carregado uma única vez a partir da collection)
+# ou "sqlite" (tabela R*Tree em SQLITE_DB, sem depender do MongoDB)
+GEO_BACKEND = os.getenv("GEO_BACKEND", "mongo")
+
+_INDICE_MEMORIA = None
+# Com SNAPSHOT_INDICE_MEMORIA=1, o índice em memória é construído a partir do snapshot colunar
+# (snapshot_locais.py), atualizado apenas com os locais novos, em vez de ler todos os documentos
+USAR_SNAPSHOT_INDICE = os.getenv("SNAPSHOT_INDICE_MEMORIA", "0") == "1"
+_INDICE_MEMORIA_LOCK = threading.Lock()
+
+# Tamanho padrão dos lotes lidos do cursor nas buscas por raio em streaming
+TAMANHO_LOTE_BUSCA = 500
+
+# Projeção com apenas os campos usados pelas telas (sem '_id' e 'descricao')
+PROJECAO_RESUMO_LOCAL = {
+    "_id": 0,
+    "nome_local": 1,
+    "cidade": 1,
+    "coordenadas.latitude": 1,
+    "coordenadas.longitude": 1,
+}
+
+# Limite padrão de memória (MB) para os blocos intermediários da matriz de distâncias
+MEMORIA_MAXIMA_MATRIZ_MB = 256
+
+# Espaçamento máximo (graus) entre vértices nas bordas leste-oeste das caixas: as arestas
+# GeoJSON são geodésicas e, densificadas, acompanham os paralelos da caixa
+PASSO_VERTICES_CAIXA_GRAUS = 1.0
+# Aresta padrão (graus) das células da agregação em grade
+TAMANHO_CELULA_GRADE_GRAUS = 0.01
+
+# Threads das buscas por raio em lote (compartilham o pool de conexões do MongoClient)
+MAX_WORKERS_BUSCA_LOTE = int(os.getenv("MAX_WORKERS_BUSCA_LOTE", "8"))
+
+# Máximo de pontos enviados a um mapa; acima disso os locais são agrupados (LIMITE_PONTOS_MAPA)
+LIMITE_PONTOS_MAPA = int(os.getenv("LIMITE_PONTOS_MAPA", "2000"))
+# Aresta inicial (px na tela, no zoom do mapa) das células de agrupamento de pontos
+TAMANHO_GRUPO_MAPA_PX = 24
+
+
+def _colecao_locais():
+    """Collection 'locais_geo' do MongoClient compartilhado, criado apenas no primeiro uso."""
+    return mongo_client.obter_colecao(MONGO_URI, DB_NAME, COLLECTION_NAME)
+
+
+def _backend_geo():
+    """Backend que responde às buscas geoespaciais (para as métricas)."""
+    return "mongodb" if GEO_BACKEND == "mongo" else GEO_BACKEND
+
+
+def _indice_local():
+    """Índice que responde às buscas nos backends "memoria" e "sqlite" (None no backend "mongo")."""
+    if GEO_BACKEND == "memoria":
+        return obter_indice_memoria()
+    if GEO_BACKEND == "sqlite":
+        return obter_indice_sqlite()
+    return None
 
 
 # ----------------------------------------------------------------------
 # 1. FUNÇÃO: Calcular Distância entre dois pontos (geopy)
 # ----------------------------------------------------------------------
+def distancia_km(lat1, lon1, lat2, lon2):
+    """
+    Mesmo cálculo de calcular_distancia(), sem métricas: para laços internos
+    (ex: predicados de invalidação de cache, chamados uma vez por entrada).
+    """
+    return great_circle((lat1, lon1), (lat2, lon2)).km
+
+
+@metricas.instrumentar("geopy")
 def calcular_distancia(lat1, lon1, lat2, lon2):
     """
     Calcula a distância em quilômetros (km) entre dois pontos geográficos
     utilizando o método do Círculo Máximo (geopy.great_circle), que é
     mais preciso.
     """
-    ponto_a = (lat1, lon1)
-    ponto_b = (lat2, lon2)
-
-    distancia_km = great_circle(ponto_a, ponto_b).km
-    return distancia_km
+    return distancia_km(lat1, lon1, lat2, lon2)
 
 
 # ----------------------------------------------------------------------
 # 2. FUNÇÃO: Listar locais em um raio de distância (MongoDB GeoSpatial)
 # ----------------------------------------------------------------------
+def filtro_raio(latitude_central, longitude_central, raio_km):
+    """Monta o filtro $nearSphere usado nas buscas por raio (síncronas e assíncronas)."""
+    # MongoDB utiliza metros para $maxDistance em consultas geoespaciais
+    raio_metros = raio_km * 1000
+
+    return {
+        "coordenadas.ponto": {
+            "$nearSphere": {
+                "$geometry": {
+                    "type": "Point",
+                    "coordinates": [longitude_central, latitude_central]  # [lon, lat] padrão GeoJSON
+                },
+                "$maxDistance": raio_metros  # Distância máxima em metros
+            }
+        }
+    }
+
+
+@metricas.instrumentar(_backend_geo)
 def buscar_locais_em_raio(latitude_central, longitude_central, raio_km):
     """
     Lista os locais no MongoDB que estão dentro de um raio de distância
     em km, utilizando a consulta geoespacial $nearSphere.
 
+    Com GEO_BACKEND = "memoria" ou "sqlite", a consulta é respondida pelo
+    índice espacial em memória ou pelo R*Tree do SQLite, com o mesmo
+    resultado (e ordem) do $nearSphere.
+
     Args:
         latitude_central (float): Latitude do ponto de busca.
         longitude_central (float): Longitude do ponto de busca.
@@ -43,36 +151,520 @@ def buscar_locais_em_raio(latitude_central, longitude_central, raio_km):
     Returns:
         list: Lista de documentos JSON (locais) encontrados.
     """
-    collection = MONGO_CLIENT[DB_NAME][COLLECTION_NAME]
+    indice = _indice_local()
+    if indice is not None:
+        return indice.buscar_em_raio(latitude_central, longitude_central, raio_km)
 
-    # MongoDB utiliza metros para $maxDistance em consultas geoespaciais
-    raio_metros = raio_km * 1000
+    try:
+        # Responde pelo cache quando o círculo está dentro de um círculo já buscado
+        return CACHE_RAIOS.buscar(latitude_central, longitude_central, raio_km, _consultar_raio_mongo)
+
+    except OperationFailure as e:
+        print(f"ERRO: Verifique se o índice '2dsphere' foi criado no MongoDB. Erro: {e}")
+        metricas.registrar_erro("buscar_locais_em_raio", "mongodb")
+        return []
+
+
+def _consultar_raio_mongo(latitude_central, longitude_central, raio_km):
+    """Executa o $nearSphere no MongoDB, sem passar pelo cache."""
+    collection = _colecao_locais()
+    resultados = collection.find(filtro_raio(latitude_central, longitude_central, raio_km))
+
+    # Converte o cursor do MongoDB para uma lista Python
+    return list(resultados)
+
+
+def _aplicar_projecao(documento, projecao):
+    """Aplica uma projeção de inclusão (campos com 1, aceitando "a.b") a um documento em memória."""
+    incluir_id = projecao.get("_id", 1)
+    campos = [campo for campo, valor in projecao.items() if valor and campo != "_id"]
+    if not campos:
+        # Projeção apenas de exclusão (ex: {"_id": 0})
+        return {chave: valor for chave, valor in documento.items() if projecao.get(chave, 1)}
+
+    resultado = {"_id": documento["_id"]} if incluir_id and "_id" in documento else {}
+    for campo in campos:
+        origem, destino = documento, resultado
+        *caminho, ultimo = campo.split(".")
+        for parte in caminho:
+            origem = origem.get(parte) if isinstance(origem, dict) else None
+            destino = destino.setdefault(parte, {})
+        if isinstance(origem, dict) and ultimo in origem:
+            destino[ultimo] = origem[ultimo]
+    return resultado
+
+
+@metricas.instrumentar(_backend_geo)
+def iterar_locais_em_raio(latitude_central, longitude_central, raio_km, tamanho_lote=TAMANHO_LOTE_BUSCA,
+                          limite=None, pular=0, projecao=PROJECAO_RESUMO_LOCAL):
+    """
+    Versão em streaming de buscar_locais_em_raio(): em vez de materializar o
+    cursor inteiro, gera os resultados em lotes (listas) de até
+    `tamanho_lote` documentos, na mesma ordem por distância.
+
+    Args:
+        latitude_central (float): Latitude do ponto de busca.
+        longitude_central (float): Longitude do ponto de busca.
+        raio_km (float): Raio de busca em quilômetros.
+        tamanho_lote (int): Documentos por lote (também o batch_size do cursor).
+        limite (int, opcional): Máximo de documentos retornados.
+        pular (int): Documentos iniciais a ignorar (paginação skip/limit).
+        projecao (dict, opcional): Campos a retornar; None retorna o documento completo.
+            Por padrão, apenas nome, cidade e latitude/longitude.
+
+    Yields:
+        list: Lotes de documentos encontrados.
+    """
+    indice = _indice_local()
+    if indice is not None:
+        locais = indice.buscar_em_raio(latitude_central, longitude_central, raio_km, pular=pular, limite=limite)
+        for inicio in range(0, len(locais), tamanho_lote):
+            lote = locais[inicio:inicio + tamanho_lote]
+            yield lote if projecao is None else [_aplicar_projecao(local, projecao) for local in lote]
+        return
+
+    collection = _colecao_locais()
+    cursor = collection.find(filtro_raio(latitude_central, longitude_central, raio_km), projecao,
+                             skip=pular, limit=limite or 0, batch_size=tamanho_lote)
 
     try:
-        resultados = collection.find({
-            "coordenadas.ponto": {
-                "$nearSphere": {
-                    "$geometry": {
-                        "type": "Point",
-                        "coordinates": [longitude_central, latitude_central]  # [lon, lat] padrão GeoJSON
-                    },
-                    "$maxDistance": raio_metros  # Distância máxima em metros
-                }
-            }
-        })
+        lote = []
+        for local in cursor:
+            lote.append(local)
+            if len(lote) >= tamanho_lote:
+                yield lote
+                lote = []
+        if lote:
+            yield lote
+
+    except OperationFailure as e:
+        print(f"ERRO: Verifique se o índice '2dsphere' foi criado no MongoDB. Erro: {e}")
+        metricas.registrar_erro("iterar_locais_em_raio", "mongodb")
+    finally:
+        cursor.close()
+
+
+# ----------------------------------------------------------------------
+# 2.1 FUNÇÕES: Distância calculada no servidor e k vizinhos mais próximos ($geoNear)
+# ----------------------------------------------------------------------
+def _pipeline_geo_near(latitude_central, longitude_central, raio_km=None, cidade=None, limite=None,
+                       projecao=PROJECAO_RESUMO_LOCAL):
+    """
+    Monta o pipeline de agregação com $geoNear, que ordena por distância e
+    devolve a distância calculada pelo MongoDB no campo 'distancia_km'.
+    """
+    geo_near = {
+        "near": {"type": "Point", "coordinates": [longitude_central, latitude_central]},  # [lon, lat]
+        "key": "coordenadas.ponto",
+        "distanceField": "distancia_km",
+        "distanceMultiplier": 0.001,  # metros -> km
+        "spherical": True,
+    }
+    if raio_km is not None:
+        geo_near["maxDistance"] = raio_km * 1000
+    if cidade is not None:
+        geo_near["query"] = {"cidade": cidade}
+
+    pipeline = [{"$geoNear": geo_near}]
+    if limite:
+        pipeline.append({"$limit": limite})
+    if projecao is not None:
+        if any(valor for campo, valor in projecao.items() if campo != "_id"):
+            # Projeção de inclusão: mantém também a distância calculada
+            projecao = {**projecao, "distancia_km": 1}
+        pipeline.append({"$project": projecao})
+    return pipeline
+
+
+@metricas.instrumentar(_backend_geo)
+def iterar_locais_com_distancia(latitude_central, longitude_central, raio_km, tamanho_lote=TAMANHO_LOTE_BUSCA,
+                                limite=None, projecao=PROJECAO_RESUMO_LOCAL, cidade=None):
+    """
+    Como iterar_locais_em_raio(), mas cada documento já traz o campo
+    'distancia_km' calculado pelo MongoDB ($geoNear), dispensando o
+    recálculo no cliente. Opcionalmente filtra por `cidade`.
+
+    Yields:
+        list: Lotes de documentos, ordenados por distância.
+    """
+    indice = _indice_local()
+    if indice is not None:
+        locais = indice.buscar_com_distancia(latitude_central, longitude_central, raio_km,
+                                             limite=limite, cidade=cidade)
+        for inicio in range(0, len(locais), tamanho_lote):
+            lote = locais[inicio:inicio + tamanho_lote]
+            if projecao is not None:
+                lote = [dict(_aplicar_projecao(local, projecao), distancia_km=local["distancia_km"]) for local in lote]
+            yield lote
+        return
 
-        # Converte o cursor do MongoDB para uma lista Python
-        locais = list(resultados)
-        return locais
+    collection = _colecao_locais()
+    pipeline = _pipeline_geo_near(latitude_central, longitude_central, raio_km, cidade, limite, projecao)
 
+    try:
+        with collection.aggregate(pipeline, batchSize=tamanho_lote) as cursor:
+            lote = []
+            for local in cursor:
+                lote.append(local)
+                if len(lote) >= tamanho_lote:
+                    yield lote
+                    lote = []
+            if lote:
+                yield lote
+
+    except OperationFailure as e:
+        print(f"ERRO: Verifique se o índice '2dsphere' foi criado no MongoDB. Erro: {e}")
+        metricas.registrar_erro("iterar_locais_com_distancia", "mongodb")
+
+
+@metricas.instrumentar(_backend_geo)
+def buscar_k_mais_proximos(latitude_central, longitude_central, k, cidade=None, projecao=PROJECAO_RESUMO_LOCAL):
+    """
+    Retorna os `k` locais mais próximos de um ponto, sem limite de raio,
+    opcionalmente apenas da `cidade` informada.
+
+    Returns:
+        list: Até `k` documentos com 'distancia_km', do mais próximo ao mais distante.
+    """
+    indice = _indice_local()
+    if indice is not None:
+        locais = indice.mais_proximos(latitude_central, longitude_central, k, cidade=cidade)
+        if projecao is None:
+            return locais
+        return [dict(_aplicar_projecao(local, projecao), distancia_km=local["distancia_km"]) for local in locais]
+
+    collection = _colecao_locais()
+    try:
+        return list(collection.aggregate(
+            _pipeline_geo_near(latitude_central, longitude_central, cidade=cidade, limite=k, projecao=projecao)))
     except OperationFailure as e:
         print(f"ERRO: Verifique se o índice '2dsphere' foi criado no MongoDB. Erro: {e}")
+        metricas.registrar_erro("buscar_k_mais_proximos", "mongodb")
         return []
 
 
+# ----------------------------------------------------------------------
+# 2.2 Índices locais (backends "memoria" e "sqlite")
+# ----------------------------------------------------------------------
+def obter_indice_memoria():
+    """
+    Retorna o índice espacial em memória, carregando-o da collection
+    'locais_geo' (ou do snapshot colunar, com USAR_SNAPSHOT_INDICE) na
+    primeira chamada (uma única vez por processo).
+    """
+    global _INDICE_MEMORIA
+    if _INDICE_MEMORIA is None:
+        with _INDICE_MEMORIA_LOCK:
+            if _INDICE_MEMORIA is None:
+                collection = _colecao_locais()
+                if USAR_SNAPSHOT_INDICE:
+                    snapshot_locais.atualizar(collection=collection)
+                    indice = IndiceEspacial.de_snapshot(snapshot_locais.carregar())
+                else:
+                    indice = IndiceEspacial()
+                    indice.adicionar_varios(collection.find({}))
+                _INDICE_MEMORIA = indice
+    return _INDICE_MEMORIA
+
+
+def obter_indice_sqlite():
+    """Backend R*Tree sobre as tabelas LOCAIS_GEO/LOCAIS_GEO_RTREE de SQLITE_DB."""
+    return IndiceRTreeSQLite(SQLITE_DB)
+
+
+def registrar_local_no_indice(documento):
+    """
+    Mantém o índice em memória atualizado após uma escrita no MongoDB.
+    Se o índice ainda não foi carregado, nada é feito: a carga inicial
+    já incluirá o novo documento. No backend "sqlite", o local também é
+    gravado no R*Tree. Os círculos do cache de buscas por raio que
+    contêm o novo ponto são descartados.
+    """
+    coordenadas = documento.get("coordenadas", {})
+    if coordenadas.get("latitude") is not None and coordenadas.get("longitude") is not None:
+        CACHE_RAIOS.invalidar_ponto(coordenadas["latitude"], coordenadas["longitude"])
+    if _INDICE_MEMORIA is not None:
+        _INDICE_MEMORIA.adicionar(documento)
+    if GEO_BACKEND == "sqlite":
+        obter_indice_sqlite().adicionar(documento)
+
+
+def registrar_locais_no_indice(documentos):
+    """
+    Versão em lote de registrar_local_no_indice() para cargas em massa: o
+    cache de buscas por raio é esvaziado, o índice em memória é descartado
+    (recarregado no próximo uso) e, no backend "sqlite", os locais são
+    gravados no R*Tree numa única transação.
+    """
+    global _INDICE_MEMORIA
+    if not documentos:
+        return
+    CACHE_RAIOS.limpar()
+    with _INDICE_MEMORIA_LOCK:
+        _INDICE_MEMORIA = None
+    if GEO_BACKEND == "sqlite":
+        obter_indice_sqlite().adicionar_varios(documentos)
+
+
+def registrar_local_atualizado(anterior, documento):
+    """
+    Equivalente a registrar_local_no_indice() para um local já existente
+    cujo documento foi substituído (ex: upsert do buffer_locais). O índice
+    em memória troca o ponto pelo '_id', sem recarga; com USAR_SNAPSHOT_INDICE,
+    o snapshot (que só recebe locais novos) é marcado para reexportação.
+    """
+    for versao in (anterior, documento):
+        coordenadas = versao.get("coordenadas", {})
+        if coordenadas.get("latitude") is not None and coordenadas.get("longitude") is not None:
+            CACHE_RAIOS.invalidar_ponto(coordenadas["latitude"], coordenadas["longitude"])
+    with _INDICE_MEMORIA_LOCK:
+        if _INDICE_MEMORIA is not None:
+            _INDICE_MEMORIA.substituir(anterior, documento)
+        if USAR_SNAPSHOT_INDICE:
+            snapshot_locais.marcar_desatualizado()
+    if GEO_BACKEND == "sqlite":
+        indice = obter_indice_sqlite()
+        indice.remover(anterior.get("nome_local"), anterior.get("cidade"))
+        indice.adicionar(documento)
+
+
+# ----------------------------------------------------------------------
+# 2.3 FUNÇÕES: Consultas por área ($geoWithin) e agregação em grade
+# ----------------------------------------------------------------------
+def _backend_area():
+    """Backend das consultas por área: o R*Tree no backend "sqlite"; o MongoDB nos demais."""
+    return "sqlite" if GEO_BACKEND == "sqlite" else "mongodb"
+
+
+def _anel_caixa(lat_min, lon_min, lat_max, lon_max):
+    """Anel GeoJSON fechado (anti-horário) da caixa, com as bordas leste-oeste densificadas."""
+    passos = max(1, math.ceil((lon_max - lon_min) / PASSO_VERTICES_CAIXA_GRAUS))
+    longitudes = [lon_min + (lon_max - lon_min) * i / passos for i in range(passos + 1)]
+    return ([[lon, lat_min] for lon in longitudes] + [[lon, lat_max] for lon in reversed(longitudes)]
+            + [[lon_min, lat_min]])
+
+
+def geometria_caixa(lat_min, lon_min, lat_max, lon_max):
+    """
+    Geometria GeoJSON de uma caixa lat/lon. Se lon_min > lon_max, a caixa
+    cruza o antimeridiano e vira um MultiPolygon com as duas metades.
+    """
+    if lon_min <= lon_max:
+        return {"type": "Polygon", "coordinates": [_anel_caixa(lat_min, lon_min, lat_max, lon_max)]}
+    return {"type": "MultiPolygon", "coordinates": [[_anel_caixa(lat_min, lon_min, lat_max, 180.0)],
+                                                    [_anel_caixa(lat_min, -180.0, lat_max, lon_max)]]}
+
+
+def caixa_da_janela(latitude_central, longitude_central, zoom, largura_px=800, altura_px=450):
+    """
+    Caixa (lat_min, lon_min, lat_max, lon_max) visível num mapa Web Mercator
+    (tiles de 256 px, como o st.map) centrado no ponto, no nível de zoom dado.
+    """
+    graus_por_px = 360.0 / (256 * 2 ** zoom)
+    meia_largura = min(largura_px / 2 * graus_por_px, 180.0)
+    lon_min = (longitude_central - meia_largura + 180) % 360 - 180
+    lon_max = (longitude_central + meia_largura + 180) % 360 - 180
+    if meia_largura >= 180:
+        lon_min, lon_max = -180.0, 180.0
+
+    # Latitude -> y de Mercator (radianos), deslocado meia altura da janela
+    y_centro = math.asinh(math.tan(math.radians(latitude_central)))
+    meia_altura = math.radians(altura_px / 2 * graus_por_px)
+    lat_min = math.degrees(math.atan(math.sinh(y_centro - meia_altura)))
+    lat_max = math.degrees(math.atan(math.sinh(y_centro + meia_altura)))
+    return lat_min, lon_min, lat_max, lon_max
+
+
+def filtro_area(geometria):
+    """Filtro $geoWithin para um Polygon/MultiPolygon GeoJSON (usa o índice 2dsphere)."""
+    return {"coordenadas.ponto": {"$geoWithin": {"$geometry": geometria}}}
+
+
+@metricas.instrumentar(_backend_area)
+def buscar_locais_em_poligono(geometria, limite=None, projecao=PROJECAO_RESUMO_LOCAL):
+    """
+    Lista os locais dentro de um Polygon ou MultiPolygon GeoJSON
+    (coordenadas [longitude, latitude]), com $geoWithin.
+
+    Args:
+        geometria (dict): Geometria GeoJSON da área.
+        limite (int, opcional): Máximo de documentos retornados.
+        projecao (dict, opcional): Campos a retornar; None retorna o documento completo.
+
+    Returns:
+        list: Documentos encontrados (sem ordem definida).
+    """
+    if GEO_BACKEND == "sqlite":
+        locais = obter_indice_sqlite().buscar_em_poligono(geometria, limite=limite)
+        return locais if projecao is None else [_aplicar_projecao(local, projecao) for local in locais]
+
+    collection = _colecao_locais()
+    try:
+        return list(collection.find(filtro_area(geometria), projecao, limit=limite or 0))
+    except OperationFailure as e:
+        print(f"ERRO: Verifique a geometria e o índice '2dsphere' no MongoDB. Erro: {e}")
+        metricas.registrar_erro("buscar_locais_em_poligono", "mongodb")
+        return []
+
+
+def buscar_locais_em_caixa(lat_min, lon_min, lat_max, lon_max, limite=None, projecao=PROJECAO_RESUMO_LOCAL):
+    """
+    Lista os locais dentro de uma caixa lat/lon (ex: a janela visível do
+    mapa, ver caixa_da_janela()). Aceita caixas que cruzam o antimeridiano
+    (lon_min > lon_max).
+    """
+    return buscar_locais_em_poligono(geometria_caixa(lat_min, lon_min, lat_max, lon_max), limite, projecao)
+
+
+@metricas.instrumentar(_backend_area)
+def agregar_em_grade(tamanho_celula_graus=TAMANHO_CELULA_GRADE_GRAUS, geometria=None, por_cidade=False):
+    """
+    Conta os locais por célula de uma grade lat/lon, no próprio servidor
+    (pipeline de agregação), sem trazer os documentos para o cliente. Útil
+    para desenhar mapas de calor de áreas densas.
+
+    Args:
+        tamanho_celula_graus (float): Aresta das células, em graus.
+        geometria (dict, opcional): Restringe a contagem a um Polygon/MultiPolygon GeoJSON.
+        por_cidade (bool): Separa as contagens de cada célula por 'cidade'.
+
+    Returns:
+        list[dict]: {"latitude", "longitude" (centro da célula), "total"[, "cidade"]},
+        da célula mais cheia para a mais vazia.
+    """
+    if GEO_BACKEND == "sqlite":
+        return obter_indice_sqlite().agregar_em_grade(tamanho_celula_graus, geometria, por_cidade)
+
+    chave = {
+        "lat": {"$floor": {"$divide": ["$coordenadas.latitude", tamanho_celula_graus]}},
+        "lon": {"$floor": {"$divide": ["$coordenadas.longitude", tamanho_celula_graus]}},
+    }
+    saida = {
+        "_id": 0,
+        "latitude": {"$multiply": [{"$add": ["$_id.lat", 0.5]}, tamanho_celula_graus]},
+        "longitude": {"$multiply": [{"$add": ["$_id.lon", 0.5]}, tamanho_celula_graus]},
+        "total": 1,
+    }
+    if por_cidade:
+        chave["cidade"] = "$cidade"
+        saida["cidade"] = "$_id.cidade"
+
+    pipeline = [{"$match": filtro_area(geometria)}] if geometria else []
+    pipeline += [{"$group": {"_id": chave, "total": {"$sum": 1}}}, {"$project": saida}, {"$sort": {"total": -1}}]
+
+    collection = _colecao_locais()
+    try:
+        return list(collection.aggregate(pipeline))
+    except OperationFailure as e:
+        print(f"ERRO: Falha na agregação em grade. Erro: {e}")
+        metricas.registrar_erro("agregar_em_grade", "mongodb")
+        return []
+
+
+@metricas.instrumentar(_backend_area, itens=len)
+def contar_locais_por_cidade(geometria=None):
+    """
+    Conta os locais por 'cidade' (opcionalmente só dentro de uma geometria
+    GeoJSON), no servidor.
+
+    Returns:
+        dict: {cidade: total}, da cidade com mais locais para a com menos.
+    """
+    if GEO_BACKEND == "sqlite":
+        return obter_indice_sqlite().contar_por_cidade(geometria)
+
+    pipeline = [{"$match": filtro_area(geometria)}] if geometria else []
+    pipeline += [{"$group": {"_id": "$cidade", "total": {"$sum": 1}}}, {"$sort": {"total": -1}}]
+
+    collection = _colecao_locais()
+    try:
+        return {grupo["_id"]: grupo["total"] for grupo in collection.aggregate(pipeline)}
+    except OperationFailure as e:
+        print(f"ERRO: Falha na contagem por cidade. Erro: {e}")
+        metricas.registrar_erro("contar_locais_por_cidade", "mongodb")
+        return {}
+
+
+# ----------------------------------------------------------------------
+# 2.4 FUNÇÕES: Busca por raio em vários centros (em paralelo)
+# ----------------------------------------------------------------------
+def _chave_local(documento):
+    """Identifica um local vindo de qualquer backend ('_id' do MongoDB ou nome + coordenadas)."""
+    if "_id" in documento:
+        return documento["_id"]
+    coordenadas = documento.get("coordenadas", {})
+    return documento.get("nome_local"), coordenadas.get("latitude"), coordenadas.get("longitude")
+
+
+def mesclar_resultados_raio(resultados):
+    """
+    Une os resultados de várias buscas por raio sem repetir locais.
+
+    Returns:
+        list: Cópias dos locais únicos (na ordem em que aparecem), cada uma com
+        'centros': índices das consultas cujo raio contém o local.
+    """
+    unicos = {}
+    for indice, locais in enumerate(resultados):
+        for local in locais:
+            chave = _chave_local(local)
+            if chave in unicos:
+                unicos[chave]["centros"].append(indice)
+            else:
+                unicos[chave] = dict(local, centros=[indice])
+    return list(unicos.values())
+
+
+@metricas.instrumentar(_backend_geo, itens=lambda lote: lote["estatisticas"]["locais"])
+def buscar_locais_em_varios_raios(consultas, max_workers=MAX_WORKERS_BUSCA_LOTE, deduplicar=False):
+    """
+    Executa a mesma busca por raio (buscar_locais_em_raio) em muitos centros
+    ao mesmo tempo, num pool limitado de threads. Todas as threads usam o
+    MongoClient compartilhado do processo, cujo pool de conexões é
+    thread-safe (o mesmo vale para os backends "memoria" e "sqlite").
+
+    Args:
+        consultas (list[tuple[float, float, float]]): (lat, lon, raio_km) de cada centro.
+        max_workers (int): Máximo de buscas simultâneas.
+        deduplicar (bool): Se True, inclui também a união dos resultados sem repetições.
+
+    Returns:
+        dict: 'resultados' (lista de locais de cada consulta, na ordem de entrada),
+        'locais_unicos' (apenas com deduplicar=True) e 'estatisticas' (vazão agregada).
+    """
+    consultas = list(consultas)
+    inicio = time.perf_counter()
+    if consultas:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(consultas))),
+                                thread_name_prefix="busca-raio") as executor:
+            # map() devolve os resultados na ordem das consultas, não na de conclusão
+            resultados = list(executor.map(lambda consulta: buscar_locais_em_raio(*consulta), consultas))
+    else:
+        resultados = []
+    segundos = time.perf_counter() - inicio
+
+    total_locais = sum(len(locais) for locais in resultados)
+    lote = {
+        "resultados": resultados,
+        "estatisticas": {
+            "consultas": len(consultas),
+            "locais": total_locais,
+            "segundos": round(segundos, 4),
+            "consultas_por_segundo": round(len(consultas) / segundos, 1) if segundos else 0.0,
+            "locais_por_segundo": round(total_locais / segundos, 1) if segundos else 0.0,
+            "max_workers": max_workers,
+        },
+    }
+    if deduplicar:
+        lote["locais_unicos"] = mesclar_resultados_raio(resultados)
+        lote["estatisticas"]["locais_unicos"] = len(lote["locais_unicos"])
+    return lote
+
+
 # ----------------------------------------------------------------------
 # 3. FUNÇÃO: Consultar e Cruzar dados (MongoDB + SQLite)
 # ----------------------------------------------------------------------
+@metricas.instrumentar("poliglota", itens=lambda resultado: 0 if "erro" in resultado else 1)
 def cruzar_dados_local_cidade(nome_local):
     """
     Busca um local no MongoDB e cruza a informação da sua 'cidade'
@@ -80,26 +672,47 @@ def cruzar_dados_local_cidade(nome_local):
 
     Retorna um dicionário com os dados combinados.
     """
+    if GEO_BACKEND == "sqlite":
+        # Local e cidade na mesma consulta SQL (LOCAIS_GEO LEFT JOIN CIDADES)
+        with metricas.medir("cruzar_dados_local_cidade.local_e_cidade", "sqlite") as medicao:
+            encontrado = obter_indice_sqlite().local_com_cidade(nome_local)
+            medicao.itens = 1 if encontrado else 0
+        if encontrado is None:
+            return {"erro": f"Local '{nome_local}' não encontrado no SQLite (LOCAIS_GEO)."}
+        return _montar_dados_cruzados(*encontrado)
+
+    if visao_locais_cidades.VISAO_ATIVA:
+        # Leitura única na visão materializada (cidade já embutida no local)
+        with metricas.medir("cruzar_dados_local_cidade.visao", "mongodb") as medicao:
+            encontrado = visao_locais_cidades.local_com_cidade(nome_local)
+            medicao.itens = 1 if encontrado else 0
+        if encontrado is not None:
+            return _montar_dados_cruzados(*encontrado)
+        # Local ainda ausente da visão: segue para o cruzamento em tempo de leitura
+
     # 1. Buscar o local no MongoDB
-    collection = MONGO_CLIENT[DB_NAME][COLLECTION_NAME]
+    collection = _colecao_locais()
     # O .pop('_id') é para remover o ObjectId do MongoDB e facilitar a serialização/visualização
-    local_mongo = collection.find_one({"nome_local": nome_local}, {'_id': False})
+    with metricas.medir("cruzar_dados_local_cidade.local", "mongodb") as medicao:
+        local_mongo = collection.find_one({"nome_local": nome_local}, {'_id': False})
+        medicao.itens = 1 if local_mongo else 0
 
     if not local_mongo:
         return {"erro": f"Local '{nome_local}' não encontrado no MongoDB."}
 
     cidade_do_local = local_mongo.get("cidade")
 
-    # 2. Buscar informações adicionais da cidade no SQLite
-    conn = sqlite3.connect(SQLITE_DB)
-    cursor = conn.cursor()
-
-    # Busca a linha da cidade
-    cursor.execute("SELECT * FROM CIDADES WHERE nome = ?", (cidade_do_local,))
-    cidade_sqlite = cursor.fetchone()
-    conn.close()
+    # 2. Buscar informações adicionais da cidade no SQLite (através do cache de cidades)
+    with metricas.medir("cruzar_dados_local_cidade.cidade", "sqlite") as medicao:
+        cidade_sqlite = CACHE_CIDADES.por_nome(cidade_do_local)
+        medicao.itens = 1 if cidade_sqlite else 0
 
     # 3. Combinar e formatar os resultados
+    return _montar_dados_cruzados(local_mongo, cidade_sqlite)
+
+
+def _montar_dados_cruzados(local_mongo, cidade_sqlite):
+    """Monta o dicionário combinado (local do MongoDB + linha da cidade no SQLite)."""
     dados_cruzados = {
         "local_mongo_info": local_mongo,
         "cidade_sqlite_info": None
@@ -114,4 +727,318 @@ def cruzar_dados_local_cidade(nome_local):
             "fonte_db": "SQLite"
         }
 
-    return dados_cruzados
\ No newline at end of file
+    return dados_cruzados
+
+
+# ----------------------------------------------------------------------
+# 3.1 FUNÇÃO: Cruzamento em lote (sem consultas N+1)
+# ----------------------------------------------------------------------
+@metricas.instrumentar("poliglota")
+def cruzar_dados_locais_cidades(locais):
+    """
+    Versão em lote de cruzar_dados_local_cidade(). Aceita uma lista de nomes
+    de locais ou a lista de documentos retornada por buscar_locais_em_raio().
+
+    Os nomes são buscados no MongoDB com uma única consulta $in (documentos
+    já carregados não são buscados novamente), todas as cidades são
+    resolvidas pelo cache de cidades (as ausentes com um único
+    SELECT ... WHERE nome IN (...)) e o cruzamento é feito em memória.
+
+    Returns:
+        list[dict]: Um item por entrada, na mesma ordem e com a mesma
+        estrutura de cruzar_dados_local_cidade() (incluindo {"erro": ...}).
+    """
+    # 1. Resolver os documentos no MongoDB (uma única consulta para os nomes)
+    nomes = [local for local in locais if isinstance(local, str)]
+    encontrados = {}
+    if nomes:
+        collection = _colecao_locais()
+        with metricas.medir("cruzar_dados_locais_cidades.locais", "mongodb") as medicao:
+            for documento in collection.find({"nome_local": {"$in": list(set(nomes))}}, {'_id': False}):
+                # Mantém o primeiro documento por nome, como o find_one() da versão unitária
+                encontrados.setdefault(documento.get("nome_local"), documento)
+            medicao.itens = len(encontrados)
+
+    locais_mongo = []
+    for local in locais:
+        if isinstance(local, str):
+            locais_mongo.append(encontrados.get(local))
+        else:
+            locais_mongo.append({chave: valor for chave, valor in local.items() if chave != '_id'})
+
+    # 2. Buscar todas as cidades envolvidas no SQLite
+    # (as que não estão no cache de cidades são buscadas juntas, em SELECT ... IN)
+    cidades = [local["cidade"] for local in locais_mongo if local and local.get("cidade") is not None]
+    with metricas.medir("cruzar_dados_locais_cidades.cidades", "sqlite") as medicao:
+        cidades_sqlite = CACHE_CIDADES.por_nomes(cidades)
+        medicao.itens = len(cidades_sqlite)
+
+    # 3. Combinar em memória
+    resultados = []
+    for entrada, local_mongo in zip(locais, locais_mongo):
+        if not local_mongo:
+            resultados.append({"erro": f"Local '{entrada}' não encontrado no MongoDB."})
+        else:
+            resultados.append(_montar_dados_cruzados(local_mongo, cidades_sqlite.get(local_mongo.get("cidade"))))
+    return resultados
+
+
+@metricas.instrumentar(_backend_geo)
+def cruzar_locais_em_raio(latitude_central, longitude_central, raio_km):
+    """
+    Busca os locais dentro do raio e cruza cada um com a sua cidade. No
+    backend "sqlite", a busca e o cruzamento são uma única consulta SQL
+    (R*Tree + LEFT JOIN CIDADES); nos demais, é buscar_locais_em_raio()
+    seguido de cruzar_dados_locais_cidades().
+
+    Returns:
+        list[dict]: Um item por local, ordenado por distância, com a mesma
+        estrutura de cruzar_dados_local_cidade().
+    """
+    if GEO_BACKEND == "sqlite":
+        return [_montar_dados_cruzados(local, cidade) for local, cidade in
+                obter_indice_sqlite().buscar_com_cidades_em_raio(latitude_central, longitude_central, raio_km)]
+    return cruzar_dados_locais_cidades(buscar_locais_em_raio(latitude_central, longitude_central, raio_km))
+
+
+# ----------------------------------------------------------------------
+# 4. FUNÇÕES: Distâncias em lote (NumPy vetorizado)
+# ----------------------------------------------------------------------
+def _angulo_central(sin_lat1, cos_lat1, lon1, sin_lat2, cos_lat2, lon2):
+    """
+    Ângulo central (rad) entre pontos, a partir de senos/cossenos das
+    latitudes já calculados. Mesma fórmula (atan2) do geopy.great_circle.
+    """
+    delta_lon = lon2 - lon1
+    cos_delta_lon, sin_delta_lon = np.cos(delta_lon), np.sin(delta_lon)
+
+    return np.arctan2(
+        np.hypot(cos_lat2 * sin_delta_lon,
+                 cos_lat1 * sin_lat2 - sin_lat1 * cos_lat2 * cos_delta_lon),
+        sin_lat1 * sin_lat2 + cos_lat1 * cos_lat2 * cos_delta_lon
+    )
+
+
+def _distancia_great_circle_km(lat1, lon1, lat2, lon2):
+    """
+    Núcleo vetorizado do Círculo Máximo. Usa exatamente a mesma fórmula
+    (atan2) e o mesmo raio do geopy.great_circle, com broadcasting do NumPy
+    entre os argumentos (em graus).
+    """
+    lat1, lon1 = np.radians(lat1), np.radians(lon1)
+    lat2, lon2 = np.radians(lat2), np.radians(lon2)
+
+    angulo = _angulo_central(np.sin(lat1), np.cos(lat1), lon1,
+                             np.sin(lat2), np.cos(lat2), lon2)
+    return RAIO_TERRA_KM * angulo
+
+
+@metricas.instrumentar("numpy")
+def calcular_distancias_um_para_muitos(lat_origem, lon_origem, latitudes, longitudes):
+    """
+    Calcula, de uma só vez, a distância em km entre um ponto de origem e
+    vários destinos. Substitui o laço de chamadas a calcular_distancia().
+
+    Os resultados coincidem com geopy.great_circle com diferença absoluta
+    inferior a 1e-6 km (1 mm), apenas por arredondamento de ponto flutuante.
+
+    Args:
+        lat_origem (float): Latitude do ponto de origem.
+        lon_origem (float): Longitude do ponto de origem.
+        latitudes (array-like): Latitudes dos destinos.
+        longitudes (array-like): Longitudes dos destinos.
+
+    Returns:
+        numpy.ndarray: Distâncias em km, na mesma ordem dos destinos.
+    """
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    if latitudes.shape != longitudes.shape:
+        raise ValueError("latitudes e longitudes devem ter o mesmo tamanho.")
+
+    return _distancia_great_circle_km(float(lat_origem), float(lon_origem), latitudes, longitudes)
+
+
+@metricas.instrumentar("numpy")
+def calcular_distancias_pareadas(latitudes_a, longitudes_a, latitudes_b, longitudes_b):
+    """
+    Calcula a distância em km entre pares de pontos (A[i], B[i]) de forma
+    vetorizada. Mesma tolerância de calcular_distancias_um_para_muitos().
+
+    Args:
+        latitudes_a, longitudes_a (array-like): Coordenadas dos pontos A.
+        latitudes_b, longitudes_b (array-like): Coordenadas dos pontos B.
+
+    Returns:
+        numpy.ndarray: Distâncias em km, uma por par.
+    """
+    coords = [np.asarray(c, dtype=np.float64)
+              for c in (latitudes_a, longitudes_a, latitudes_b, longitudes_b)]
+    if len({c.shape for c in coords}) != 1:
+        raise ValueError("Todos os vetores de coordenadas devem ter o mesmo tamanho.")
+
+    return _distancia_great_circle_km(*coords)
+
+
+# ----------------------------------------------------------------------
+# 5. FUNÇÕES: Matriz de distâncias muitos-para-muitos (em blocos)
+# ----------------------------------------------------------------------
+def _preparar_conjunto(latitudes, longitudes):
+    """Converte um conjunto de pontos para (sin_lat, cos_lat, lon_rad)."""
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    if latitudes.ndim != 1 or latitudes.shape != longitudes.shape:
+        raise ValueError("latitudes e longitudes devem ser vetores 1D do mesmo tamanho.")
+
+    lat_rad = np.radians(latitudes)
+    return np.sin(lat_rad), np.cos(lat_rad), np.radians(longitudes)
+
+
+def _linhas_por_bloco(n_colunas, memoria_max_mb):
+    """
+    Quantidade de linhas por bloco para que os temporários do cálculo
+    (cerca de 8 matrizes float64 do tamanho do bloco) caibam no limite.
+    """
+    bytes_por_linha = max(n_colunas, 1) * 8 * 8
+    return max(1, int(memoria_max_mb * 1024 * 1024) // bytes_por_linha)
+
+
+def _blocos_de_distancia(conjunto_a, conjunto_b, memoria_max_mb):
+    """Gera (inicio, fim, distancias_km) para cada bloco de linhas de A x B."""
+    sin_a, cos_a, lon_a = conjunto_a
+    sin_b, cos_b, lon_b = conjunto_b
+    passo = _linhas_por_bloco(len(lon_b), memoria_max_mb)
+
+    for inicio in range(0, len(lon_a), passo):
+        fim = min(inicio + passo, len(lon_a))
+        angulo = _angulo_central(sin_a[inicio:fim, None], cos_a[inicio:fim, None], lon_a[inicio:fim, None],
+                                 sin_b[None, :], cos_b[None, :], lon_b[None, :])
+        yield inicio, fim, RAIO_TERRA_KM * angulo
+
+
+@metricas.instrumentar("numpy")
+def calcular_matriz_distancias(latitudes_a, longitudes_a, latitudes_b, longitudes_b,
+                               memoria_max_mb=MEMORIA_MAXIMA_MATRIZ_MB, saida=None, arquivo_memmap=None,
+                               dtype=np.float64):
+    """
+    Calcula a matriz completa de distâncias (km) entre todos os pontos do
+    conjunto A e todos os pontos do conjunto B, processando A em blocos de
+    linhas para que a memória intermediária respeite `memoria_max_mb`.
+
+    A matriz final (len(A) x len(B)) pode ser gravada em um array fornecido
+    pelo chamador (`saida`) ou em um arquivo mapeado em memória
+    (`arquivo_memmap`), o que permite matrizes maiores que a RAM.
+
+    Args:
+        latitudes_a, longitudes_a (array-like): Coordenadas do conjunto A.
+        latitudes_b, longitudes_b (array-like): Coordenadas do conjunto B.
+        memoria_max_mb (float): Limite de memória dos blocos intermediários.
+        saida (numpy.ndarray, opcional): Array de destino com shape (len(A), len(B)).
+        arquivo_memmap (str, opcional): Caminho de um arquivo .npy a ser criado
+            e preenchido via memória mapeada (ignorado se `saida` for informado).
+        dtype: Tipo dos valores da matriz criada (padrão float64).
+
+    Returns:
+        numpy.ndarray: A matriz de distâncias (o próprio `saida`, se informado).
+    """
+    conjunto_a = _preparar_conjunto(latitudes_a, longitudes_a)
+    conjunto_b = _preparar_conjunto(latitudes_b, longitudes_b)
+    shape = (len(conjunto_a[2]), len(conjunto_b[2]))
+
+    if saida is not None:
+        if saida.shape != shape:
+            raise ValueError(f"O array de saída deve ter shape {shape}, recebido {saida.shape}.")
+    elif arquivo_memmap is not None:
+        saida = np.lib.format.open_memmap(arquivo_memmap, mode="w+", dtype=dtype, shape=shape)
+    else:
+        saida = np.empty(shape, dtype=dtype)
+
+    for inicio, fim, bloco in _blocos_de_distancia(conjunto_a, conjunto_b, memoria_max_mb):
+        saida[inicio:fim] = bloco
+
+    if isinstance(saida, np.memmap):
+        saida.flush()
+    return saida
+
+
+@metricas.instrumentar("numpy", itens=lambda pares: len(pares[2]))
+def buscar_pares_ate_distancia(latitudes_a, longitudes_a, latitudes_b, longitudes_b, limite_km,
+                               memoria_max_mb=MEMORIA_MAXIMA_MATRIZ_MB):
+    """
+    Modo esparso da matriz de distâncias: retorna apenas os pares (i, j)
+    cuja distância entre A[i] e B[j] é menor ou igual a `limite_km`, sem
+    nunca materializar a matriz completa. Útil para deduplicação e
+    agrupamento de locais próximos.
+
+    Args:
+        latitudes_a, longitudes_a (array-like): Coordenadas do conjunto A.
+        latitudes_b, longitudes_b (array-like): Coordenadas do conjunto B.
+        limite_km (float): Distância máxima (inclusiva) em km.
+        memoria_max_mb (float): Limite de memória dos blocos intermediários.
+
+    Returns:
+        tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]: Índices em A,
+        índices em B e as respectivas distâncias em km.
+    """
+    conjunto_a = _preparar_conjunto(latitudes_a, longitudes_a)
+    conjunto_b = _preparar_conjunto(latitudes_b, longitudes_b)
+
+    indices_a, indices_b, distancias = [], [], []
+    for inicio, _, bloco in _blocos_de_distancia(conjunto_a, conjunto_b, memoria_max_mb):
+        linhas, colunas = np.nonzero(bloco <= limite_km)
+        indices_a.append(linhas + inicio)
+        indices_b.append(colunas)
+        distancias.append(bloco[linhas, colunas])
+
+    if not distancias:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float64)
+    return np.concatenate(indices_a), np.concatenate(indices_b), np.concatenate(distancias)
+
+
+# ----------------------------------------------------------------------
+# 6. FUNÇÃO: Agrupamento de pontos para mapas (NumPy vetorizado)
+# ----------------------------------------------------------------------
+@metricas.instrumentar("numpy", itens=lambda grupos: grupos["total"].size)
+def agrupar_pontos_mapa(latitudes, longitudes, zoom, limite_pontos=LIMITE_PONTOS_MAPA,
+                        tamanho_celula_px=TAMANHO_GRUPO_MAPA_PX):
+    """
+    Reduz os pontos de um mapa a no máximo `limite_pontos` representantes.
+    Até o limite, os pontos são devolvidos como estão; acima dele, são
+    agrupados em células quadradas de `tamanho_celula_px` pixels na tela
+    (Web Mercator, no zoom dado) e cada célula vira um único ponto no
+    centróide dos seus locais. Se ainda houver células demais, a aresta é
+    dobrada até caber no limite.
+
+    Args:
+        latitudes, longitudes (array-like): Coordenadas dos locais (NaN são ignorados).
+        zoom (float): Nível de zoom do mapa (tiles de 256 px, como o st.map).
+
+    Returns:
+        dict: Colunas 'lat', 'lon' e 'total' (arrays NumPy, 'total' = locais de cada ponto).
+    """
+    lat = np.asarray(latitudes, dtype=np.float64)
+    lon = np.asarray(longitudes, dtype=np.float64)
+    validos = ~(np.isnan(lat) | np.isnan(lon))
+    lat, lon = lat[validos], lon[validos]
+
+    if lat.size <= limite_pontos:
+        return {"lat": lat, "lon": lon, "total": np.ones(lat.size, dtype=np.int64)}
+
+    # Posição em pixels do "mundo" no zoom 0 (0 a 256 nos dois eixos)
+    x = (lon + 180.0) / 360.0 * 256
+    seno = np.sin(np.radians(np.clip(lat, -85.05113, 85.05113)))
+    y = (0.5 - np.log((1 + seno) / (1 - seno)) / (4 * np.pi)) * 256
+
+    tamanho = tamanho_celula_px / 2 ** zoom
+    while True:
+        celulas_por_linha = int(256 / tamanho) + 1
+        chaves = np.floor(x / tamanho).astype(np.int64) * celulas_por_linha + np.floor(y / tamanho).astype(np.int64)
+        celulas, grupo = np.unique(chaves, return_inverse=True)
+        if celulas.size <= max(limite_pontos, 1):
+            break
+        tamanho *= 2
+
+    total = np.bincount(grupo)
+    return {"lat": np.bincount(grupo, weights=lat) / total,
+            "lon": np.bincount(grupo, weights=lon) / total,
+            "total": total}
@@ -1,9 +1,21 @@
+import time
 import streamlit as st
+import numpy as np
 import pandas as pd
-from geoprocessing_service import calcular_distancia, buscar_locais_em_raio, cruzar_dados_local_cidade
-from pymongo import MongoClient
+import pydeck as pdk
+from geoprocessing_service import (distancia_km, iterar_locais_com_distancia, cruzar_dados_local_cidade,
+                                   CACHE_CIDADES, CACHE_RAIOS, caixa_da_janela,
+                                   geometria_caixa, buscar_locais_em_caixa, agregar_em_grade, contar_locais_por_cidade,
+                                   agrupar_pontos_mapa)
 import sqlite3
+import atribuicao_cidades
+import buffer_locais
 import database_setup
+import metricas
+import mongo_client
+import sqlite_pool
+import visao_locais_cidades
+from query_cache import CacheConsultas
 
 # --- Constantes de Conexão ---
 MONGO_URI = database_setup.MONGO_URI
@@ -11,13 +23,46 @@ DB_NAME = database_setup.DB_NAME
 COLLECTION_NAME = database_setup.COLLECTION_NAME
 SQLITE_DB = database_setup.SQLITE_DB
 
-# Cliente MongoDB é inicializado fora das funções para reutilização
-try:
-    MONGO_CLIENT = MongoClient(MONGO_URI)
-except Exception as e:
-    st.error(f"Erro ao inicializar o cliente MongoDB: {e}")
-    st.stop()
+# --- Limites do cache de leituras da interface: (máximo de entradas, TTL em segundos) ---
+LIMITES_CACHE_INTERFACE = {
+    "locais_por_cidade": (128, 300),
+    "nomes_locais": (1, 300),
+    "busca_raio": (256, 120),
+    "area_mapa": (64, 60),
+}
+
+# Marca o início desta execução do script (cada interação no Streamlit reexecuta o arquivo)
+INICIO_EXECUCAO = time.perf_counter()
+
+
+def get_locais_collection():
+    """Collection de locais do MongoClient compartilhado (criado de forma preguiçosa, uma vez por processo)."""
+    return mongo_client.obter_colecao(MONGO_URI, DB_NAME, COLLECTION_NAME)
+
 
+@st.cache_resource(show_spinner="Preparando os bancos de dados...")
+def inicializar_bancos() -> dict:
+    """
+    Garante o schema e os dados iniciais uma única vez por processo (e não a
+    cada rerun). Entre processos, o versionamento do database_setup reduz o
+    setup a uma verificação rápida.
+
+    Returns:
+        dict: Tempos do setup de cada banco (ver database_setup.garantir_bancos_configurados).
+    """
+    tempos = database_setup.garantir_bancos_configurados()
+    # Visão materializada locais + cidade (construída só na primeira vez)
+    visao_locais_cidades.garantir_visao()
+    return tempos
+
+
+@st.cache_resource
+def get_cache_consultas() -> CacheConsultas:
+    """
+    Cache de leituras compartilhado por todas as sessões do processo. As
+    entradas são invalidadas seletivamente pelas funções de inserção.
+    """
+    return CacheConsultas(limites=LIMITES_CACHE_INTERFACE)
 
 
 def get_all_cities_from_sqlite() -> list[str]:
@@ -27,14 +72,11 @@ def get_all_cities_from_sqlite() -> list[str]:
     Returns:
         list[str]: Lista de cidades formatadas.
     """
-    conn = sqlite3.connect(SQLITE_DB)
-    cursor = conn.cursor()
-    try:
-        cursor.execute("SELECT nome, estado FROM CIDADES ORDER BY nome")
-        cidades = cursor.fetchall()
-        return [f"{cidade[0]} ({cidade[1]})" for cidade in cidades]
-    finally:
-        conn.close()
+    # Leitura através do cache de cidades (invalidado em insert_new_city_sqlite)
+    with metricas.medir("interface.cidades", "sqlite") as medicao:
+        cidades = CACHE_CIDADES.todas()
+        medicao.itens = len(cidades)
+    return [f"{cidade[1]} ({cidade[2]})" for cidade in cidades]
 
 
 def get_locals_by_city(city_name: str) -> list[dict]:
@@ -47,17 +89,150 @@ def get_locals_by_city(city_name: str) -> list[dict]:
     Returns:
         list[dict]: Lista de documentos de locais.
     """
-    collection = MONGO_CLIENT[DB_NAME][COLLECTION_NAME]
     # Limpa o nome da cidade removendo o sufixo do estado (ex: "João Pessoa (PB)" -> "João Pessoa")
     city_name_clean = city_name.split(' (')[0]
 
-    locais = list(collection.find({"cidade": city_name_clean}, {'_id': 0}))
-    return locais
+    def carregar():
+        with metricas.medir("interface.locais_por_cidade", "mongodb") as medicao:
+            if visao_locais_cidades.VISAO_ATIVA:
+                # Visão materializada: os locais já trazem estado/população da cidade ('cidade_info')
+                locais = visao_locais_cidades.locais_da_cidade(city_name_clean)
+            else:
+                locais = list(get_locais_collection().find({"cidade": city_name_clean}, {'_id': 0}))
+            medicao.itens = len(locais)
+        return locais
+
+    # Leitura em cache, invalidada apenas quando um local desta cidade é inserido
+    return get_cache_consultas().obter("locais_por_cidade", (city_name_clean,), carregar)
+
+
+def get_all_local_names() -> list[str]:
+    """
+    Retorna o nome de todos os locais cadastrados no MongoDB (em cache).
+
+    Returns:
+        list[str]: Nomes dos locais.
+    """
+    def carregar():
+        collection = get_locais_collection()
+        with metricas.medir("interface.nomes_locais", "mongodb") as medicao:
+            nomes = [l['nome_local'] for l in collection.find({}, {'nome_local': 1, '_id': 0})]
+            medicao.itens = len(nomes)
+        return nomes
+
+    return get_cache_consultas().obter("nomes_locais", (), carregar)
+
+
+def get_locals_in_radius(center_lat: float, center_lon: float, radius_km: float, max_results: int) -> dict:
+    """
+    Busca os locais no raio (via $geoNear, em streaming) e retorna apenas as
+    colunas exibidas na tela. O resultado fica em cache até que um novo local
+    seja inserido dentro deste círculo.
+
+    Returns:
+        dict: Colunas 'Local', 'Cidade', 'Distância (km)', 'lat' e 'lon'.
+    """
+    def carregar():
+        # Os resultados chegam em lotes (streaming) e apenas com os campos exibidos;
+        # acumulamos somente as colunas da tabela, sem guardar os documentos
+        colunas = {"Local": [], "Cidade": [], "Distância (km)": [], "lat": [], "lon": []}
+        for lote in iterar_locais_com_distancia(center_lat, center_lon, radius_km, limite=max_results):
+            colunas["Local"].extend(local['nome_local'] for local in lote)
+            colunas["Cidade"].extend(local['cidade'] for local in lote)
+            # Distância calculada pelo próprio MongoDB ($geoNear), sem recálculo no cliente
+            colunas["Distância (km)"].extend(f"{local['distancia_km']:.3f}" for local in lote)
+            colunas["lat"].extend(local['coordenadas']['latitude'] for local in lote)
+            colunas["lon"].extend(local['coordenadas']['longitude'] for local in lote)
+        return colunas
+
+    return get_cache_consultas().obter("busca_raio", (center_lat, center_lon, radius_km, max_results), carregar)
+
+
+def get_area_summary(lat_min: float, lon_min: float, lat_max: float, lon_max: float,
+                     cell_size: float, max_points: int) -> dict:
+    """
+    Resumo de uma área do mapa calculado no servidor: células da grade com a
+    contagem de locais (mapa de calor), total por cidade e, só se a área
+    tiver até `max_points` locais, os pontos individuais.
+
+    Returns:
+        dict: 'celulas' (lista), 'por_cidade' (dict) e 'pontos' (colunas ou None).
+    """
+    def carregar():
+        geometria = geometria_caixa(lat_min, lon_min, lat_max, lon_max)
+        por_cidade = contar_locais_por_cidade(geometria)
+        pontos = None
+        if sum(por_cidade.values()) <= max_points:
+            locais = buscar_locais_em_caixa(lat_min, lon_min, lat_max, lon_max, limite=max_points)
+            pontos = {"Local": [local['nome_local'] for local in locais],
+                      "Cidade": [local['cidade'] for local in locais],
+                      "lat": [local['coordenadas']['latitude'] for local in locais],
+                      "lon": [local['coordenadas']['longitude'] for local in locais]}
+        return {"celulas": agregar_em_grade(cell_size, geometria), "por_cidade": por_cidade, "pontos": pontos}
+
+    return get_cache_consultas().obter("area_mapa", (lat_min, lon_min, lat_max, lon_max, cell_size, max_points),
+                                       carregar)
+
+
+def _exibir_mapa(latitudes, longitudes, zoom: int) -> None:
+    """
+    Mostra os locais no st.map. Acima de LIMITE_PONTOS_MAPA pontos, exibe
+    apenas os representantes de cada grupo (agrupar_pontos_mapa), com o
+    raio do círculo proporcional à quantidade de locais agrupados.
+    """
+    grupos = agrupar_pontos_mapa(latitudes, longitudes, zoom)
+    # Metros por pixel na latitude média e raio de ~3 px por ponto (crescendo com a raiz do total)
+    latitude_media = float(np.mean(grupos["lat"])) if grupos["lat"].size else 0.0
+    metros_por_px = 156543.03 * np.cos(np.radians(latitude_media)) / 2 ** zoom
+    df_mapa = pd.DataFrame({"lat": grupos["lat"], "lon": grupos["lon"],
+                            "raio": 3 * metros_por_px * np.sqrt(grupos["total"])})
+    st.map(df_mapa, size="raio", zoom=zoom)
+
+    total_locais = int(grupos["total"].sum())
+    if len(df_mapa) < total_locais:
+        st.caption(f"Mapa agrupado: {len(df_mapa)} pontos representando {total_locais} locais "
+                   f"(aproxime o zoom para ver os locais individualmente).")
+
+
+def _caixa_contem(lat_min: float, lon_min: float, lat_max: float, lon_max: float, lat: float, lon: float) -> bool:
+    """Indica se o ponto está na caixa (que pode cruzar o antimeridiano, com lon_min > lon_max)."""
+    if not lat_min <= lat <= lat_max:
+        return False
+    return lon_min <= lon <= lon_max if lon_min <= lon_max else (lon >= lon_min or lon <= lon_max)
+
+
+def _invalidar_leituras_do_local(cidade: str, lat: float, lon: float) -> None:
+    """Invalida somente as leituras em cache afetadas por um novo local."""
+    cache = get_cache_consultas()
+    cache.invalidar("locais_por_cidade", lambda argumentos: argumentos == (cidade,))
+    cache.invalidar("nomes_locais")
+    # Apenas as buscas cujo círculo contém o novo ponto
+    cache.invalidar("busca_raio",
+                    lambda argumentos: distancia_km(argumentos[0], argumentos[1], lat, lon) <= argumentos[2])
+    # Apenas as áreas do mapa que contêm o novo ponto
+    cache.invalidar("area_mapa", lambda argumentos: _caixa_contem(*argumentos[:4], lat, lon))
+
+
+def _invalidar_leituras_dos_locais(gravados: list) -> None:
+    """Callback do buffer de escrita: invalida as leituras afetadas pelo lote (posições antiga e nova)."""
+    for anterior, documento in gravados:
+        for versao in (anterior, documento):
+            if versao is not None and versao.get("coordenadas"):
+                _invalidar_leituras_do_local(versao["cidade"], versao["coordenadas"]["latitude"],
+                                             versao["coordenadas"]["longitude"])
+
+
+@st.cache_resource
+def get_buffer_locais() -> buffer_locais.BufferLocais:
+    """Buffer de escrita compartilhado pelas sessões: agrupa as inserções de locais em lotes (bulk_write)."""
+    return buffer_locais.obter_buffer_locais(cache_cidades=CACHE_CIDADES, ao_gravar=_invalidar_leituras_dos_locais)
 
 
 def insert_new_local_mongodb(nome: str, cidade: str, lat: float, lon: float, descricao: str) -> tuple[bool, str]:
     """
-    Insere um novo local (Ponto de Interesse) no MongoDB com coordenadas GeoJSON.
+    Insere (ou atualiza, se já existir com o mesmo nome e cidade) um local
+    (Ponto de Interesse) no MongoDB com coordenadas GeoJSON. A gravação é
+    feita pelo buffer de escrita, junto com as inserções das demais sessões.
 
     Args:
         nome (str): Nome do local.
@@ -69,8 +244,6 @@ def insert_new_local_mongodb(nome: str, cidade: str, lat: float, lon: float, des
     Returns:
         tuple[bool, str]: Status (sucesso/falha) e mensagem.
     """
-    collection = MONGO_CLIENT[DB_NAME][COLLECTION_NAME]
-
     if not (nome and cidade and lat and lon):
         return False, "Erro: Todos os campos obrigatórios (Nome, Cidade, Lat, Lon) devem ser preenchidos."
 
@@ -86,13 +259,19 @@ def insert_new_local_mongodb(nome: str, cidade: str, lat: float, lon: float, des
             },
             "descricao": descricao
         }
-        collection.insert_one(documento)
-        return True, f"Local '{nome}' inserido com sucesso no MongoDB."
+        # O buffer mantém índices, visão e caches sincronizados após gravar o lote
+        with metricas.medir("interface.inserir_local", "mongodb") as medicao:
+            resultado = get_buffer_locais().gravar(documento)
+            medicao.itens = 1
+        if resultado["status"] in ("rejeitado", "erro"):
+            return False, f"Erro: {resultado['mensagem']}"
+        return True, resultado["mensagem"]
     except Exception as e:
         return False, f"Erro ao inserir no MongoDB: {e}"
 
 
-def insert_new_city_sqlite(nome: str, estado: str, populacao: int) -> tuple[bool, str]:
+def insert_new_city_sqlite(nome: str, estado: str, populacao: int, latitude: float = None,
+                           longitude: float = None) -> tuple[bool, str]:
     """
     Insere uma nova cidade no SQLite.
 
@@ -100,28 +279,32 @@ def insert_new_city_sqlite(nome: str, estado: str, populacao: int) -> tuple[bool
         nome (str): Nome da cidade.
         estado (str): Sigla do estado (UF).
         populacao (int): População estimada.
+        latitude, longitude (float, opcionais): Centro da cidade (CIDADES_GEO), usado na atribuição de locais.
 
     Returns:
         tuple[bool, str]: Status (sucesso/falha) e mensagem.
     """
-    conn = sqlite3.connect(SQLITE_DB)
-    cursor = conn.cursor()
-
     if not (nome and estado and populacao):
-        conn.close()
         return False, "Erro: Todos os campos obrigatórios (Nome, Estado, População) devem ser preenchidos."
 
     try:
-        cursor.execute("INSERT INTO CIDADES (nome, estado, populacao) VALUES (?, ?, ?)",
-                       (nome, estado.upper(), populacao))
-        conn.commit()
+        # O commit é feito ao sair do bloco; em caso de erro, a transação é desfeita
+        with metricas.medir("interface.inserir_cidade", "sqlite") as medicao, \
+                sqlite_pool.conexao(SQLITE_DB) as conn:
+            cursor = conn.execute("INSERT INTO CIDADES (nome, estado, populacao) VALUES (?, ?, ?)",
+                                  (nome, estado.upper(), populacao))
+            if latitude is not None and longitude is not None:
+                atribuicao_cidades.gravar_centro_cidade(conn, cursor.lastrowid, latitude, longitude)
+            medicao.itens = 1
+        CACHE_CIDADES.registrar_insercao(nome, estado)
+        # Locais já cadastrados com esta cidade passam a embutir os seus dados na visão
+        visao_locais_cidades.registrar_cidade(nome)
+        get_cache_consultas().invalidar("locais_por_cidade", lambda argumentos: argumentos == (nome,))
         return True, f"Cidade '{nome} ({estado.upper()})' inserida com sucesso no SQLite."
     except sqlite3.IntegrityError:
         return False, f"Erro: A cidade '{nome}' já existe no banco de dados SQLite."
     except Exception as e:
         return False, f"Erro ao inserir no SQLite: {e}"
-    finally:
-        conn.close()
 
 
 
@@ -134,15 +317,15 @@ st.markdown(
 
 # Garante que os bancos de dados estão configurados antes da execução da interface
 try:
-    database_setup.setup_sqlite()
-    database_setup.setup_mongodb()
+    tempos_setup = inicializar_bancos()
 except Exception as e:
     st.error(f"Erro de Conexão/Setup do Banco de Dados. Verifique se o MongoDB está rodando. Detalhes: {e}")
     st.stop()
 
 st.sidebar.title("Opções")
 page = st.sidebar.radio("Navegar",
-                        ["Visão Geral e Mapa", "Busca Geoespacial", "Inserção de Dados", "Cruzamento de Dados"])
+                        ["Visão Geral e Mapa", "Busca Geoespacial", "Inserção de Dados", "Cruzamento de Dados",
+                         "Área e Densidade", "Métricas"])
 
 
 if page == "Inserção de Dados":
@@ -160,9 +343,17 @@ if page == "Inserção de Dados":
         new_city_state = st.text_input("Estado (UF, ex: BA)", max_chars=2, key="city_state_sql")
     with col3:
         new_city_pop = st.number_input("População Estimada", min_value=100, step=10000, format="%d", key="city_pop_sql")
+    col1, col2 = st.columns(2)
+    with col1:
+        new_city_lat = st.number_input("Latitude do Centro (opcional)", value=None, min_value=-90.0, max_value=90.0,
+                                       format="%.6f", key="city_lat_sql")
+    with col2:
+        new_city_lon = st.number_input("Longitude do Centro (opcional)", value=None, min_value=-180.0,
+                                       max_value=180.0, format="%.6f", key="city_lon_sql")
 
     if st.button("Inserir Cidade no SQLite"):
-        success, message = insert_new_city_sqlite(new_city_name, new_city_state, new_city_pop)
+        success, message = insert_new_city_sqlite(new_city_name, new_city_state, new_city_pop,
+                                                  new_city_lat, new_city_lon)
         if success:
             st.success(message)
         else:
@@ -199,27 +390,30 @@ elif page == "Visão Geral e Mapa":
     cities_options = get_all_cities_from_sqlite()
     selected_city = st.selectbox("Selecione a Cidade:", cities_options)
 
+    map_zoom = st.slider("Zoom do Mapa", min_value=3, max_value=18, value=12, key="overview_zoom")
+
     if selected_city:
         locais = get_locals_by_city(selected_city)
 
         st.subheader(f"Locais em {selected_city} (Total: {len(locais)})")
 
+        # Dados da cidade embutidos pela visão materializada (sem consulta ao SQLite)
+        cidade_info = locais[0].get("cidade_info") if locais else None
+        if cidade_info:
+            st.caption(f"Estado: {cidade_info['estado']} | "
+                       f"População estimada: {cidade_info['populacao']:,}".replace(',', '.'))
+
         if locais:
-            # Prepara os dados para o st.dataframe e st.map
-            data = [
-                {
-                    "Local": local.get("nome_local"),
-                    "Descrição": local.get("descricao"),
-                    "lat": local.get("coordenadas", {}).get("latitude"),
-                    "lon": local.get("coordenadas", {}).get("longitude")
-                } for local in locais
-            ]
-
-            df_locais = pd.DataFrame(data)
-
-            # Mostra o mapa e o Dataframe
-            st.map(df_locais[['lat', 'lon']].dropna(), zoom=12)
-            st.dataframe(df_locais.drop(columns=['lat', 'lon']), use_container_width=True)
+            # Prepara os dados em colunas (sem uma lista de dicionários por linha)
+            coordenadas = [local.get("coordenadas", {}) for local in locais]
+            latitudes = np.array([c.get("latitude", np.nan) for c in coordenadas], dtype=np.float64)
+            longitudes = np.array([c.get("longitude", np.nan) for c in coordenadas], dtype=np.float64)
+
+            # Mostra o mapa (agrupado se houver muitos locais) e o Dataframe
+            _exibir_mapa(latitudes, longitudes, map_zoom)
+            st.dataframe(pd.DataFrame({"Local": [local.get("nome_local") for local in locais],
+                                       "Descrição": [local.get("descricao") for local in locais]}),
+                         use_container_width=True)
 
         else:
             st.info(f"Nenhum local encontrado no MongoDB para a cidade de {selected_city.split(' (')[0]}.")
@@ -227,7 +421,8 @@ elif page == "Visão Geral e Mapa":
 
 elif page == "Busca Geoespacial":
     st.header("🔍 Busca de Locais em Raio (MongoDB GeoSpatial)")
-    st.markdown("Utiliza a função geoespacial `$nearSphere` do MongoDB, que requer o índice **`2dsphere`**.")
+    st.markdown("Utiliza o estágio geoespacial `$geoNear` do MongoDB, que requer o índice **`2dsphere`** "
+                "e já retorna a distância de cada local.")
 
     st.subheader("Configurações da Busca")
     col1, col2, col3 = st.columns(3)
@@ -239,34 +434,22 @@ elif page == "Busca Geoespacial":
     with col3:
         radius_km = st.slider("Raio de Busca (km)", min_value=0.5, max_value=10.0, value=2.0, step=0.5, key="radius_km")
 
+    max_results = st.number_input("Máximo de Resultados", min_value=10, max_value=100000, value=5000, step=500,
+                                  key="max_results")
+    map_zoom = st.slider("Zoom do Mapa", min_value=3, max_value=18, value=12, key="radius_zoom")
+
     if st.button("Buscar Locais no Raio"):
 
         with st.spinner(f"Buscando locais em até **{radius_km} km** do ponto central ({center_lat}, {center_lon})..."):
-            locais_proximos = buscar_locais_em_raio(center_lat, center_lon, radius_km)
-
-        st.subheader(f"Resultados Encontrados: {len(locais_proximos)}")
-
-        if locais_proximos:
-            data = []
-            for local in locais_proximos:
-                local_lat = local['coordenadas']['latitude']
-                local_lon = local['coordenadas']['longitude']
-                # Recalcula a distância exata com geopy para exibição detalhada
-                dist_exata = calcular_distancia(center_lat, center_lon, local_lat, local_lon)
-
-                data.append({
-                    "Local": local['nome_local'],
-                    "Cidade": local['cidade'],
-                    "Distância (km)": f"{dist_exata:.3f}",
-                    "lat": local_lat,
-                    "lon": local_lon
-                })
-
-            df_proximos = pd.DataFrame(data)
-
-            # Mostra o mapa e o Dataframe
-            st.map(df_proximos[['lat', 'lon']].dropna(), zoom=12)
-            st.dataframe(df_proximos.drop(columns=['lat', 'lon']), use_container_width=True)
+            colunas = get_locals_in_radius(center_lat, center_lon, radius_km, int(max_results))
+
+        st.subheader(f"Resultados Encontrados: {len(colunas['Local'])}")
+
+        if colunas["Local"]:
+            # Mostra o mapa (agrupado se houver muitos locais) e o Dataframe
+            _exibir_mapa(colunas["lat"], colunas["lon"], map_zoom)
+            df_proximos = pd.DataFrame({nome: colunas[nome] for nome in ("Local", "Cidade", "Distância (km)")})
+            st.dataframe(df_proximos, use_container_width=True)
         else:
             st.warning("Nenhum local encontrado no raio especificado.")
 
@@ -278,9 +461,7 @@ elif page == "Cruzamento de Dados":
 
     # Busca todos os locais no MongoDB para o Selectbox
     try:
-        collection = MONGO_CLIENT[DB_NAME][COLLECTION_NAME]
-        all_locals = list(collection.find({}, {'nome_local': 1, '_id': 0}))
-        local_names = [l['nome_local'] for l in all_locals]
+        local_names = get_all_local_names()
     except Exception as e:
         local_names = []
         st.error(f"Erro ao buscar locais no MongoDB. Verifique a conexão: {e}")
@@ -323,4 +504,98 @@ elif page == "Cruzamento de Dados":
             else:
                 st.error(dados_cruzados['erro'])
         else:
-            st.warning("Selecione um local para cruzar os dados.")
\ No newline at end of file
+            st.warning("Selecione um local para cruzar os dados.")
+
+
+elif page == "Área e Densidade":
+    st.header("🔥 Locais na Área do Mapa e Mapa de Calor")
+    st.markdown("Consulta a janela visível do mapa com `$geoWithin` e conta os locais por célula de uma grade e "
+                "por cidade **no servidor** (agregação), sem trazer todos os documentos para o cliente.")
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        area_lat = st.number_input("Latitude Central", format="%.5f", value=-7.11532, key="area_lat")
+    with col2:
+        area_lon = st.number_input("Longitude Central", format="%.5f", value=-34.861, key="area_lon")
+    with col3:
+        area_zoom = st.slider("Zoom", min_value=3, max_value=16, value=12, key="area_zoom")
+
+    max_points = st.number_input("Máximo de pontos individuais", min_value=0, max_value=50000, value=2000,
+                                 step=500, key="area_max_points")
+
+    # Janela do mapa (Web Mercator) e células de ~32 px no zoom escolhido
+    lat_min, lon_min, lat_max, lon_max = caixa_da_janela(area_lat, area_lon, area_zoom)
+    cell_size = 45 / 2 ** area_zoom
+    st.caption(f"Janela: lat {lat_min:.4f} a {lat_max:.4f}, lon {lon_min:.4f} a {lon_max:.4f} | "
+               f"Célula da grade: {cell_size:.5f}°")
+
+    if st.button("Consultar Área"):
+        with st.spinner("Agregando os locais da área no servidor..."):
+            resumo = get_area_summary(lat_min, lon_min, lat_max, lon_max, cell_size, int(max_points))
+
+        total_area = sum(resumo["por_cidade"].values())
+        st.subheader(f"Locais na Área: {total_area}")
+
+        camadas = [pdk.Layer("HeatmapLayer", data=pd.DataFrame(resumo["celulas"]),
+                             get_position=["longitude", "latitude"], get_weight="total")]
+        if resumo["pontos"] is not None:
+            camadas.append(pdk.Layer("ScatterplotLayer", data=pd.DataFrame(resumo["pontos"]),
+                                     get_position=["lon", "lat"], get_radius=30, get_fill_color=[30, 90, 200, 160],
+                                     pickable=True))
+        else:
+            st.info(f"A área tem mais de {int(max_points)} locais: exibindo apenas o mapa de calor.")
+
+        st.pydeck_chart(pdk.Deck(layers=camadas, tooltip={"text": "{Local} ({Cidade})"},
+                                 initial_view_state=pdk.ViewState(latitude=area_lat, longitude=area_lon,
+                                                                  zoom=area_zoom)))
+
+        if resumo["por_cidade"]:
+            st.markdown("**Locais por cidade na área**")
+            st.dataframe(pd.DataFrame({"Cidade": list(resumo["por_cidade"]),
+                                       "Locais": list(resumo["por_cidade"].values())}),
+                         use_container_width=True, hide_index=True)
+
+
+elif page == "Métricas":
+    st.header("📊 Métricas de Latência por Backend")
+    st.markdown("Chamadas, erros, linhas/documentos retornados e latência de cada operação do **MongoDB**, "
+                "do **SQLite** e do geoprocessamento (**geopy**/**NumPy**) desde o início do processo.")
+
+    col_m1, col_m2 = st.columns(2)
+    with col_m1:
+        coleta_ativa = st.toggle("Coleta de métricas ativa", value=metricas.esta_ativo())
+        if coleta_ativa != metricas.esta_ativo():
+            metricas.ativar(coleta_ativa)
+    with col_m2:
+        if st.button("Zerar métricas"):
+            metricas.resetar()
+
+    operacoes = metricas.exportar()
+    if operacoes:
+        df_metricas = pd.DataFrame.from_dict(operacoes, orient="index").drop(columns=["histograma"])
+        df_metricas.index.name = "Operação"
+
+        # Tempo total por backend: mostra onde a página passa mais tempo
+        st.subheader("Tempo Total por Backend (ms)")
+        st.bar_chart(df_metricas.groupby("backend")["total_ms"].sum())
+
+        st.subheader("Operações")
+        st.dataframe(df_metricas.sort_values("total_ms", ascending=False), use_container_width=True)
+
+        operacao_histograma = st.selectbox("Histograma de latência da operação:", list(operacoes))
+        st.bar_chart(pd.Series(operacoes[operacao_histograma]["histograma"], name="chamadas"))
+
+        st.download_button("Exportar métricas (JSON)", metricas.exportar_json(), file_name="metricas.json",
+                           mime="application/json")
+    else:
+        st.info("Nenhuma métrica coletada ainda. Navegue pelas outras páginas para gerar chamadas.")
+
+    st.subheader("Caches")
+    st.json({"cache_cidades": CACHE_CIDADES.estatisticas(), "cache_consultas": get_cache_consultas().estatisticas(),
+             "cache_raios": CACHE_RAIOS.estatisticas()})
+
+
+# --- Tempos de inicialização e desta execução ---
+st.sidebar.caption(
+    f"Setup (início a frio): SQLite {tempos_setup['sqlite']['ms']} ms, MongoDB {tempos_setup['mongodb']['ms']} ms | "
+    f"Esta execução: {(time.perf_counter() - INICIO_EXECUCAO) * 1000:.1f} ms")
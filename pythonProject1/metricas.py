@@ -0,0 +1,294 @@
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# --- Configurações da Instrumentação ---
+# Liga/desliga a coleta (METRICAS=0 desativa); também pode ser alterado em execução com ativar()
+METRICAS_ATIVAS = os.getenv("METRICAS", "1") != "0"
+# Limites superiores (ms) dos baldes do histograma de latência; o último balde é "> 2500 ms"
+LIMITES_HISTOGRAMA_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+
+def _contar_itens(resultado):
+    """Quantidade de linhas/documentos de um resultado (listas, tuplas e arrays pelo tamanho)."""
+    if resultado is None:
+        return 0
+    if isinstance(resultado, (list, tuple)):
+        return len(resultado)
+    tamanho = getattr(resultado, "size", None)  # numpy.ndarray
+    return tamanho if isinstance(tamanho, int) else 1
+
+
+class EstatisticaOperacao:
+    """Contadores e histograma de latência de uma operação."""
+
+    __slots__ = ("backend", "chamadas", "erros", "itens", "total_s", "max_s", "baldes")
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.chamadas = 0
+        self.erros = 0
+        self.itens = 0
+        self.total_s = 0.0
+        self.max_s = 0.0
+        self.baldes = [0] * (len(LIMITES_HISTOGRAMA_MS) + 1)
+
+    def registrar(self, segundos, itens):
+        self.chamadas += 1
+        self.itens += itens
+        self.total_s += segundos
+        if segundos > self.max_s:
+            self.max_s = segundos
+        self.baldes[bisect_left(LIMITES_HISTOGRAMA_MS, segundos * 1000)] += 1
+
+    def _percentil_ms(self, fracao):
+        """Percentil aproximado: limite superior do balde que contém a posição (ou o máximo)."""
+        alvo, acumulado = fracao * self.chamadas, 0
+        for limite, quantidade in zip(LIMITES_HISTOGRAMA_MS, self.baldes):
+            acumulado += quantidade
+            if acumulado >= alvo:
+                return min(limite, round(self.max_s * 1000, 3))
+        return round(self.max_s * 1000, 3)
+
+    def resumo(self):
+        rotulos = [f"<= {limite} ms" for limite in LIMITES_HISTOGRAMA_MS] + [f"> {LIMITES_HISTOGRAMA_MS[-1]} ms"]
+        return {
+            "backend": self.backend,
+            "chamadas": self.chamadas,
+            "erros": self.erros,
+            "itens": self.itens,
+            "total_ms": round(self.total_s * 1000, 3),
+            "media_ms": round(self.total_s * 1000 / self.chamadas, 3) if self.chamadas else 0.0,
+            "p50_ms": self._percentil_ms(0.50) if self.chamadas else 0.0,
+            "p95_ms": self._percentil_ms(0.95) if self.chamadas else 0.0,
+            "p99_ms": self._percentil_ms(0.99) if self.chamadas else 0.0,
+            "max_ms": round(self.max_s * 1000, 3),
+            "histograma": {rotulo: quantidade for rotulo, quantidade in zip(rotulos, self.baldes) if quantidade},
+        }
+
+
+class Medicao:
+    """Objeto devolvido por RegistroMetricas.medir(); atribua `itens` dentro do bloco."""
+
+    __slots__ = ("itens",)
+
+    def __init__(self):
+        self.itens = 0
+
+
+class RegistroMetricas:
+    """
+    Registro (thread-safe) de métricas por operação: chamadas, erros,
+    linhas/documentos retornados e histograma de latência.
+    """
+
+    def __init__(self, ativo=METRICAS_ATIVAS):
+        self.ativo = ativo
+        self._lock = threading.Lock()
+        self._operacoes = {}
+
+    def _estatistica(self, operacao, backend):
+        estatistica = self._operacoes.get(operacao)
+        if estatistica is None:
+            estatistica = self._operacoes[operacao] = EstatisticaOperacao(backend)
+        return estatistica
+
+    def registrar(self, operacao, backend, segundos, itens=0, erro=False):
+        if not self.ativo:
+            return
+        with self._lock:
+            estatistica = self._estatistica(operacao, backend)
+            estatistica.registrar(segundos, itens)
+            if erro:
+                estatistica.erros += 1
+
+    def registrar_erro(self, operacao, backend):
+        """Conta um erro tratado dentro da operação (ex: OperationFailure convertido em [])."""
+        if not self.ativo:
+            return
+        with self._lock:
+            self._estatistica(operacao, backend).erros += 1
+
+    @contextmanager
+    def medir(self, operacao, backend):
+        """
+        Mede um bloco de código:
+
+            with REGISTRO.medir("locais_por_cidade", "mongodb") as medicao:
+                locais = list(collection.find(...))
+                medicao.itens = len(locais)
+        """
+        medicao = Medicao()
+        if not self.ativo:
+            yield medicao
+            return
+        inicio = time.perf_counter()
+        erro = False
+        try:
+            yield medicao
+        except Exception:
+            erro = True
+            raise
+        finally:
+            self.registrar(operacao, backend, time.perf_counter() - inicio, medicao.itens, erro)
+
+    def exportar(self):
+        """Retorna {operacao: resumo} com os contadores atuais."""
+        with self._lock:
+            return {operacao: estatistica.resumo() for operacao, estatistica in sorted(self._operacoes.items())}
+
+    def resetar(self):
+        with self._lock:
+            self._operacoes.clear()
+
+
+# Registro compartilhado pelo processo
+REGISTRO = RegistroMetricas()
+
+
+# ----------------------------------------------------------------------
+# 1. Instrumentação de funções
+# ----------------------------------------------------------------------
+def instrumentar(backend, operacao=None, itens=_contar_itens):
+    """
+    Decorador que registra latência, itens retornados e erros de cada
+    chamada em REGISTRO. Com as métricas desligadas, o custo é apenas o de
+    uma verificação de atributo.
+
+    Args:
+        backend (str | callable): Origem dos dados ("mongodb", "sqlite", "geopy", "numpy"...)
+            ou função sem argumentos que a retorna no momento da chamada.
+        operacao (str, opcional): Nome da operação (padrão: nome da função).
+        itens (callable): Conta as linhas/documentos do resultado. Em geradores, é
+            aplicado a cada item gerado (ex: a cada lote).
+    """
+    def decorador(funcao):
+        nome = operacao or funcao.__name__
+        obter_backend = backend if callable(backend) else (lambda: backend)
+
+        if inspect.isgeneratorfunction(funcao):
+            @functools.wraps(funcao)
+            def gerador_instrumentado(*args, **kwargs):
+                if not REGISTRO.ativo:
+                    yield from funcao(*args, **kwargs)
+                    return
+
+                # Mede apenas o tempo gasto dentro do gerador, não o do consumidor entre os lotes
+                gerador = funcao(*args, **kwargs)
+                segundos, quantidade, erro = 0.0, 0, False
+                try:
+                    while True:
+                        inicio = time.perf_counter()
+                        try:
+                            item = next(gerador)
+                        except StopIteration:
+                            return
+                        finally:
+                            segundos += time.perf_counter() - inicio
+                        quantidade += itens(item)
+                        yield item
+                except Exception:
+                    erro = True
+                    raise
+                finally:
+                    gerador.close()
+                    REGISTRO.registrar(nome, obter_backend(), segundos, quantidade, erro)
+
+            return gerador_instrumentado
+
+        @functools.wraps(funcao)
+        def instrumentada(*args, **kwargs):
+            if not REGISTRO.ativo:
+                return funcao(*args, **kwargs)
+
+            inicio = time.perf_counter()
+            try:
+                resultado = funcao(*args, **kwargs)
+            except Exception:
+                REGISTRO.registrar(nome, obter_backend(), time.perf_counter() - inicio, 0, erro=True)
+                raise
+            REGISTRO.registrar(nome, obter_backend(), time.perf_counter() - inicio, itens(resultado))
+            return resultado
+
+        return instrumentada
+
+    return decorador
+
+
+class PerfilEtapas:
+    """
+    Cronometra etapas sequenciais de um script: cada chamada a etapa()
+    encerra a anterior. As etapas entram em REGISTRO com backend "etapa".
+    """
+
+    def __init__(self):
+        self._etapa_atual = None
+        self._inicio = 0.0
+
+    def etapa(self, nome):
+        self.encerrar()
+        self._etapa_atual, self._inicio = nome, time.perf_counter()
+
+    def encerrar(self):
+        if self._etapa_atual is not None:
+            REGISTRO.registrar(self._etapa_atual, "etapa", time.perf_counter() - self._inicio)
+            self._etapa_atual = None
+
+
+# ----------------------------------------------------------------------
+# 2. API de consulta/exportação
+# ----------------------------------------------------------------------
+def medir(operacao, backend):
+    """Atalho para REGISTRO.medir()."""
+    return REGISTRO.medir(operacao, backend)
+
+
+def registrar_erro(operacao, backend):
+    """Atalho para REGISTRO.registrar_erro()."""
+    REGISTRO.registrar_erro(operacao, backend)
+
+
+def ativar(ativo=True):
+    """Liga (ou desliga, com ativo=False) a coleta de métricas."""
+    REGISTRO.ativo = ativo
+
+
+def esta_ativo():
+    return REGISTRO.ativo
+
+
+def exportar():
+    """Retorna {operacao: resumo} (chamadas, erros, itens, latências e histograma)."""
+    return REGISTRO.exportar()
+
+
+def exportar_json(caminho=None):
+    """Serializa as métricas em JSON; grava em `caminho` se informado e retorna o texto."""
+    texto = json.dumps({"coletado_em": time.time(), "operacoes": exportar()}, indent=2, ensure_ascii=False)
+    if caminho:
+        with open(caminho, "w", encoding="utf-8") as arquivo:
+            arquivo.write(texto)
+    return texto
+
+
+def resetar():
+    """Zera todos os contadores."""
+    REGISTRO.resetar()
+
+
+def relatorio_texto():
+    """Tabela em texto com as métricas agrupadas por backend (usada no modo de perfil do Main.py)."""
+    operacoes = exportar()
+    linhas = [f"{'operação':<42}{'chamadas':>9}{'erros':>7}{'itens':>9}{'total ms':>11}{'p50 ms':>9}{'p95 ms':>9}"]
+    for backend in sorted({resumo["backend"] for resumo in operacoes.values()}):
+        linhas.append(f"[{backend}]")
+        for operacao, resumo in operacoes.items():
+            if resumo["backend"] == backend:
+                linhas.append(f"  {operacao:<40}{resumo['chamadas']:>9}{resumo['erros']:>7}{resumo['itens']:>9}"
+                              f"{resumo['total_ms']:>11.2f}{resumo['p50_ms']:>9}{resumo['p95_ms']:>9}")
+    return "\n".join(linhas)
@@ -0,0 +1,35 @@
+import threading
+
+from pymongo import MongoClient
+
+_CLIENTES = {}
+_CLIENTES_LOCK = threading.Lock()
+
+
+def obter_cliente(mongo_uri):
+    """
+    Retorna o MongoClient compartilhado (por processo) de `mongo_uri`,
+    criando-o apenas no primeiro uso. O MongoClient já mantém um pool de
+    conexões thread-safe, então uma única instância atende todo o processo.
+    """
+    cliente = _CLIENTES.get(mongo_uri)
+    if cliente is None:
+        with _CLIENTES_LOCK:
+            cliente = _CLIENTES.get(mongo_uri)
+            if cliente is None:
+                cliente = MongoClient(mongo_uri)
+                _CLIENTES[mongo_uri] = cliente
+    return cliente
+
+
+def obter_colecao(mongo_uri, db_name, collection_name):
+    """Atalho para obter_cliente(mongo_uri)[db_name][collection_name]."""
+    return obter_cliente(mongo_uri)[db_name][collection_name]
+
+
+def fechar_todos():
+    """Fecha todos os clientes compartilhados (ex: ao encerrar o processo)."""
+    with _CLIENTES_LOCK:
+        for cliente in _CLIENTES.values():
+            cliente.close()
+        _CLIENTES.clear()
@@ -0,0 +1,136 @@
+import threading
+import time
+from collections import OrderedDict
+
+# --- Configurações Padrão do Cache de Consultas ---
+# Máximo de entradas por tipo de consulta antes da remoção LRU
+CACHE_CONSULTAS_MAX_ENTRADAS = 256
+# Tempo de vida (segundos) de cada entrada; None desativa a expiração
+CACHE_CONSULTAS_TTL = 120
+
+# Sentinela para "chave ausente" (None é um valor válido em cache)
+AUSENTE = object()
+
+
+class LRUComTTL:
+    """Dicionário LRU com tempo de vida por entrada (não é thread-safe)."""
+
+    def __init__(self, max_entradas, ttl):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self._dados = OrderedDict()
+
+    def get(self, chave):
+        item = self._dados.get(chave, AUSENTE)
+        if item is AUSENTE:
+            return AUSENTE
+        valor, expira_em = item
+        if expira_em is not None and expira_em < time.monotonic():
+            del self._dados[chave]
+            return AUSENTE
+        self._dados.move_to_end(chave)
+        return valor
+
+    def put(self, chave, valor):
+        expira_em = time.monotonic() + self.ttl if self.ttl is not None else None
+        self._dados[chave] = (valor, expira_em)
+        self._dados.move_to_end(chave)
+        while len(self._dados) > self.max_entradas:
+            self._dados.popitem(last=False)
+
+    def pop(self, chave):
+        self._dados.pop(chave, None)
+
+    def chaves(self):
+        return list(self._dados)
+
+    def itens(self):
+        """Pares (chave, valor) não expirados, sem alterar a ordem do LRU."""
+        agora = time.monotonic()
+        return [(chave, valor) for chave, (valor, expira_em) in self._dados.items()
+                if expira_em is None or expira_em >= agora]
+
+    def clear(self):
+        self._dados.clear()
+
+    def __len__(self):
+        return len(self._dados)
+
+
+class CacheConsultas:
+    """
+    Cache de leitura (read-through) de consultas, separado por tipo de
+    consulta (namespace) e indexado pelos argumentos.
+
+    Cada namespace tem seu próprio LRU com TTL. A invalidação é seletiva:
+    invalidar(namespace, predicado) remove apenas as entradas cujos
+    argumentos satisfazem o predicado (ex: só a cidade que recebeu um novo
+    local). Um contador de geração por namespace impede que uma carga
+    iniciada antes da invalidação grave um resultado desatualizado.
+    """
+
+    def __init__(self, limites=None, max_entradas=CACHE_CONSULTAS_MAX_ENTRADAS, ttl=CACHE_CONSULTAS_TTL):
+        """
+        Args:
+            limites (dict, opcional): {namespace: (max_entradas, ttl)} para tipos de consulta específicos.
+            max_entradas (int): Limite padrão de entradas por namespace.
+            ttl (float, opcional): Tempo de vida padrão, em segundos.
+        """
+        self._limites = limites or {}
+        self._padrao = (max_entradas, ttl)
+        self._lock = threading.Lock()
+        self._caches = {}
+        self._geracoes = {}
+        self._acertos = {}
+        self._falhas = {}
+
+    def _cache(self, namespace):
+        if namespace not in self._caches:
+            self._caches[namespace] = LRUComTTL(*self._limites.get(namespace, self._padrao))
+        return self._caches[namespace]
+
+    def obter(self, namespace, argumentos, carregar):
+        """
+        Retorna o valor em cache para (namespace, argumentos) ou chama
+        `carregar()` e guarda o resultado.
+        """
+        with self._lock:
+            valor = self._cache(namespace).get(argumentos)
+            if valor is not AUSENTE:
+                self._acertos[namespace] = self._acertos.get(namespace, 0) + 1
+                return valor
+            self._falhas[namespace] = self._falhas.get(namespace, 0) + 1
+            geracao = self._geracoes.get(namespace, 0)
+
+        valor = carregar()
+        with self._lock:
+            if self._geracoes.get(namespace, 0) == geracao:
+                self._cache(namespace).put(argumentos, valor)
+        return valor
+
+    def invalidar(self, namespace, predicado=None):
+        """
+        Remove as entradas de `namespace` cujos argumentos satisfazem
+        `predicado(argumentos)`; sem predicado, remove todas.
+        """
+        with self._lock:
+            self._geracoes[namespace] = self._geracoes.get(namespace, 0) + 1
+            cache = self._cache(namespace)
+            if predicado is None:
+                cache.clear()
+                return
+            for argumentos in cache.chaves():
+                if predicado(argumentos):
+                    cache.pop(argumentos)
+
+    def estatisticas(self):
+        """Retorna, por namespace, acertos, falhas e quantidade de entradas."""
+        with self._lock:
+            return {
+                namespace: {
+                    "acertos": self._acertos.get(namespace, 0),
+                    "falhas": self._falhas.get(namespace, 0),
+                    "entradas": len(cache),
+                }
+                for namespace, cache in self._caches.items()
+            }
@@ -0,0 +1,176 @@
+import math
+import threading
+
+import numpy as np
+
+from query_cache import LRUComTTL
+from spatial_index import MONGO_RAIO_TERRA_KM
+
+# --- Configurações do Cache de Buscas por Raio ---
+# Máximo de círculos guardados antes da remoção LRU
+CACHE_RAIOS_MAX_ENTRADAS = 128
+# Tempo de vida (segundos) de cada círculo; limita a defasagem de escritas feitas por outros processos
+CACHE_RAIOS_TTL = 60
+# Grade (graus) para onde os centros são arredondados (~11 m no equador)
+PASSO_CENTRO_GRAUS = 1e-4
+# Os raios guardados são arredondados para cima em múltiplos deste valor (km)
+PASSO_RAIO_KM = 0.25
+# Círculos com mais documentos que isto não são guardados
+MAX_DOCUMENTOS_POR_CIRCULO = 50000
+# Folga (km) no teste de contenção, para absorver arredondamentos de ponto flutuante
+MARGEM_CONTENCAO_KM = 1e-6
+
+
+def _esfera_unitaria(latitudes, longitudes):
+    """(lat, lon) em graus -> matriz n x 3 de pontos na esfera unitária."""
+    latitudes = np.radians(np.asarray(latitudes, dtype=np.float64))
+    longitudes = np.radians(np.asarray(longitudes, dtype=np.float64))
+    cos_lat = np.cos(latitudes)
+    return np.column_stack((cos_lat * np.cos(longitudes), cos_lat * np.sin(longitudes), np.sin(latitudes)))
+
+
+def _distancias_km(xyz, latitude, longitude):
+    """Distâncias (km, esfera do MongoDB) do ponto a cada linha de `xyz`, via atan2(|a x b|, a . b)."""
+    centro = _esfera_unitaria([latitude], [longitude])[0]
+    return np.arctan2(np.linalg.norm(np.cross(xyz, centro), axis=1), xyz @ centro) * MONGO_RAIO_TERRA_KM
+
+
+class _Circulo:
+    """Resultado guardado de uma busca: documentos ordenados por distância e os seus pontos."""
+
+    __slots__ = ("latitude", "longitude", "raio_km", "centro", "documentos", "xyz")
+
+    def __init__(self, latitude, longitude, raio_km, documentos):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.raio_km = raio_km
+        self.centro = _esfera_unitaria([latitude], [longitude])[0]
+        self.documentos = documentos
+        coordenadas = [documento.get("coordenadas", {}) for documento in documentos]
+        self.xyz = _esfera_unitaria([c.get("latitude") for c in coordenadas],
+                                    [c.get("longitude") for c in coordenadas]).reshape(-1, 3)
+
+
+def _copiar(valor):
+    """Cópia dos dicts e listas aninhados (ex: 'coordenadas.ponto'); os demais valores são imutáveis."""
+    if isinstance(valor, dict):
+        return {campo: _copiar(item) for campo, item in valor.items()}
+    if isinstance(valor, list):
+        return [_copiar(item) for item in valor]
+    return valor
+
+
+def _distancias_aos_centros(itens, latitude, longitude):
+    """Distâncias (km) do ponto ao centro de cada círculo de `itens` (pares chave, círculo), numa única chamada."""
+    return _distancias_km(np.array([circulo.centro for _, circulo in itens]).reshape(-1, 3), latitude, longitude)
+
+
+class CacheRaios:
+    """
+    Cache das buscas por raio que também responde a círculos contidos em
+    um círculo já buscado.
+
+    Uma busca ausente do cache é feita com o centro arredondado para a grade
+    PASSO_CENTRO_GRAUS e o raio ampliado (em múltiplos de PASSO_RAIO_KM) o
+    suficiente para conter o círculo pedido. Buscas seguintes cujo círculo
+    esteja inteiro dentro de um círculo guardado são respondidas filtrando
+    os documentos guardados pela distância, em memória, com o mesmo
+    resultado e a mesma ordem do $nearSphere.
+    """
+
+    def __init__(self, max_entradas=CACHE_RAIOS_MAX_ENTRADAS, ttl=CACHE_RAIOS_TTL, ativo=True):
+        self.ativo = ativo
+        self._lock = threading.Lock()
+        self._circulos = LRUComTTL(max_entradas, ttl)
+        self._geracao = 0
+        self._acertos = 0
+        self._falhas = 0
+
+    @staticmethod
+    def _chave(latitude_central, longitude_central, raio_km):
+        """Centro na grade e raio (múltiplo de PASSO_RAIO_KM) de um círculo que contém o pedido."""
+        latitude = min(max(round(latitude_central / PASSO_CENTRO_GRAUS) * PASSO_CENTRO_GRAUS, -90.0), 90.0)
+        longitude = round(longitude_central / PASSO_CENTRO_GRAUS) * PASSO_CENTRO_GRAUS
+        deslocamento = float(_distancias_km(_esfera_unitaria([latitude], [longitude]),
+                                            latitude_central, longitude_central)[0])
+        passos = math.ceil((raio_km + deslocamento + MARGEM_CONTENCAO_KM) / PASSO_RAIO_KM - 1e-9)
+        return round(latitude, 6), round(longitude, 6), round(max(passos, 1) * PASSO_RAIO_KM, 6)
+
+    @staticmethod
+    def _menor_circulo_contendo(itens, latitude_central, longitude_central, raio_km):
+        """(chave, círculo) do menor círculo de `itens` que contém o círculo pedido, ou (None, None)."""
+        if not itens:
+            return None, None
+        raios = np.array([circulo.raio_km for _, circulo in itens])
+        distancias = _distancias_aos_centros(itens, latitude_central, longitude_central)
+        contem = np.flatnonzero(distancias + raio_km + MARGEM_CONTENCAO_KM <= raios)
+        if not len(contem):
+            return None, None
+        return itens[int(contem[np.argmin(raios[contem])])]
+
+    @staticmethod
+    def _filtrar(circulo, latitude_central, longitude_central, raio_km):
+        """
+        Documentos do círculo guardado a até `raio_km` do centro, do mais
+        próximo ao mais distante. São cópias completas: alterá-las não altera o cache.
+        """
+        if not circulo.documentos:
+            return []
+        distancias = _distancias_km(circulo.xyz, latitude_central, longitude_central)
+        dentro = np.flatnonzero(distancias <= raio_km)
+        ordem = dentro[np.argsort(distancias[dentro], kind="stable")]
+        return [_copiar(circulo.documentos[i]) for i in ordem.tolist()]
+
+    def buscar(self, latitude_central, longitude_central, raio_km, carregar):
+        """
+        Retorna os locais do círculo pedido a partir do cache ou chama
+        `carregar(lat, lon, raio_km)` para um círculo que o contém.
+        """
+        if not self.ativo:
+            return carregar(latitude_central, longitude_central, raio_km)
+
+        with self._lock:
+            itens = self._circulos.itens()
+            geracao = self._geracao
+        # A procura (vetorizada) roda fora do lock, sobre a cópia da lista de círculos
+        chave, circulo = self._menor_circulo_contendo(itens, latitude_central, longitude_central, raio_km)
+        with self._lock:
+            # get() também marca o círculo como usado no LRU; se ele foi invalidado nesse meio-tempo, é uma falha
+            if circulo is not None and self._circulos.get(chave) is circulo:
+                self._acertos += 1
+            else:
+                circulo = None
+                self._falhas += 1
+
+        if circulo is None:
+            latitude, longitude, raio_guardado = self._chave(latitude_central, longitude_central, raio_km)
+            documentos = carregar(latitude, longitude, raio_guardado)
+            circulo = _Circulo(latitude, longitude, raio_guardado, documentos)
+            with self._lock:
+                # Uma escrita durante a carga pode não estar no resultado: nesse caso, não guarda
+                if self._geracao == geracao and len(documentos) <= MAX_DOCUMENTOS_POR_CIRCULO:
+                    self._circulos.put((latitude, longitude, raio_guardado), circulo)
+
+        return self._filtrar(circulo, latitude_central, longitude_central, raio_km)
+
+    def invalidar_ponto(self, latitude, longitude):
+        """Remove apenas os círculos que contêm o ponto (ex: local recém-inserido)."""
+        with self._lock:
+            self._geracao += 1
+            itens = self._circulos.itens()
+            if not itens:
+                return
+            distancias = _distancias_aos_centros(itens, latitude, longitude)
+            for (chave, circulo), distancia in zip(itens, distancias.tolist()):
+                if distancia <= circulo.raio_km + MARGEM_CONTENCAO_KM:
+                    self._circulos.pop(chave)
+
+    def limpar(self):
+        with self._lock:
+            self._geracao += 1
+            self._circulos.clear()
+
+    def estatisticas(self):
+        """Acertos (respondidos em memória), falhas (consultas ao banco) e círculos guardados."""
+        with self._lock:
+            return {"acertos": self._acertos, "falhas": self._falhas, "entradas": len(self._circulos)}
@@ -0,0 +1,370 @@
+import argparse
+import datetime
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+from bson import ObjectId
+
+import metricas
+import mongo_client
+from bulk_loader import montar_documento_local
+from database_setup import MONGO_URI, DB_NAME, COLLECTION_NAME
+
+# --- Configurações do Snapshot Colunar ---
+# Diretório padrão do snapshot de 'locais_geo'
+DIRETORIO_SNAPSHOT = os.getenv("SNAPSHOT_LOCAIS", "snapshot_locais_geo")
+# Incremente ao mudar o formato dos arquivos: snapshots antigos precisam de nova exportação
+VERSAO_SNAPSHOT = 2
+# Documentos lidos do MongoDB e gravados por vez
+TAMANHO_LOTE_SNAPSHOT = 50000
+# Na atualização incremental, relê os documentos com _id até esta quantidade de segundos
+# antes do último exportado (ObjectIds de outros processos no mesmo segundo não são ordenados)
+MARGEM_ATUALIZACAO_S = 60
+
+ARQUIVO_MANIFESTO = "manifesto.json"
+# Cada exportação completa grava as colunas num subdiretório novo (geracao_<n>), indicado no
+# manifesto: leitores com arquivos mapeados continuam na geração anterior até reabrirem o snapshot
+PREFIXO_GERACAO = "geracao_"
+# '_id' de cada local: os 12 bytes do ObjectId (matriz n x 12 de uint8)
+ARQUIVO_IDS = "id.oid"
+
+# Colunas de tamanho fixo: nome -> (arquivo, dtype little-endian)
+_COLUNAS_FIXAS = {
+    "latitude": ("latitude.f8", "<f8"),
+    "longitude": ("longitude.f8", "<f8"),
+    "cidade": ("cidade.i4", "<i4"),
+}
+# Colunas de texto: bytes UTF-8 concatenados, deslocamentos (n + 1 inteiros) do início de cada
+# valor e um byte por linha que marca os valores nulos (None)
+_COLUNAS_TEXTO = {
+    "nome_local": ("nome_local.utf8", "nome_local.offsets.i8", "nome_local.nulos.u1"),
+    "descricao": ("descricao.utf8", "descricao.offsets.i8", "descricao.nulos.u1"),
+}
+
+_PROJECAO_SNAPSHOT = {"nome_local": 1, "cidade": 1, "descricao": 1, "coordenadas.latitude": 1,
+                      "coordenadas.longitude": 1}
+
+
+def _manifesto_vazio(geracao=1):
+    return {"versao": VERSAO_SNAPSHOT, "geracao": geracao, "total": 0,
+            "bytes": {coluna: 0 for coluna in _COLUNAS_TEXTO}, "cidades": [], "ultimo_id": None,
+            "atualizado_em": None}
+
+
+def _diretorio_dados(diretorio, manifesto):
+    """Subdiretório com os arquivos de coluna da geração do manifesto."""
+    return os.path.join(diretorio, f"{PREFIXO_GERACAO}{manifesto['geracao']}")
+
+
+def ler_manifesto(diretorio=DIRETORIO_SNAPSHOT):
+    """Manifesto do snapshot (ou None se não existir ou estiver em outra versão)."""
+    try:
+        with open(os.path.join(diretorio, ARQUIVO_MANIFESTO), encoding="utf-8") as arquivo:
+            manifesto = json.load(arquivo)
+    except FileNotFoundError:
+        return None
+    return manifesto if manifesto.get("versao") == VERSAO_SNAPSHOT else None
+
+
+def _gravar_manifesto(diretorio, manifesto):
+    """Grava o manifesto de forma atômica: é ele que define quantas linhas dos arquivos são válidas."""
+    caminho = os.path.join(diretorio, ARQUIVO_MANIFESTO)
+    with open(caminho + ".tmp", "w", encoding="utf-8") as arquivo:
+        json.dump(manifesto, arquivo, ensure_ascii=False)
+    os.replace(caminho + ".tmp", caminho)
+
+
+# ----------------------------------------------------------------------
+# 1. Leitura (memory-mapped)
+# ----------------------------------------------------------------------
+def _mapear(diretorio, arquivo, dtype, quantidade, largura=None):
+    """Array somente leitura sobre as primeiras `quantidade` posições do arquivo (sem copiar)."""
+    forma = (quantidade,) if largura is None else (quantidade, largura)
+    if quantidade == 0:
+        return np.empty(forma, dtype=dtype)
+    return np.memmap(os.path.join(diretorio, arquivo), dtype=dtype, mode="r", shape=forma)
+
+
+def _mapear_ids(diretorio, quantidade):
+    return _mapear(diretorio, ARQUIVO_IDS, np.uint8, quantidade, largura=12)
+
+
+class SnapshotLocais:
+    """
+    Snapshot colunar de 'locais_geo' mapeado em memória: abrir é apenas ler
+    o manifesto e mapear os arquivos, e as páginas só são lidas do disco
+    quando acessadas.
+
+    As colunas `latitudes`, `longitudes` e `cidade_ids` são arrays NumPy e
+    podem ser passadas diretamente às funções de distância em lote
+    (ex: calcular_distancias_um_para_muitos) e a IndiceEspacial.de_snapshot().
+    """
+
+    def __init__(self, diretorio=DIRETORIO_SNAPSHOT):
+        manifesto = ler_manifesto(diretorio)
+        if manifesto is None:
+            raise FileNotFoundError(f"Snapshot não encontrado (ou em versão antiga) em '{diretorio}'. "
+                                    f"Gere-o com: python snapshot_locais.py exportar")
+        self.diretorio = diretorio
+        self.manifesto = manifesto
+        total = manifesto["total"]
+        dados = _diretorio_dados(diretorio, manifesto)
+
+        self.ids = _mapear_ids(dados, total)
+        self.latitudes = _mapear(dados, *_COLUNAS_FIXAS["latitude"], total)
+        self.longitudes = _mapear(dados, *_COLUNAS_FIXAS["longitude"], total)
+        # Índice em self.cidades (-1 = sem cidade)
+        self.cidade_ids = _mapear(dados, *_COLUNAS_FIXAS["cidade"], total)
+        self.cidades = manifesto["cidades"]
+        self._textos = {
+            coluna: (_mapear(dados, arquivo_bytes, np.uint8, manifesto["bytes"][coluna]),
+                     _mapear(dados, arquivo_offsets, "<i8", total + 1 if total else 0),
+                     _mapear(dados, arquivo_nulos, np.uint8, total))
+            for coluna, (arquivo_bytes, arquivo_offsets, arquivo_nulos) in _COLUNAS_TEXTO.items()
+        }
+
+    def __len__(self):
+        return len(self.latitudes)
+
+    def _texto(self, coluna, indice):
+        dados, offsets, nulos = self._textos[coluna]
+        if nulos[indice]:
+            return None
+        inicio, fim = offsets[indice], offsets[indice + 1]
+        return dados[inicio:fim].tobytes().decode("utf-8")
+
+    def nome(self, indice):
+        return self._texto("nome_local", indice)
+
+    def cidade(self, indice):
+        cidade_id = self.cidade_ids[indice]
+        return self.cidades[cidade_id] if cidade_id >= 0 else None
+
+    def indices_da_cidade(self, nome_cidade):
+        """Posições dos locais de uma cidade (comparação de inteiros, sem decodificar textos)."""
+        if nome_cidade not in self.cidades:
+            return np.empty(0, dtype=np.intp)
+        return np.flatnonzero(self.cidade_ids == self.cidades.index(nome_cidade))
+
+    def documento(self, indice):
+        """Documento no formato de 'locais_geo' (com '_id' e o ponto GeoJSON) montado sob demanda."""
+        documento = montar_documento_local(self.nome(indice), self.cidade(indice), float(self.latitudes[indice]),
+                                           float(self.longitudes[indice]), self._texto("descricao", indice))
+        documento["_id"] = ObjectId(self.ids[indice].tobytes())
+        return documento
+
+
+def carregar(diretorio=DIRETORIO_SNAPSHOT):
+    """Abre o snapshot de `diretorio` (atalho para SnapshotLocais)."""
+    return SnapshotLocais(diretorio)
+
+
+# ----------------------------------------------------------------------
+# 2. Escrita (exportação completa e atualização incremental)
+# ----------------------------------------------------------------------
+def _truncar(diretorio, manifesto):
+    """
+    Descarta bytes gravados além do manifesto (ex: atualização interrompida)
+    antes de anexar. Leitores só mapeiam o que o manifesto publicou, então
+    os trechos removidos nunca estão mapeados.
+    """
+    total = manifesto["total"]
+    tamanhos = {arquivo: total * np.dtype(dtype).itemsize for arquivo, dtype in _COLUNAS_FIXAS.values()}
+    tamanhos[ARQUIVO_IDS] = total * 12
+    for coluna, (arquivo_bytes, arquivo_offsets, arquivo_nulos) in _COLUNAS_TEXTO.items():
+        tamanhos[arquivo_bytes] = manifesto["bytes"][coluna]
+        tamanhos[arquivo_offsets] = (total + 1) * 8 if total else 0
+        tamanhos[arquivo_nulos] = total
+    for arquivo, tamanho in tamanhos.items():
+        with open(os.path.join(diretorio, arquivo), "ab") as saida:
+            saida.truncate(tamanho)
+
+
+def _anexar_lote(diretorio, manifesto, documentos, posicao_cidades):
+    """Acrescenta um lote de documentos ao fim de cada arquivo de coluna e atualiza o manifesto."""
+    with open(os.path.join(diretorio, ARQUIVO_IDS), "ab") as saida:
+        saida.write(b"".join(documento["_id"].binary for documento in documentos))
+
+    colunas = {
+        "latitude": np.array([documento["coordenadas"]["latitude"] for documento in documentos], dtype="<f8"),
+        "longitude": np.array([documento["coordenadas"]["longitude"] for documento in documentos], dtype="<f8"),
+    }
+    cidade_ids = []
+    for documento in documentos:
+        cidade = documento.get("cidade")
+        if cidade is None:
+            cidade_ids.append(-1)
+            continue
+        if cidade not in posicao_cidades:
+            posicao_cidades[cidade] = len(manifesto["cidades"])
+            manifesto["cidades"].append(cidade)
+        cidade_ids.append(posicao_cidades[cidade])
+    colunas["cidade"] = np.array(cidade_ids, dtype="<i4")
+
+    for coluna, (arquivo, _) in _COLUNAS_FIXAS.items():
+        with open(os.path.join(diretorio, arquivo), "ab") as saida:
+            saida.write(colunas[coluna].tobytes())
+
+    for coluna, (arquivo_bytes, arquivo_offsets, arquivo_nulos) in _COLUNAS_TEXTO.items():
+        valores = [documento.get(coluna) for documento in documentos]
+        textos = [(valor or "").encode("utf-8") for valor in valores]
+        offsets = manifesto["bytes"][coluna] + np.cumsum([len(texto) for texto in textos], dtype=np.int64)
+        if manifesto["total"] == 0:
+            offsets = np.concatenate(([0], offsets))
+        with open(os.path.join(diretorio, arquivo_bytes), "ab") as saida:
+            saida.write(b"".join(textos))
+        with open(os.path.join(diretorio, arquivo_offsets), "ab") as saida:
+            saida.write(offsets.astype("<i8").tobytes())
+        with open(os.path.join(diretorio, arquivo_nulos), "ab") as saida:
+            saida.write(bytes(valor is None for valor in valores))
+        manifesto["bytes"][coluna] = int(offsets[-1])
+
+    manifesto["total"] += len(documentos)
+    ultimo = max(documento["_id"] for documento in documentos)
+    if manifesto["ultimo_id"] is None or ultimo > ObjectId(manifesto["ultimo_id"]):
+        manifesto["ultimo_id"] = str(ultimo)
+
+
+def _gravar_documentos(diretorio, manifesto, cursor, tamanho_lote, ids_existentes=frozenset(), publicar_lotes=True):
+    """
+    Anexa os documentos do cursor em lotes na geração do manifesto. O
+    manifesto é gravado no final e, com `publicar_lotes`, após cada lote completo.
+    """
+    dados = _diretorio_dados(diretorio, manifesto)
+    posicao_cidades = {cidade: posicao for posicao, cidade in enumerate(manifesto["cidades"])}
+    novos, lote = 0, []
+    for documento in cursor:
+        coordenadas = documento.get("coordenadas", {})
+        if coordenadas.get("latitude") is None or coordenadas.get("longitude") is None:
+            continue
+        if not isinstance(documento.get("_id"), ObjectId) or documento["_id"].binary in ids_existentes:
+            continue
+        lote.append(documento)
+        if len(lote) >= tamanho_lote:
+            _anexar_lote(dados, manifesto, lote, posicao_cidades)
+            if publicar_lotes:
+                _gravar_manifesto(diretorio, manifesto)
+            novos, lote = novos + len(lote), []
+    if lote:
+        _anexar_lote(dados, manifesto, lote, posicao_cidades)
+        novos += len(lote)
+    manifesto["atualizado_em"] = time.time()
+    _gravar_manifesto(diretorio, manifesto)
+    return novos
+
+
+def _remover_geracoes_antigas(diretorio, manifesto):
+    """
+    Remove as gerações (e os arquivos da versão 1, na raiz) que o manifesto
+    não usa mais. Arquivos ainda mapeados por outro processo continuam
+    acessíveis a ele no Linux; no Windows a remoção falha e fica para a próxima exportação.
+    """
+    atual = os.path.basename(_diretorio_dados(diretorio, manifesto))
+    for nome in os.listdir(diretorio):
+        if nome.startswith(PREFIXO_GERACAO) and nome != atual:
+            shutil.rmtree(os.path.join(diretorio, nome), ignore_errors=True)
+    arquivos_v1 = [ARQUIVO_IDS, *(arquivo for arquivo, _ in _COLUNAS_FIXAS.values()),
+                   *(arquivo for arquivos in _COLUNAS_TEXTO.values() for arquivo in arquivos)]
+    for arquivo in arquivos_v1:
+        try:
+            os.remove(os.path.join(diretorio, arquivo))
+        except OSError:
+            pass
+
+
+@metricas.instrumentar("mongodb", operacao="snapshot.exportar", itens=lambda resumo: resumo["novos"])
+def exportar(diretorio=DIRETORIO_SNAPSHOT, collection=None, tamanho_lote=TAMANHO_LOTE_SNAPSHOT):
+    """
+    Exporta toda a collection de locais para um snapshot novo em `diretorio`.
+    Os arquivos são gravados numa geração nova e o manifesto passa a apontar
+    para ela só no final: até lá, os leitores veem o snapshot anterior, e os
+    que já o mapearam continuam válidos depois da troca.
+
+    Returns:
+        dict: Total de documentos, novos e tempo gasto.
+    """
+    inicio = time.perf_counter()
+    collection = collection if collection is not None else mongo_client.obter_colecao(MONGO_URI, DB_NAME,
+                                                                                       COLLECTION_NAME)
+    anterior = ler_manifesto(diretorio)
+    manifesto = _manifesto_vazio(anterior["geracao"] + 1 if anterior else 1)
+    dados = _diretorio_dados(diretorio, manifesto)
+    # Restos de uma exportação interrompida (nenhum manifesto aponta para eles)
+    shutil.rmtree(dados, ignore_errors=True)
+    os.makedirs(dados)
+
+    cursor = collection.find({}, _PROJECAO_SNAPSHOT, batch_size=tamanho_lote).sort("_id", 1)
+    novos = _gravar_documentos(diretorio, manifesto, cursor, tamanho_lote, publicar_lotes=False)
+    _remover_geracoes_antigas(diretorio, manifesto)
+    return {"total": manifesto["total"], "novos": novos, "segundos": round(time.perf_counter() - inicio, 3)}
+
+
+def marcar_desatualizado(diretorio=DIRETORIO_SNAPSHOT):
+    """
+    Registra no manifesto que documentos já exportados foram alterados: a
+    próxima chamada de atualizar() reexporta tudo em vez de só anexar.
+
+    Returns:
+        bool: True se o snapshot existe (e está marcado).
+    """
+    manifesto = ler_manifesto(diretorio)
+    if manifesto is None:
+        return False
+    if not manifesto.get("desatualizado"):
+        manifesto["desatualizado"] = True
+        _gravar_manifesto(diretorio, manifesto)
+    return True
+
+
+@metricas.instrumentar("mongodb", operacao="snapshot.atualizar", itens=lambda resumo: resumo["novos"])
+def atualizar(diretorio=DIRETORIO_SNAPSHOT, collection=None, tamanho_lote=TAMANHO_LOTE_SNAPSHOT):
+    """
+    Acrescenta ao snapshot apenas os locais inseridos desde a última
+    exportação/atualização (pelo '_id'), sem reescrever os arquivos. Se
+    o snapshot ainda não existir, faz a exportação completa.
+
+    Remoções e alterações de documentos antigos não são detectadas: use
+    exportar() ou marcar_desatualizado() (a próxima atualização será uma
+    exportação completa) nesses casos.
+
+    Returns:
+        dict: Total de documentos, novos e tempo gasto.
+    """
+    manifesto = ler_manifesto(diretorio)
+    if manifesto is None or manifesto.get("desatualizado"):
+        return exportar(diretorio, collection, tamanho_lote)
+
+    inicio = time.perf_counter()
+    collection = collection if collection is not None else mongo_client.obter_colecao(MONGO_URI, DB_NAME,
+                                                                                       COLLECTION_NAME)
+    dados = _diretorio_dados(diretorio, manifesto)
+    _truncar(dados, manifesto)
+
+    filtro, ids_existentes = {}, frozenset()
+    if manifesto["ultimo_id"] is not None:
+        gerado_em = ObjectId(manifesto["ultimo_id"]).generation_time
+        limite = ObjectId.from_datetime(gerado_em - datetime.timedelta(seconds=MARGEM_ATUALIZACAO_S))
+        filtro = {"_id": {"$gte": limite}}
+        # Ids já exportados dentro da margem (os 4 primeiros bytes do ObjectId são o timestamp, big-endian)
+        ids = _mapear_ids(dados, manifesto["total"])
+        timestamps = ids[:, :4].copy().view(">u4").ravel()
+        recentes = ids[timestamps >= int(limite.generation_time.timestamp())]
+        ids_existentes = frozenset(linha.tobytes() for linha in recentes)
+
+    cursor = collection.find(filtro, _PROJECAO_SNAPSHOT, batch_size=tamanho_lote).sort("_id", 1)
+    novos = _gravar_documentos(diretorio, manifesto, cursor, tamanho_lote, ids_existentes)
+    return {"total": manifesto["total"], "novos": novos, "segundos": round(time.perf_counter() - inicio, 3)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Snapshot colunar (memory-mapped) da collection de locais.")
+    parser.add_argument("acao", choices=["exportar", "atualizar"])
+    parser.add_argument("--diretorio", default=DIRETORIO_SNAPSHOT)
+    parser.add_argument("--lote", type=int, default=TAMANHO_LOTE_SNAPSHOT, help="Documentos por lote.")
+    args = parser.parse_args()
+
+    executar = exportar if args.acao == "exportar" else atualizar
+    print(json.dumps(executar(args.diretorio, tamanho_lote=args.lote), indent=2))
@@ -0,0 +1,242 @@
+import math
+import threading
+
+import numpy as np
+
+# Raio da Terra usado pelo MongoDB nas consultas esféricas ($nearSphere com GeoJSON).
+# Usamos o mesmo valor para que o índice em memória devolva exatamente os mesmos locais.
+MONGO_RAIO_TERRA_KM = 6378.1
+
+# Aresta padrão (em km) das células da grade sobre a esfera unitária
+TAMANHO_CELULA_KM = 5.0
+
+
+def _para_esfera_unitaria(latitude, longitude):
+    """Converte (lat, lon) em graus para coordenadas cartesianas (x, y, z) na esfera unitária."""
+    lat = math.radians(latitude)
+    lon = math.radians(longitude)
+    cos_lat = math.cos(lat)
+    return cos_lat * math.cos(lon), cos_lat * math.sin(lon), math.sin(lat)
+
+
+class _DocumentosSnapshot:
+    """
+    Sequência de documentos de um snapshot colunar (montados sob demanda,
+    sem materializar todos os dicts) seguida dos adicionados depois.
+    """
+
+    def __init__(self, snapshot):
+        self._snapshot = snapshot
+        self._tamanho_snapshot = len(snapshot)
+        self._extras = []
+
+    def __len__(self):
+        return self._tamanho_snapshot + len(self._extras)
+
+    def __getitem__(self, indice):
+        if indice < self._tamanho_snapshot:
+            return self._snapshot.documento(indice)
+        return self._extras[indice - self._tamanho_snapshot]
+
+    def append(self, documento):
+        self._extras.append(documento)
+
+    def tem_id(self, indice, _id):
+        """Compara o '_id' da posição sem montar o documento (no snapshot, pelos 12 bytes do ObjectId)."""
+        if indice < self._tamanho_snapshot:
+            return self._snapshot.ids[indice].tobytes() == getattr(_id, "binary", None)
+        return self._extras[indice - self._tamanho_snapshot].get("_id") == _id
+
+
+class IndiceEspacial:
+    """
+    Índice espacial em memória para os documentos de 'locais_geo'.
+
+    Os pontos são projetados na esfera unitária (x, y, z) e distribuídos em
+    uma grade cúbica uniforme. Uma busca por raio visita apenas as células
+    que intersectam o cubo envolvente do círculo e refina os candidatos com
+    a distância angular exata, evitando os problemas de polos e do
+    antimeridiano de uma grade em (lat, lon).
+    """
+
+    def __init__(self, tamanho_celula_km=TAMANHO_CELULA_KM):
+        self._aresta = tamanho_celula_km / MONGO_RAIO_TERRA_KM
+        self._lock = threading.Lock()
+        self._documentos = []
+        # Pontos adicionados desde a última busca; são empilhados em _xyz_array sob demanda
+        self._xyz = []
+        self._xyz_array = np.empty((0, 3), dtype=np.float64)
+        self._celulas = {}
+        # Posições removidas (substituídas): saem das células, mas mantêm o lugar em _documentos/_xyz_array
+        self._removidos = set()
+
+    def __len__(self):
+        return len(self._documentos) - len(self._removidos)
+
+    def _celula(self, x, y, z):
+        return (math.floor(x / self._aresta), math.floor(y / self._aresta), math.floor(z / self._aresta))
+
+    def adicionar(self, documento):
+        """Adiciona um documento (com 'coordenadas.latitude/longitude') ao índice."""
+        coordenadas = documento.get("coordenadas", {})
+        latitude, longitude = coordenadas.get("latitude"), coordenadas.get("longitude")
+        if latitude is None or longitude is None:
+            return
+
+        xyz = _para_esfera_unitaria(latitude, longitude)
+        with self._lock:
+            self._celulas.setdefault(self._celula(*xyz), []).append(len(self._documentos))
+            self._documentos.append(documento)
+            self._xyz.append(xyz)
+
+    def adicionar_varios(self, documentos):
+        """Adiciona vários documentos de uma vez (ex: carga inicial da collection)."""
+        for documento in documentos:
+            self.adicionar(documento)
+
+    def _tem_id(self, posicao, _id):
+        if isinstance(self._documentos, _DocumentosSnapshot):
+            return self._documentos.tem_id(posicao, _id)
+        return self._documentos[posicao].get("_id") == _id
+
+    def remover(self, documento):
+        """
+        Remove o documento de mesmo '_id', procurado na célula das coordenadas
+        de `documento` (as que estão no índice) e, se não estiver nela, nas vizinhas.
+
+        Returns:
+            bool: True se o documento estava no índice.
+        """
+        coordenadas = documento.get("coordenadas", {})
+        latitude, longitude = coordenadas.get("latitude"), coordenadas.get("longitude")
+        if latitude is None or longitude is None or documento.get("_id") is None:
+            return False
+
+        i, j, k = self._celula(*_para_esfera_unitaria(latitude, longitude))
+        # As vizinhas cobrem diferenças de arredondamento entre a carga vetorizada (de_snapshot) e math
+        celulas = [(i, j, k)] + [(i + a, j + b, k + c) for a in (-1, 0, 1) for b in (-1, 0, 1) for c in (-1, 0, 1)
+                                 if (a, b, c) != (0, 0, 0)]
+        with self._lock:
+            for celula in celulas:
+                posicoes = self._celulas.get(celula, ())
+                for posicao in posicoes:
+                    if self._tem_id(posicao, documento["_id"]):
+                        posicoes.remove(posicao)
+                        self._removidos.add(posicao)
+                        return True
+        return False
+
+    def substituir(self, anterior, documento):
+        """Troca a versão `anterior` de um local (mesmo '_id') por `documento`, sem recarregar o índice."""
+        self.remover(anterior)
+        self.adicionar(documento)
+
+    @classmethod
+    def de_snapshot(cls, snapshot, tamanho_celula_km=TAMANHO_CELULA_KM):
+        """
+        Constrói o índice a partir das colunas de um snapshot_locais.SnapshotLocais,
+        de forma vetorizada e sem criar um dict por documento (os documentos
+        só são montados quando retornados por uma busca).
+        """
+        indice = cls(tamanho_celula_km)
+        latitudes = np.radians(np.asarray(snapshot.latitudes, dtype=np.float64))
+        longitudes = np.radians(np.asarray(snapshot.longitudes, dtype=np.float64))
+        cos_lat = np.cos(latitudes)
+        xyz = np.column_stack((cos_lat * np.cos(longitudes), cos_lat * np.sin(longitudes), np.sin(latitudes)))
+
+        if len(xyz):
+            # Agrupa as posições por célula: ordena pela célula e divide nos pontos de troca
+            celulas, grupo = np.unique(np.floor(xyz / indice._aresta).astype(np.int64), axis=0, return_inverse=True)
+            ordem = np.argsort(grupo.ravel(), kind="stable")
+            cortes = np.cumsum(np.bincount(grupo.ravel(), minlength=len(celulas)))[:-1]
+            indice._celulas = {tuple(celula): posicoes.tolist()
+                               for celula, posicoes in zip(celulas.tolist(), np.split(ordem, cortes))}
+
+        indice._documentos = _DocumentosSnapshot(snapshot)
+        indice._xyz_array = xyz
+        return indice
+
+    def buscar_em_raio(self, latitude_central, longitude_central, raio_km, pular=0, limite=None):
+        """
+        Retorna os documentos dentro de `raio_km` do ponto central, ordenados
+        da menor para a maior distância (mesma semântica do $nearSphere).
+        `pular` e `limite` paginam o resultado como skip/limit do MongoDB.
+
+        Returns:
+            list: Cópias rasas dos documentos encontrados.
+        """
+        indices, _ = self._buscar_indices(latitude_central, longitude_central, raio_km)
+        fim = None if limite is None else pular + limite
+        return [dict(self._documentos[i]) for i in indices[pular:fim]]
+
+    def buscar_com_distancia(self, latitude_central, longitude_central, raio_km, pular=0, limite=None,
+                             cidade=None):
+        """
+        Como buscar_em_raio(), mas filtra opcionalmente por `cidade` e inclui
+        em cada documento o campo 'distancia_km' (equivalente ao $geoNear).
+        """
+        indices, distancias = self._buscar_indices(latitude_central, longitude_central, raio_km)
+        pares = zip(indices, distancias.tolist())
+        if cidade is not None:
+            pares = ((i, d) for i, d in pares if self._documentos[i].get("cidade") == cidade)
+
+        fim = None if limite is None else pular + limite
+        return [dict(self._documentos[i], distancia_km=d) for i, d in list(pares)[pular:fim]]
+
+    def mais_proximos(self, latitude_central, longitude_central, k, cidade=None):
+        """
+        Retorna os `k` documentos mais próximos do ponto (opcionalmente apenas
+        da `cidade`), com 'distancia_km'. O raio de busca começa em uma
+        célula e é ampliado até encontrar `k` documentos ou cobrir a esfera.
+        """
+        raio_km = self._aresta * MONGO_RAIO_TERRA_KM
+        while True:
+            resultado = self.buscar_com_distancia(latitude_central, longitude_central, raio_km,
+                                                  limite=k, cidade=cidade)
+            if len(resultado) >= k or raio_km >= math.pi * MONGO_RAIO_TERRA_KM:
+                return resultado
+            raio_km *= 4
+
+    def _buscar_indices(self, latitude_central, longitude_central, raio_km):
+        """Retorna (índices ordenados por distância, distâncias em km)."""
+        with self._lock:
+            if not self._documentos:
+                return [], np.empty(0)
+            if self._xyz:
+                self._xyz_array = np.vstack((self._xyz_array, np.array(self._xyz, dtype=np.float64)))
+                self._xyz = []
+            xyz_array = self._xyz_array
+            centro = np.array(_para_esfera_unitaria(latitude_central, longitude_central))
+
+            # Corda equivalente ao raio (na esfera unitária) delimita o cubo envolvente
+            angulo_max = min(raio_km / MONGO_RAIO_TERRA_KM, math.pi)
+            corda = 2 * math.sin(angulo_max / 2)
+            minimo = self._celula(*(centro - corda))
+            maximo = self._celula(*(centro + corda))
+            total_celulas = (maximo[0] - minimo[0] + 1) * (maximo[1] - minimo[1] + 1) * (maximo[2] - minimo[2] + 1)
+
+            if total_celulas >= len(self._celulas):
+                # Raio grande: varrer as células ocupadas é mais barato que enumerar o cubo
+                candidatos = np.arange(len(self._documentos))
+                if self._removidos:
+                    candidatos = np.delete(candidatos, sorted(self._removidos))
+            else:
+                candidatos = []
+                for i in range(minimo[0], maximo[0] + 1):
+                    for j in range(minimo[1], maximo[1] + 1):
+                        for k in range(minimo[2], maximo[2] + 1):
+                            candidatos.extend(self._celulas.get((i, j, k), ()))
+                candidatos = np.array(sorted(candidatos), dtype=np.intp)
+
+        if len(candidatos) == 0:
+            return [], np.empty(0)
+
+        pontos = xyz_array[candidatos]
+        # Ângulo central exato via atan2(|a x b|, a . b), estável para distâncias pequenas
+        produto_vetorial = np.linalg.norm(np.cross(pontos, centro), axis=1)
+        angulos = np.arctan2(produto_vetorial, pontos @ centro)
+
+        dentro = angulos <= angulo_max
+        candidatos, angulos = candidatos[dentro], angulos[dentro]
+        ordem = np.argsort(angulos, kind="stable")
+        return candidatos[ordem].tolist(), angulos[ordem] * MONGO_RAIO_TERRA_KM
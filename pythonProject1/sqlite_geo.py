@@ -0,0 +1,307 @@
+import argparse
+import math
+from collections import Counter
+
+import numpy as np
+
+import database_setup
+import mongo_client
+import sqlite_pool
+from bulk_loader import montar_documento_local
+from spatial_index import MONGO_RAIO_TERRA_KM
+
+# Margem (graus) somada às caixas envolventes para absorver arredondamentos de ponto flutuante
+MARGEM_CAIXA_GRAUS = 1e-9
+
+_COLUNAS_LOCAL = "l.id, l.nome_local, l.cidade, l.latitude, l.longitude, l.descricao"
+_COLUNAS_CIDADE = "c.id, c.nome, c.estado, c.populacao"
+
+
+def caixas_envolventes(latitude_central, longitude_central, raio_km):
+    """
+    Retorna as caixas (lat_min, lat_max, lon_min, lon_max) que contêm o
+    círculo de `raio_km`. O círculo que cruza o antimeridiano gera duas
+    caixas; o que contém um polo cobre todas as longitudes.
+    """
+    angulo = raio_km / MONGO_RAIO_TERRA_KM
+    if angulo >= math.pi:
+        return [(-90.0, 90.0, -180.0, 180.0)]
+
+    delta_lat = math.degrees(angulo) + MARGEM_CAIXA_GRAUS
+    lat_min, lat_max = latitude_central - delta_lat, latitude_central + delta_lat
+    if lat_min <= -90 or lat_max >= 90:
+        return [(max(lat_min, -90.0), min(lat_max, 90.0), -180.0, 180.0)]
+
+    # Maior afastamento em longitude de um ponto do círculo (tangente ao meridiano)
+    delta_lon = math.degrees(math.asin(math.sin(angulo) / math.cos(math.radians(latitude_central))))
+    delta_lon += MARGEM_CAIXA_GRAUS
+    lon_min, lon_max = longitude_central - delta_lon, longitude_central + delta_lon
+    if lon_min < -180:
+        return [(lat_min, lat_max, lon_min + 360, 180.0), (lat_min, lat_max, -180.0, lon_max)]
+    if lon_max > 180:
+        return [(lat_min, lat_max, lon_min, 180.0), (lat_min, lat_max, -180.0, lon_max - 360)]
+    return [(lat_min, lat_max, lon_min, lon_max)]
+
+
+def _angulos_centrais(latitude_central, longitude_central, latitudes, longitudes):
+    """Ângulo central (rad) entre o centro e cada ponto, via atan2(|a x b|, a . b)."""
+    lat, lon = np.radians(latitudes), np.radians(longitudes)
+    pontos = np.column_stack((np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)))
+    lat_c, lon_c = math.radians(latitude_central), math.radians(longitude_central)
+    centro = np.array((math.cos(lat_c) * math.cos(lon_c), math.cos(lat_c) * math.sin(lon_c), math.sin(lat_c)))
+    return np.arctan2(np.linalg.norm(np.cross(pontos, centro), axis=1), pontos @ centro)
+
+
+def _poligonos(geometria):
+    """Lista de polígonos (cada um uma lista de anéis: exterior e buracos) de um Polygon/MultiPolygon."""
+    if geometria.get("type") == "Polygon":
+        return [geometria["coordinates"]]
+    if geometria.get("type") == "MultiPolygon":
+        return geometria["coordinates"]
+    raise ValueError(f"Geometria não suportada: {geometria.get('type')} (use Polygon ou MultiPolygon).")
+
+
+def _dentro_do_anel(longitudes, latitudes, anel):
+    """Teste ponto-no-polígono (raio horizontal, no plano lon/lat) para vários pontos de uma vez."""
+    dentro = np.zeros(len(longitudes), dtype=bool)
+    for (x1, y1), (x2, y2) in zip(anel, anel[1:]):
+        cruza = (y1 > latitudes) != (y2 > latitudes)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x_cruzamento = x1 + (latitudes - y1) * (x2 - x1) / (y2 - y1)
+        dentro ^= cruza & (longitudes < x_cruzamento)
+    return dentro
+
+
+def _inserir_locais(conn, documentos):
+    """Insere os documentos em LOCAIS_GEO e o ponto de cada um no R*Tree; retorna quantos foram gravados."""
+    gravados = 0
+    for documento in documentos:
+        coordenadas = documento.get("coordenadas", {})
+        latitude, longitude = coordenadas.get("latitude"), coordenadas.get("longitude")
+        if latitude is None or longitude is None:
+            continue
+        cursor = conn.execute(
+            "INSERT INTO LOCAIS_GEO (nome_local, cidade, latitude, longitude, descricao) VALUES (?, ?, ?, ?, ?)",
+            (documento.get("nome_local"), documento.get("cidade"), latitude, longitude, documento.get("descricao", "")))
+        # Ponto = caixa degenerada (min = max)
+        conn.execute("INSERT INTO LOCAIS_GEO_RTREE VALUES (?, ?, ?, ?, ?)",
+                     (cursor.lastrowid, latitude, latitude, longitude, longitude))
+        gravados += 1
+    return gravados
+
+
+class IndiceRTreeSQLite:
+    """
+    Backend geoespacial sobre o SQLite: os locais ficam na tabela LOCAIS_GEO
+    e os pontos na tabela virtual R*Tree LOCAIS_GEO_RTREE (criadas pelo
+    database_setup).
+
+    A busca por raio filtra pela caixa envolvente do círculo no R*Tree e
+    refina os candidatos com a distância de círculo máximo exata, usando o
+    mesmo raio da Terra do MongoDB. Os métodos têm o mesmo contrato do
+    IndiceEspacial (buscar_em_raio, buscar_com_distancia, mais_proximos).
+    """
+
+    def __init__(self, caminho_db):
+        self.caminho_db = caminho_db
+
+    def __len__(self):
+        with sqlite_pool.conexao(self.caminho_db) as conn:
+            return conn.execute("SELECT COUNT(*) FROM LOCAIS_GEO").fetchone()[0]
+
+    # --- Escrita ---
+    def adicionar(self, documento):
+        """Adiciona um documento de 'locais_geo' (com 'coordenadas.latitude/longitude')."""
+        self.adicionar_varios([documento])
+
+    def adicionar_varios(self, documentos):
+        """Adiciona vários documentos numa única transação; retorna quantos foram gravados."""
+        with sqlite_pool.conexao(self.caminho_db) as conn:
+            return _inserir_locais(conn, documentos)
+
+    def remover(self, nome_local, cidade):
+        """Remove o local (nome_local, cidade) de LOCAIS_GEO e do R*Tree; retorna quantos foram removidos."""
+        with sqlite_pool.conexao(self.caminho_db) as conn:
+            conn.execute("DELETE FROM LOCAIS_GEO_RTREE WHERE id IN "
+                         "(SELECT id FROM LOCAIS_GEO WHERE nome_local = ? AND cidade = ?)", (nome_local, cidade))
+            return conn.execute("DELETE FROM LOCAIS_GEO WHERE nome_local = ? AND cidade = ?",
+                                (nome_local, cidade)).rowcount
+
+    def sincronizar(self, collection):
+        """Substitui (numa única transação) o conteúdo das tabelas pelos documentos da collection do MongoDB."""
+        with sqlite_pool.conexao(self.caminho_db) as conn:
+            conn.execute("DELETE FROM LOCAIS_GEO_RTREE")
+            conn.execute("DELETE FROM LOCAIS_GEO")
+            return _inserir_locais(conn, collection.find({}, {"_id": False}))
+
+    # --- Consultas ---
+    @staticmethod
+    def sql_caixa(colunas=_COLUNAS_LOCAL, juncao="", com_cidade=False):
+        """SELECT das linhas numa caixa (lat_min, lat_max, lon_min, lon_max) via R*Tree, opcionalmente de uma cidade."""
+        sql = (f"SELECT {colunas} FROM LOCAIS_GEO_RTREE r JOIN LOCAIS_GEO l ON l.id = r.id {juncao} "
+               "WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ?")
+        return sql + " AND l.cidade = ?" if com_cidade else sql
+
+    def _linhas_nas_caixas(self, colunas, juncao, caixas, cidade=None):
+        """Linhas cujo ponto está em alguma das caixas (lat_min, lat_max, lon_min, lon_max), via R*Tree."""
+        sql = self.sql_caixa(colunas, juncao, cidade is not None)
+
+        linhas = []
+        with sqlite_pool.conexao(self.caminho_db) as conn:
+            for caixa in caixas:
+                linhas.extend(conn.execute(sql, tuple(caixa) + ((cidade,) if cidade is not None else ())))
+        return linhas
+
+    def _candidatos(self, colunas, juncao, latitude_central, longitude_central, raio_km, cidade=None):
+        """Linhas cujo ponto está nas caixas envolventes do círculo (pré-filtro do R*Tree)."""
+        return self._linhas_nas_caixas(colunas, juncao,
+                                       caixas_envolventes(latitude_central, longitude_central, raio_km), cidade)
+
+    def _refinar(self, linhas, latitude_central, longitude_central, raio_km):
+        """Mantém as linhas dentro do raio exato; retorna (linhas ordenadas por distância, distâncias em km)."""
+        if not linhas:
+            return [], []
+        angulos = _angulos_centrais(latitude_central, longitude_central,
+                                    [linha[3] for linha in linhas], [linha[4] for linha in linhas])
+        dentro = np.flatnonzero(angulos <= min(raio_km / MONGO_RAIO_TERRA_KM, math.pi))
+        ordem = dentro[np.argsort(angulos[dentro], kind="stable")]
+        return [linhas[i] for i in ordem], (angulos[ordem] * MONGO_RAIO_TERRA_KM).tolist()
+
+    @staticmethod
+    def _documento(linha):
+        _, nome_local, cidade, latitude, longitude, descricao = linha[:6]
+        return montar_documento_local(nome_local, cidade, latitude, longitude, descricao)
+
+    def buscar_em_raio(self, latitude_central, longitude_central, raio_km, pular=0, limite=None):
+        """
+        Retorna os documentos dentro de `raio_km` do ponto central, ordenados
+        da menor para a maior distância (mesma semântica do $nearSphere).
+        """
+        linhas, _ = self._refinar(self._candidatos(_COLUNAS_LOCAL, "", latitude_central, longitude_central, raio_km),
+                                  latitude_central, longitude_central, raio_km)
+        fim = None if limite is None else pular + limite
+        return [self._documento(linha) for linha in linhas[pular:fim]]
+
+    def buscar_com_distancia(self, latitude_central, longitude_central, raio_km, pular=0, limite=None,
+                             cidade=None):
+        """
+        Como buscar_em_raio(), mas filtra opcionalmente por `cidade` e inclui
+        em cada documento o campo 'distancia_km' (equivalente ao $geoNear).
+        """
+        linhas = self._candidatos(_COLUNAS_LOCAL, "", latitude_central, longitude_central, raio_km, cidade)
+        linhas, distancias = self._refinar(linhas, latitude_central, longitude_central, raio_km)
+        fim = None if limite is None else pular + limite
+        return [dict(self._documento(linha), distancia_km=distancia)
+                for linha, distancia in list(zip(linhas, distancias))[pular:fim]]
+
+    def mais_proximos(self, latitude_central, longitude_central, k, cidade=None, raio_inicial_km=5.0):
+        """
+        Retorna os `k` documentos mais próximos do ponto (opcionalmente apenas
+        da `cidade`), com 'distancia_km'. O raio é ampliado até encontrar `k`
+        documentos ou cobrir a esfera.
+        """
+        raio_km = raio_inicial_km
+        while True:
+            resultado = self.buscar_com_distancia(latitude_central, longitude_central, raio_km,
+                                                  limite=k, cidade=cidade)
+            if len(resultado) >= k or raio_km >= math.pi * MONGO_RAIO_TERRA_KM:
+                return resultado
+            raio_km *= 4
+
+    # --- Consultas por área e agregações ---
+    def _linhas_na_geometria(self, geometria):
+        """
+        Linhas de LOCAIS_GEO dentro de um Polygon/MultiPolygon GeoJSON: a
+        caixa de cada polígono filtra no R*Tree e o teste ponto-no-polígono
+        (exterior menos buracos) refina.
+        """
+        encontradas = {}
+        for aneis in _poligonos(geometria):
+            exterior = np.asarray(aneis[0], dtype=np.float64)
+            caixa = (exterior[:, 1].min(), exterior[:, 1].max(), exterior[:, 0].min(), exterior[:, 0].max())
+            linhas = self._linhas_nas_caixas(_COLUNAS_LOCAL, "", [caixa])
+            if not linhas:
+                continue
+            longitudes = np.array([linha[4] for linha in linhas])
+            latitudes = np.array([linha[3] for linha in linhas])
+            dentro = _dentro_do_anel(longitudes, latitudes, aneis[0])
+            for buraco in aneis[1:]:
+                dentro &= ~_dentro_do_anel(longitudes, latitudes, buraco)
+            for i in np.flatnonzero(dentro):
+                encontradas[linhas[i][0]] = linhas[i]
+        return [encontradas[id_local] for id_local in sorted(encontradas)]
+
+    def _todas_as_linhas(self):
+        with sqlite_pool.conexao(self.caminho_db) as conn:
+            return conn.execute(f"SELECT {_COLUNAS_LOCAL} FROM LOCAIS_GEO l").fetchall()
+
+    def buscar_em_poligono(self, geometria, limite=None):
+        """Documentos dentro de um Polygon/MultiPolygon GeoJSON (equivalente ao $geoWithin)."""
+        return [self._documento(linha) for linha in self._linhas_na_geometria(geometria)[:limite]]
+
+    def agregar_em_grade(self, tamanho_celula_graus, geometria=None, por_cidade=False):
+        """Mesmo resultado de geoprocessing_service.agregar_em_grade(), calculado sobre o SQLite."""
+        linhas = self._linhas_na_geometria(geometria) if geometria else self._todas_as_linhas()
+        if not linhas:
+            return []
+        celulas_lat = np.floor(np.array([linha[3] for linha in linhas]) / tamanho_celula_graus).astype(np.int64)
+        celulas_lon = np.floor(np.array([linha[4] for linha in linhas]) / tamanho_celula_graus).astype(np.int64)
+        cidades = [linha[2] for linha in linhas] if por_cidade else [None] * len(linhas)
+
+        contagem = Counter(zip(celulas_lat.tolist(), celulas_lon.tolist(), cidades))
+        resultado = []
+        for (celula_lat, celula_lon, cidade), total in contagem.most_common():
+            celula = {"latitude": (celula_lat + 0.5) * tamanho_celula_graus,
+                      "longitude": (celula_lon + 0.5) * tamanho_celula_graus, "total": total}
+            if por_cidade:
+                celula["cidade"] = cidade
+            resultado.append(celula)
+        return resultado
+
+    def contar_por_cidade(self, geometria=None):
+        """{cidade: total} dos locais (opcionalmente dentro de uma geometria), da maior para a menor contagem."""
+        if geometria:
+            return dict(Counter(linha[2] for linha in self._linhas_na_geometria(geometria)).most_common())
+        with sqlite_pool.conexao(self.caminho_db) as conn:
+            return dict(conn.execute("SELECT cidade, COUNT(*) AS total FROM LOCAIS_GEO GROUP BY cidade "
+                                     "ORDER BY total DESC").fetchall())
+
+    # --- Cruzamento com CIDADES numa única consulta SQL ---
+    def local_com_cidade(self, nome_local):
+        """
+        Retorna (documento, linha de CIDADES ou None) do primeiro local com
+        esse nome, ou None se o local não existir.
+        """
+        with sqlite_pool.conexao(self.caminho_db) as conn:
+            linha = conn.execute(f"SELECT {_COLUNAS_LOCAL}, {_COLUNAS_CIDADE} FROM LOCAIS_GEO l "
+                                 "LEFT JOIN CIDADES c ON c.nome = l.cidade WHERE l.nome_local = ? "
+                                 "ORDER BY l.id LIMIT 1", (nome_local,)).fetchone()
+        if linha is None:
+            return None
+        return self._documento(linha), (linha[6:] if linha[6] is not None else None)
+
+    def buscar_com_cidades_em_raio(self, latitude_central, longitude_central, raio_km):
+        """
+        Locais dentro do raio já cruzados com a tabela CIDADES (LEFT JOIN na
+        mesma consulta do R*Tree).
+
+        Returns:
+            list[tuple[dict, tuple | None]]: (documento com 'distancia_km', linha da cidade), por distância.
+        """
+        linhas = self._candidatos(f"{_COLUNAS_LOCAL}, {_COLUNAS_CIDADE}", "LEFT JOIN CIDADES c ON c.nome = l.cidade",
+                                  latitude_central, longitude_central, raio_km)
+        linhas, distancias = self._refinar(linhas, latitude_central, longitude_central, raio_km)
+        return [(dict(self._documento(linha), distancia_km=distancia), linha[6:] if linha[6] is not None else None)
+                for linha, distancia in zip(linhas, distancias)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Copia os locais do MongoDB para o backend R*Tree do SQLite.")
+    parser.add_argument("--sqlite", default=database_setup.SQLITE_DB)
+    args = parser.parse_args()
+
+    database_setup.SQLITE_DB = args.sqlite
+    database_setup.setup_sqlite()
+    collection = mongo_client.obter_colecao(database_setup.MONGO_URI, database_setup.DB_NAME,
+                                            database_setup.COLLECTION_NAME)
+    print(f"{IndiceRTreeSQLite(args.sqlite).sincronizar(collection)} locais copiados para '{args.sqlite}'.")
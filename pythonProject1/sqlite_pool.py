@@ -0,0 +1,116 @@
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# --- Configurações das Conexões SQLite (podem ser ajustadas por variáveis de ambiente) ---
+# Nível de durabilidade: OFF, NORMAL (recomendado com WAL) ou FULL
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+# Cache de páginas por conexão, em KiB (PRAGMA cache_size negativo = KiB)
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "16384"))
+# Tamanho máximo do arquivo mapeado em memória, em bytes (0 desativa)
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+# Tempo de espera por um lock de escrita antes de "database is locked", em segundos
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "5"))
+# Quantidade de comandos preparados mantidos em cache por conexão
+SQLITE_CACHED_STATEMENTS = int(os.getenv("SQLITE_CACHED_STATEMENTS", "256"))
+# Máximo de conexões ociosas mantidas por banco
+SQLITE_POOL_TAMANHO = int(os.getenv("SQLITE_POOL_TAMANHO", "8"))
+
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def _abrir_conexao(caminho_db):
+    """Abre uma conexão de longa duração com WAL e os PRAGMAs configurados."""
+    conn = sqlite3.connect(caminho_db, timeout=SQLITE_BUSY_TIMEOUT, check_same_thread=False,
+                           cached_statements=SQLITE_CACHED_STATEMENTS)
+    # WAL: leitores não bloqueiam o escritor (e vice-versa)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    return conn
+
+
+class PoolConexoesSQLite:
+    """
+    Pool de conexões reutilizáveis para um arquivo SQLite.
+
+    As conexões são criadas sob demanda e devolvidas ao pool após o uso,
+    de forma que o custo de conexão, os PRAGMAs e o cache de comandos
+    preparados sejam aproveitados entre chamadas e entre threads (ex:
+    sessões simultâneas do Streamlit).
+    """
+
+    def __init__(self, caminho_db, tamanho_max=SQLITE_POOL_TAMANHO):
+        self.caminho_db = caminho_db
+        self.tamanho_max = tamanho_max
+        self._livres = queue.LifoQueue()
+
+    def obter(self):
+        """Retira uma conexão ociosa do pool ou abre uma nova."""
+        try:
+            return self._livres.get_nowait()
+        except queue.Empty:
+            return _abrir_conexao(self.caminho_db)
+
+    def devolver(self, conn):
+        """Devolve a conexão ao pool (ou a fecha, se o pool estiver cheio)."""
+        if conn.in_transaction:
+            conn.rollback()
+        if self._livres.qsize() < self.tamanho_max:
+            self._livres.put(conn)
+        else:
+            conn.close()
+
+    def fechar(self):
+        """Fecha todas as conexões ociosas do pool."""
+        while True:
+            try:
+                self._livres.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def obter_pool(caminho_db):
+    """Retorna o pool compartilhado (por processo) do arquivo `caminho_db`."""
+    chave = os.path.abspath(caminho_db)
+    with _POOLS_LOCK:
+        if chave not in _POOLS:
+            _POOLS[chave] = PoolConexoesSQLite(caminho_db)
+        return _POOLS[chave]
+
+
+@contextmanager
+def conexao(caminho_db):
+    """
+    Empresta uma conexão do pool compartilhado.
+
+    Ao sair do bloco, uma transação aberta é confirmada (commit) ou,
+    em caso de exceção, desfeita (rollback), e a conexão volta ao pool.
+
+    Exemplo:
+        with sqlite_pool.conexao(SQLITE_DB) as conn:
+            conn.execute("SELECT ...")
+    """
+    pool = obter_pool(caminho_db)
+    conn = pool.obter()
+    try:
+        yield conn
+        if conn.in_transaction:
+            conn.commit()
+    except BaseException:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        pool.devolver(conn)
+
+
+def fechar_todas():
+    """Fecha as conexões ociosas de todos os pools (ex: ao encerrar o processo)."""
+    with _POOLS_LOCK:
+        for pool in _POOLS.values():
+            pool.fechar()
@@ -0,0 +1,407 @@
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import benchmark
+import buffer_locais
+import bulk_loader
+import database_setup
+import geoprocessing_service
+import metricas
+import mongo_client
+import sqlite_pool
+import visao_locais_cidades
+from query_cache import CacheConsultas
+
+# --- Configurações do Teste de Carga ---
+# Peso relativo de cada operação da interface no tráfego gerado
+MIX_PADRAO = {"cidades": 20, "locais_cidade": 30, "raio": 30, "cruzamento": 15, "insercao": 5}
+DURACAO_PADRAO_S = 30
+CONCORRENCIA_PADRAO = 8
+INTERVALO_SERIE_S = 1.0      # largura (segundos) de cada janela da série temporal
+AMOSTRA_LOCAIS = 5000        # locais lidos do banco para sortear nomes e centros das buscas
+MAX_RESULTADOS_RAIO = 200    # mesmo limite padrão da tela "Busca Geoespacial"
+# Mesmos limites do cache de leituras da interface (interface.LIMITES_CACHE_INTERFACE)
+LIMITES_CACHE_CARGA = {"locais_por_cidade": (128, 300), "busca_raio": (256, 120)}
+# Prefixo dos locais inseridos pelo teste (removidos ao final, exceto com --manter-insercoes)
+PREFIXO_INSERCAO = "Teste de Carga"
+DB_NAME_CARGA = "poliglota_geoproj_carga"
+
+
+# ----------------------------------------------------------------------
+# 1. Operações (os mesmos caminhos de leitura/escrita da interface)
+# ----------------------------------------------------------------------
+class OperacoesInterface:
+    """
+    Reproduz as chamadas que interface.py faz ao serviço em cada tela, sem
+    o Streamlit: listagem de cidades, locais da cidade, busca por raio,
+    cruzamento MongoDB + SQLite e inserção de locais (pelo buffer de escrita).
+    Cada operação sorteia os parâmetros de uma amostra dos dados do banco.
+    """
+
+    def __init__(self, amostra_locais=AMOSTRA_LOCAIS, raios_km=benchmark.RAIOS_KM, cache_interface=True,
+                 semente=benchmark.SEMENTE_PADRAO):
+        collection = mongo_client.obter_colecao(database_setup.MONGO_URI, database_setup.DB_NAME,
+                                                database_setup.COLLECTION_NAME)
+        locais = list(collection.find({}, {"_id": 0, "nome_local": 1, "cidade": 1, "coordenadas.latitude": 1,
+                                           "coordenadas.longitude": 1}).limit(amostra_locais))
+        if not locais:
+            raise ValueError("Nenhum local no MongoDB para sortear as consultas (use --sintetico).")
+
+        self.nomes_locais = [local["nome_local"] for local in locais]
+        self.centros = [(local["coordenadas"]["latitude"], local["coordenadas"]["longitude"], local["cidade"])
+                        for local in locais]
+        self.cidades = [linha[1] for linha in geoprocessing_service.CACHE_CIDADES.todas()]
+        self.raios_km = raios_km
+        self.cache = CacheConsultas(limites=LIMITES_CACHE_CARGA) if cache_interface else None
+        self.buffer = buffer_locais.obter_buffer_locais(cache_cidades=geoprocessing_service.CACHE_CIDADES,
+                                                        ao_gravar=self._invalidar_leituras)
+        self.inseridos = []
+        self._contador = itertools.count()
+        self._rng_local = threading.local()
+        self._semente = semente
+        self._sementes = itertools.count()
+
+    def _rng(self):
+        """Gerador por thread (np.random.Generator não é thread-safe), reprodutível pela semente."""
+        rng = getattr(self._rng_local, "rng", None)
+        if rng is None:
+            rng = self._rng_local.rng = np.random.default_rng([self._semente, next(self._sementes)])
+        return rng
+
+    def _sortear(self, valores):
+        return valores[int(self._rng().integers(len(valores)))]
+
+    def _em_cache(self, namespace, argumentos, carregar):
+        return self.cache.obter(namespace, argumentos, carregar) if self.cache is not None else carregar()
+
+    def _invalidar_leituras(self, gravados):
+        """Mesma invalidação seletiva da interface após cada lote do buffer de escrita."""
+        if self.cache is None:
+            return
+        for _, documento in gravados:
+            lat, lon = documento["coordenadas"]["latitude"], documento["coordenadas"]["longitude"]
+            self.cache.invalidar("locais_por_cidade", lambda argumentos: argumentos == (documento["cidade"],))
+            self.cache.invalidar("busca_raio", lambda argumentos: geoprocessing_service.distancia_km(
+                argumentos[0], argumentos[1], lat, lon) <= argumentos[2])
+
+    # --- Operações: retornam True se a resposta foi válida ---
+    def cidades_listadas(self):
+        return bool(geoprocessing_service.CACHE_CIDADES.todas())
+
+    def locais_cidade(self):
+        nome = self._sortear(self.cidades)
+
+        def carregar():
+            if visao_locais_cidades.VISAO_ATIVA:
+                return visao_locais_cidades.locais_da_cidade(nome)
+            collection = mongo_client.obter_colecao(database_setup.MONGO_URI, database_setup.DB_NAME,
+                                                    database_setup.COLLECTION_NAME)
+            return list(collection.find({"cidade": nome}, {"_id": 0}))
+
+        return isinstance(self._em_cache("locais_por_cidade", (nome,), carregar), list)
+
+    def raio(self):
+        latitude, longitude, _ = self._sortear(self.centros)
+        # Centros com a precisão dos campos da tela (4 casas), como os usuários os digitam
+        argumentos = (round(latitude, 4), round(longitude, 4), self._sortear(self.raios_km), MAX_RESULTADOS_RAIO)
+
+        def carregar():
+            return [local for lote in geoprocessing_service.iterar_locais_com_distancia(*argumentos[:3],
+                                                                                         limite=argumentos[3])
+                    for local in lote]
+
+        return isinstance(self._em_cache("busca_raio", argumentos, carregar), list)
+
+    def cruzamento(self):
+        return "erro" not in geoprocessing_service.cruzar_dados_local_cidade(self._sortear(self.nomes_locais))
+
+    def insercao(self):
+        latitude, longitude, cidade = self._sortear(self.centros)
+        deslocamento = self._rng().normal(0.0, 0.01, size=2)
+        documento = bulk_loader.montar_documento_local(
+            f"{PREFIXO_INSERCAO} {os.getpid()}-{next(self._contador)}", cidade,
+            float(np.clip(latitude + deslocamento[0], -90, 90)), float((longitude + deslocamento[1] + 180) % 360 - 180),
+            "Inserido pelo teste de carga.")
+        resultado = self.buffer.gravar(documento)
+        if resultado["status"] in ("inserido", "atualizado", "enviado"):
+            self.inseridos.append((documento["nome_local"], cidade))
+        return resultado["status"] not in ("rejeitado", "erro")
+
+    def funcoes(self):
+        return {"cidades": self.cidades_listadas, "locais_cidade": self.locais_cidade, "raio": self.raio,
+                "cruzamento": self.cruzamento, "insercao": self.insercao}
+
+    def remover_inseridos(self):
+        """Remove os locais inseridos pelo teste (collection, visão e, no backend "sqlite", o R*Tree)."""
+        self.buffer.descarregar()
+        if not self.inseridos:
+            return 0
+        filtro = {"nome_local": {"$regex": f"^{PREFIXO_INSERCAO} {os.getpid()}-"}}
+        db = mongo_client.obter_cliente(database_setup.MONGO_URI)[database_setup.DB_NAME]
+        removidos = db[database_setup.COLLECTION_NAME].delete_many(filtro).deleted_count
+        db[visao_locais_cidades.COLLECTION_VISAO].delete_many(filtro)
+        if geoprocessing_service.GEO_BACKEND == "sqlite":
+            indice = geoprocessing_service.obter_indice_sqlite()
+            for nome, cidade in self.inseridos:
+                indice.remover(nome, cidade)
+        return removidos
+
+
+# ----------------------------------------------------------------------
+# 2. Geração de carga (laço fechado ou chegadas de Poisson)
+# ----------------------------------------------------------------------
+def _executar_medindo(funcao, operacao, chegada, inicio_teste, registros):
+    """Executa a operação e guarda (operação, fim relativo ao início, latência desde a chegada, ok)."""
+    try:
+        ok = funcao()
+    except Exception as e:
+        print(f"ERRO: {operacao}: {e}", file=sys.stderr)
+        ok = False
+    fim = time.perf_counter()
+    registros.append((operacao, fim - inicio_teste, fim - chegada, ok))
+
+
+def gerar_carga(operacoes, mix=None, concorrencia=CONCORRENCIA_PADRAO, duracao_s=DURACAO_PADRAO_S, taxa=None,
+                intervalo_s=INTERVALO_SERIE_S, semente=benchmark.SEMENTE_PADRAO):
+    """
+    Dispara as operações sorteadas pelo `mix` durante `duracao_s` segundos.
+
+    Sem `taxa`, roda em laço fechado: `concorrencia` usuários, cada um
+    emendando uma operação na outra (mede a vazão máxima). Com `taxa`
+    (operações/s), as chegadas seguem um processo de Poisson atendido por
+    `concorrencia` threads: a latência é medida desde a chegada, então a
+    espera na fila aparece quando o sistema satura.
+
+    Returns:
+        dict: Resumo geral, por operação e a série temporal por janela de `intervalo_s`.
+    """
+    mix = mix or MIX_PADRAO
+    funcoes = operacoes.funcoes()
+    nomes = [nome for nome in mix if mix[nome] > 0]
+    probabilidades = np.array([mix[nome] for nome in nomes], dtype=np.float64)
+    probabilidades /= probabilidades.sum()
+    rng = np.random.default_rng(semente)
+    registros = []  # list.append é atômico: dispensa lock entre as threads
+    erros_antes = _erros_tratados()
+
+    inicio = time.perf_counter()
+    limite = inicio + duracao_s
+    if taxa is None:
+        def usuario(indice):
+            rng_usuario = np.random.default_rng([semente, indice])
+            while time.perf_counter() < limite:
+                operacao = nomes[rng_usuario.choice(len(nomes), p=probabilidades)]
+                _executar_medindo(funcoes[operacao], operacao, time.perf_counter(), inicio, registros)
+
+        with ThreadPoolExecutor(max_workers=concorrencia) as executor:
+            list(executor.map(usuario, range(concorrencia)))
+    else:
+        with ThreadPoolExecutor(max_workers=concorrencia) as executor:
+            chegada = inicio
+            while True:
+                chegada += rng.exponential(1.0 / taxa)
+                if chegada >= limite:
+                    break
+                espera = chegada - time.perf_counter()
+                if espera > 0:
+                    time.sleep(espera)
+                operacao = nomes[rng.choice(len(nomes), p=probabilidades)]
+                executor.submit(_executar_medindo, funcoes[operacao], operacao, chegada, inicio, registros)
+    total_s = time.perf_counter() - inicio
+
+    return {
+        "resumo": _resumir_registros(registros, total_s),
+        "por_operacao": {nome: _resumir_registros([r for r in registros if r[0] == nome], total_s)
+                         for nome in nomes},
+        "serie_temporal": _serie_temporal(registros, intervalo_s),
+        "erros_tratados": _erros_tratados() - erros_antes,
+    }
+
+
+def _erros_tratados():
+    """Erros que o serviço trata e converte em resposta vazia (contados em metricas)."""
+    return sum(resumo["erros"] for resumo in metricas.exportar().values())
+
+
+def _resumir_registros(registros, total_s):
+    if not registros:
+        return {"chamadas": 0, "erros": 0, "taxa_erro": 0.0}
+    resumo = benchmark._resumir([r[2] for r in registros], total_s)
+    resumo["erros"] = sum(1 for r in registros if not r[3])
+    resumo["taxa_erro"] = round(resumo["erros"] / len(registros), 4)
+    return resumo
+
+
+def _serie_temporal(registros, intervalo_s):
+    """Vazão, percentis de latência e taxa de erro de cada janela (pelo instante de término)."""
+    if not registros:
+        return []
+    fins = np.array([r[1] for r in registros])
+    latencias_ms = np.array([r[2] for r in registros]) * 1000
+    erros = np.array([not r[3] for r in registros])
+    janelas = (fins // intervalo_s).astype(np.int64)
+    serie = []
+    for janela in range(int(janelas.max()) + 1):
+        na_janela = janelas == janela
+        quantidade = int(np.count_nonzero(na_janela))
+        ponto = {"inicio_s": round(janela * intervalo_s, 3), "operacoes": quantidade,
+                 "ops_por_segundo": round(quantidade / intervalo_s, 1)}
+        if quantidade:
+            p50, p95, p99 = np.percentile(latencias_ms[na_janela], [50, 95, 99])
+            ponto.update(p50_ms=round(float(p50), 3), p95_ms=round(float(p95), 3), p99_ms=round(float(p99), 3),
+                         taxa_erro=round(float(erros[na_janela].mean()), 4))
+        serie.append(ponto)
+    return serie
+
+
+def serie_texto(serie):
+    linhas = [f"{'t (s)':>7}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'erros':>8}"]
+    for ponto in serie:
+        linhas.append(f"{ponto['inicio_s']:>7.0f}{ponto['ops_por_segundo']:>10.1f}{ponto.get('p50_ms', 0):>10.2f}"
+                      f"{ponto.get('p95_ms', 0):>10.2f}{ponto.get('p99_ms', 0):>10.2f}"
+                      f"{100 * ponto.get('taxa_erro', 0):>7.1f}%")
+    return "\n".join(linhas)
+
+
+# ----------------------------------------------------------------------
+# 3. Execução
+# ----------------------------------------------------------------------
+def _preparar_bancos_sinteticos(mongo_uri, quantidade_locais, quantidade_cidades, semente):
+    """Bancos dedicados com os dados sintéticos do benchmark (não toca nos dados reais)."""
+    sqlite_db = os.path.join(tempfile.mkdtemp(prefix="carga_poliglota_"), "carga.db")
+    benchmark._apontar_para_bancos(mongo_uri, DB_NAME_CARGA, sqlite_db)
+    # O teste mede os caches também (o benchmark os desativa para medir o backend)
+    geoprocessing_service.CACHE_RAIOS.ativo = os.getenv("CACHE_RAIO", "1") != "0"
+    collection = mongo_client.obter_colecao(mongo_uri, DB_NAME_CARGA, database_setup.COLLECTION_NAME)
+    collection.database.client.drop_database(DB_NAME_CARGA)
+
+    with contextlib.redirect_stdout(sys.stderr):
+        database_setup.garantir_bancos_configurados()
+    cidades = benchmark.gerar_cidades(quantidade_cidades, semente)
+    with sqlite_pool.conexao(sqlite_db) as conn:
+        conn.executemany("INSERT OR IGNORE INTO CIDADES (nome, estado, populacao) VALUES (?, ?, ?)",
+                         [(c["nome"], c["estado"], c["populacao"]) for c in cidades])
+    locais = list(benchmark.gerar_locais(quantidade_locais, cidades, semente))
+    for inicio in range(0, len(locais), bulk_loader.TAMANHO_LOTE_MONGO):
+        bulk_loader._inserir_lote_mongo(collection, locais[inicio:inicio + bulk_loader.TAMANHO_LOTE_MONGO])
+    if visao_locais_cidades.VISAO_ATIVA:
+        visao_locais_cidades.reconstruir()
+    if geoprocessing_service.GEO_BACKEND == "sqlite":
+        geoprocessing_service.obter_indice_sqlite().adicionar_varios(locais)
+
+
+def executar(mix=None, concorrencia=CONCORRENCIA_PADRAO, duracao_s=DURACAO_PADRAO_S, taxa=None,
+             intervalo_s=INTERVALO_SERIE_S, cache_interface=True, sintetico=None, mongo_uri=database_setup.MONGO_URI,
+             em_processo=False, backend_geo=None, manter_insercoes=False, semente=benchmark.SEMENTE_PADRAO):
+    """
+    Prepara os bancos, gera a carga e devolve o relatório.
+
+    Args:
+        sintetico (tuple, opcional): (locais, cidades) para usar bancos dedicados com dados
+            sintéticos; sem ele, a carga vai para os bancos configurados (database_setup).
+
+    Returns:
+        dict: Configuração, resultados de gerar_carga() e estatísticas dos caches.
+    """
+    ignoradas = []
+    if em_processo:
+        benchmark._usar_substituto_em_processo(mongo_uri)
+        # As inserções passam pelo buffer (upsert em bulk_write), que o mongomock não suporta
+        mix = dict(mix or MIX_PADRAO)
+        if mix.pop("insercao", 0) > 0:
+            ignoradas.append("insercao")
+            print("AVISO: operação 'insercao' ignorada com --em-processo (o mongomock não suporta upsert em "
+                  "bulk_write).", file=sys.stderr)
+        if not mix:
+            sys.exit("Nenhuma operação restante no mix para o modo --em-processo.")
+    if backend_geo:
+        geoprocessing_service.GEO_BACKEND = backend_geo
+    if sintetico:
+        _preparar_bancos_sinteticos(mongo_uri, *sintetico, semente)
+    else:
+        # Mesmos bancos, possivelmente com outras opções de conexão na URI (ex: maxPoolSize)
+        for modulo in (database_setup, geoprocessing_service, bulk_loader, buffer_locais, visao_locais_cidades):
+            modulo.MONGO_URI = mongo_uri
+        with contextlib.redirect_stdout(sys.stderr):
+            database_setup.garantir_bancos_configurados()
+
+    metricas.ativar()
+    operacoes = OperacoesInterface(cache_interface=cache_interface, semente=semente)
+    if geoprocessing_service.GEO_BACKEND == "memoria":
+        geoprocessing_service.obter_indice_memoria()  # a carga do índice não entra na medição
+
+    resultado = {
+        "configuracao": {
+            "mix": mix or MIX_PADRAO, "operacoes_ignoradas": ignoradas, "concorrencia": concorrencia,
+            "duracao_s": duracao_s,
+            "taxa_chegada": taxa, "modo": "laço fechado" if taxa is None else "chegadas de Poisson",
+            "cache_interface": cache_interface, "backend_geo": geoprocessing_service.GEO_BACKEND,
+            "bancos": "sintéticos" if sintetico else "configurados",
+            "sqlite_pool": sqlite_pool.SQLITE_POOL_TAMANHO,
+        },
+        **gerar_carga(operacoes, mix, concorrencia, duracao_s, taxa, intervalo_s, semente),
+        "caches": {
+            "cidades": geoprocessing_service.CACHE_CIDADES.estatisticas(),
+            "raios": geoprocessing_service.CACHE_RAIOS.estatisticas(),
+            "interface": operacoes.cache.estatisticas() if operacoes.cache is not None else None,
+        },
+    }
+    if not sintetico and not manter_insercoes:
+        resultado["locais_inseridos_removidos"] = operacoes.remover_inseridos()
+    return resultado
+
+
+def _ler_mix(texto):
+    """'raio=50,cruzamento=50' -> {'raio': 50.0, 'cruzamento': 50.0}."""
+    mix = {}
+    for parte in texto.split(","):
+        nome, _, peso = parte.partition("=")
+        if nome.strip() not in MIX_PADRAO:
+            raise argparse.ArgumentTypeError(f"Operação desconhecida '{nome}' (use: {', '.join(MIX_PADRAO)}).")
+        mix[nome.strip()] = float(peso)
+    return mix
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Teste de carga com o tráfego misto da interface.")
+    parser.add_argument("--mix", type=_ler_mix, help="Pesos das operações, ex: cidades=20,raio=50,insercao=5 "
+                                                     f"(padrão: {MIX_PADRAO}).")
+    parser.add_argument("--concorrencia", type=int, default=CONCORRENCIA_PADRAO, help="Usuários/threads simultâneos.")
+    parser.add_argument("--duracao", type=float, default=DURACAO_PADRAO_S, help="Segundos de carga.")
+    parser.add_argument("--taxa", type=float, help="Chegadas por segundo (Poisson); padrão: laço fechado.")
+    parser.add_argument("--intervalo", type=float, default=INTERVALO_SERIE_S, help="Janela da série temporal (s).")
+    parser.add_argument("--sem-cache-interface", action="store_true",
+                        help="Desliga o cache de leituras da interface (mede o serviço e os bancos).")
+    parser.add_argument("--sintetico", type=int, nargs=2, metavar=("LOCAIS", "CIDADES"),
+                        help="Usa bancos dedicados com dados sintéticos em vez dos bancos configurados.")
+    parser.add_argument("--mongo-uri", default=database_setup.MONGO_URI,
+                        help="Ex: mongodb://localhost:27017/?maxPoolSize=20 para testar o pool de conexões.")
+    parser.add_argument("--em-processo", action="store_true",
+                        help="Usa mongomock no lugar de um mongod local (requer o pacote mongomock).")
+    parser.add_argument("--backend-geo", choices=["mongo", "memoria", "sqlite"])
+    parser.add_argument("--manter-insercoes", action="store_true",
+                        help="Não remove os locais inseridos pelo teste dos bancos configurados.")
+    parser.add_argument("--semente", type=int, default=benchmark.SEMENTE_PADRAO)
+    parser.add_argument("--saida", help="Arquivo JSON com o relatório completo.")
+    args = parser.parse_args()
+
+    relatorio = executar(args.mix, args.concorrencia, args.duracao, args.taxa, args.intervalo,
+                         not args.sem_cache_interface, args.sintetico, args.mongo_uri, args.em_processo,
+                         args.backend_geo, args.manter_insercoes, args.semente)
+
+    print(serie_texto(relatorio["serie_temporal"]))
+    print(json.dumps({"resumo": relatorio["resumo"], "erros_tratados": relatorio["erros_tratados"]},
+                     indent=2, ensure_ascii=False))
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as arquivo:
+            json.dump(relatorio, arquivo, indent=2, ensure_ascii=False, default=str)
@@ -0,0 +1,241 @@
+import argparse
+import json
+import os
+import sqlite3
+import time
+
+from pymongo import ReplaceOne, UpdateMany
+from pymongo.errors import PyMongoError
+
+import metricas
+import mongo_client
+import sqlite_pool
+from database_setup import MONGO_URI, DB_NAME, COLLECTION_NAME, SQLITE_DB, COLLECTION_VERSOES, criar_indices_mongodb
+
+# --- Configurações da Visão Materializada ---
+# Collection com cada local de COLLECTION_NAME e a sua cidade do SQLite embutida em 'cidade_info'
+COLLECTION_VISAO = "locais_com_cidade"
+# Incremente ao mudar o formato dos documentos da visão: ela será reconstruída uma vez
+VERSAO_VISAO = 1
+# Liga/desliga as leituras pela visão (VISAO_LOCAIS_CIDADES=0 volta ao cruzamento em tempo de leitura)
+VISAO_ATIVA = os.getenv("VISAO_LOCAIS_CIDADES", "1") != "0"
+# Documentos por lote na reconstrução completa
+TAMANHO_LOTE_VISAO = 5000
+
+# Máximo de parâmetros por "IN (...)" (abaixo do limite histórico de 999 do SQLite)
+_TAMANHO_LOTE_IN = 900
+
+
+def _colecao_visao():
+    return mongo_client.obter_colecao(MONGO_URI, DB_NAME, COLLECTION_VISAO)
+
+
+# ----------------------------------------------------------------------
+# 1. Conversão entre linhas de CIDADES e o campo embutido 'cidade_info'
+# ----------------------------------------------------------------------
+def cidade_embutida(linha):
+    """Converte uma linha (id, nome, estado, populacao) de CIDADES no subdocumento 'cidade_info'."""
+    if linha is None:
+        return None
+    return {"id": linha[0], "nome": linha[1], "estado": linha[2], "populacao": linha[3]}
+
+
+def linha_cidade(cidade_info):
+    """Operação inversa de cidade_embutida(): volta ao formato de "SELECT * FROM CIDADES"."""
+    if not cidade_info:
+        return None
+    return cidade_info["id"], cidade_info["nome"], cidade_info["estado"], cidade_info["populacao"]
+
+
+def _cidades_por_nome(conn, nomes):
+    """Retorna {nome: linha} das cidades existentes, em lotes de SELECT ... WHERE nome IN (...)."""
+    nomes = [nome for nome in set(nomes) if nome is not None]
+    encontradas = {}
+    for inicio in range(0, len(nomes), _TAMANHO_LOTE_IN):
+        lote = nomes[inicio:inicio + _TAMANHO_LOTE_IN]
+        marcadores = ", ".join("?" * len(lote))
+        for linha in conn.execute(f"SELECT * FROM CIDADES WHERE nome IN ({marcadores})", lote):
+            encontradas[linha[1]] = linha
+    return encontradas
+
+
+def _enriquecer(conn, documentos):
+    """Cópias dos documentos com 'cidade_info' (None se a cidade não existir no SQLite)."""
+    cidades = _cidades_por_nome(conn, [documento.get("cidade") for documento in documentos])
+    return [dict(documento, cidade_info=cidade_embutida(cidades.get(documento.get("cidade"))))
+            for documento in documentos]
+
+
+# ----------------------------------------------------------------------
+# 2. Reconstrução completa (backfill)
+# ----------------------------------------------------------------------
+def reconstruir(tamanho_lote=TAMANHO_LOTE_VISAO):
+    """
+    Reconstrói a visão a partir de toda a collection de locais. Os
+    documentos são gravados numa collection temporária, que substitui a
+    visão (rename) só no final: as leituras nunca veem uma visão parcial.
+
+    Returns:
+        dict: Documentos gravados e tempo gasto.
+    """
+    inicio = time.perf_counter()
+    db = mongo_client.obter_cliente(MONGO_URI)[DB_NAME]
+    temporaria = db[COLLECTION_VISAO + "_reconstrucao"]
+    temporaria.drop()
+
+    total = 0
+    with sqlite_pool.conexao(SQLITE_DB) as conn:
+        lote = []
+        for documento in db[COLLECTION_NAME].find({}, batch_size=tamanho_lote):
+            lote.append(documento)
+            if len(lote) >= tamanho_lote:
+                temporaria.insert_many(_enriquecer(conn, lote), ordered=False)
+                total += len(lote)
+                lote = []
+        if lote:
+            temporaria.insert_many(_enriquecer(conn, lote), ordered=False)
+            total += len(lote)
+
+    if total:
+        # Mesmos índices da collection de origem (a visão atende as mesmas consultas)
+        criar_indices_mongodb(temporaria)
+        temporaria.rename(COLLECTION_VISAO, dropTarget=True)
+    else:
+        db[COLLECTION_VISAO].drop()
+
+    db[COLLECTION_VERSOES].update_one({"_id": COLLECTION_VISAO}, {"$set": {"versao": VERSAO_VISAO}}, upsert=True)
+    return {"documentos": total, "segundos": round(time.perf_counter() - inicio, 3)}
+
+
+def garantir_visao():
+    """
+    Reconstrói a visão apenas se ela nunca foi construída ou se está numa
+    versão anterior a VERSAO_VISAO (nas demais vezes, uma única leitura).
+
+    Returns:
+        bool: True se a visão foi reconstruída.
+    """
+    if not VISAO_ATIVA:
+        return False
+    registro = mongo_client.obter_cliente(MONGO_URI)[DB_NAME][COLLECTION_VERSOES].find_one({"_id": COLLECTION_VISAO})
+    if registro and registro.get("versao", 0) >= VERSAO_VISAO:
+        return False
+
+    print(f"Construindo a visão '{COLLECTION_VISAO}'...")
+    print(f"Visão construída: {reconstruir()}")
+    return True
+
+
+# ----------------------------------------------------------------------
+# 3. Manutenção incremental (após as escritas)
+# ----------------------------------------------------------------------
+def registrar_locais(documentos):
+    """
+    Copia para a visão locais recém-inseridos na collection de origem (os
+    documentos precisam do '_id' atribuído na inserção). Falhas não
+    interrompem a escrita principal: a próxima reconstrução corrige a visão.
+
+    Returns:
+        int: Documentos gravados na visão.
+    """
+    if not VISAO_ATIVA or not documentos:
+        return 0
+    try:
+        with sqlite_pool.conexao(SQLITE_DB) as conn:
+            enriquecidos = _enriquecer(conn, documentos)
+        resultado = _colecao_visao().bulk_write(
+            [ReplaceOne({"_id": documento["_id"]}, documento, upsert=True) for documento in enriquecidos],
+            ordered=False)
+        return resultado.upserted_count + resultado.modified_count
+    except (PyMongoError, sqlite3.Error) as e:
+        print(f"AVISO: visão '{COLLECTION_VISAO}' não atualizada (reconstrua com visao_locais_cidades.py). Erro: {e}")
+        metricas.registrar_erro("visao.registrar_locais", "mongodb")
+        return 0
+
+
+def registrar_local(documento):
+    """Atalho para registrar_locais([documento])."""
+    return registrar_locais([documento])
+
+
+def registrar_cidades(nomes):
+    """
+    Atualiza 'cidade_info' dos locais das cidades inseridas (ou alteradas)
+    no SQLite, com um UpdateMany por cidade num único bulk_write.
+
+    Returns:
+        int: Documentos da visão alterados.
+    """
+    if not VISAO_ATIVA or not nomes:
+        return 0
+    try:
+        with sqlite_pool.conexao(SQLITE_DB) as conn:
+            cidades = _cidades_por_nome(conn, nomes)
+        if not cidades:
+            return 0
+        resultado = _colecao_visao().bulk_write(
+            [UpdateMany({"cidade": nome}, {"$set": {"cidade_info": cidade_embutida(linha)}})
+             for nome, linha in cidades.items()], ordered=False)
+        return resultado.modified_count
+    except (PyMongoError, sqlite3.Error) as e:
+        print(f"AVISO: visão '{COLLECTION_VISAO}' não atualizada (reconstrua com visao_locais_cidades.py). Erro: {e}")
+        metricas.registrar_erro("visao.registrar_cidades", "mongodb")
+        return 0
+
+
+def registrar_cidade(nome):
+    """Atalho para registrar_cidades([nome])."""
+    return registrar_cidades([nome])
+
+
+def registrar_troca_de_cidade(ids, nome_cidade):
+    """
+    Aplica à visão a troca de cidade de locais já existentes (ex: correções
+    de atribuicao_cidades.py): 'cidade' e 'cidade_info' num único UpdateMany.
+
+    Returns:
+        int: Documentos da visão alterados.
+    """
+    if not VISAO_ATIVA or not ids:
+        return 0
+    try:
+        with sqlite_pool.conexao(SQLITE_DB) as conn:
+            linha = _cidades_por_nome(conn, [nome_cidade]).get(nome_cidade)
+        resultado = _colecao_visao().update_many(
+            {"_id": {"$in": list(ids)}},
+            {"$set": {"cidade": nome_cidade, "cidade_info": cidade_embutida(linha) if linha else None}})
+        return resultado.modified_count
+    except (PyMongoError, sqlite3.Error) as e:
+        print(f"AVISO: visão '{COLLECTION_VISAO}' não atualizada (reconstrua com visao_locais_cidades.py). Erro: {e}")
+        metricas.registrar_erro("visao.registrar_troca_de_cidade", "mongodb")
+        return 0
+
+
+# ----------------------------------------------------------------------
+# 4. Leituras
+# ----------------------------------------------------------------------
+def local_com_cidade(nome_local):
+    """
+    Lê um local e a sua cidade numa única consulta à visão.
+
+    Returns:
+        tuple | None: (documento sem '_id'/'cidade_info', linha da cidade ou None),
+        ou None se o local não estiver na visão.
+    """
+    documento = _colecao_visao().find_one({"nome_local": nome_local}, {"_id": False})
+    if documento is None:
+        return None
+    return documento, linha_cidade(documento.pop("cidade_info", None))
+
+
+def locais_da_cidade(nome_cidade, projecao=None):
+    """Documentos da visão de uma cidade (com 'cidade_info'), sem o '_id'."""
+    return list(_colecao_visao().find({"cidade": nome_cidade}, {"_id": False, **(projecao or {})}))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=f"Reconstrói a visão materializada '{COLLECTION_VISAO}'.")
+    parser.add_argument("--lote", type=int, default=TAMANHO_LOTE_VISAO, help="Documentos por lote.")
+    args = parser.parse_args()
+
+    print(json.dumps(reconstruir(args.lote), indent=2))